@@ -1,11 +1,22 @@
+import logging
+import os
+import time
+
 from django import forms
+from django.conf import settings
 from django.contrib import admin, messages
+from django.utils import timezone
 from django.utils.html import format_html
 from django.contrib.auth.admin import UserAdmin as DefaultUserAdmin
 from django.utils.safestring import mark_safe
+from django.http import StreamingHttpResponse
 
+from ufo_shop import invoice_pdf
+from ufo_shop.management.pool import render_invoices
 from ufo_shop.models import *
-from ufo_shop.utils.emailing import send_order_confirmation_email
+from ufo_shop.utils.emailing import queue_order_confirmation_email
+
+logger = logging.getLogger(__name__)
 
 
 @admin.register(User)
@@ -139,20 +150,10 @@ class OrderAdmin(admin.ModelAdmin):
     _items_link.short_description = 'Items'
 
     def resend_confirmation_email(self, request, queryset):
-
-        sent = 0
-        errors = []
+        # Sent by `manage.py run_worker`; see the Outgoing emails admin for delivery
         for order in queryset:
-            try:
-                send_order_confirmation_email(order, request=request)
-                sent += 1
-            except Exception as e:
-                errors.append((order.id, str(e)))
-
-        if sent:
-            self.message_user(request, f"Resent confirmation email for {sent} order(s).", level=messages.SUCCESS)
-        if errors:
-            self.message_user(request, f"Errors for {len(errors)} order(s): " + ", ".join([f"#{oid}: {err}" for oid, err in errors]), level=messages.ERROR)
+            queue_order_confirmation_email(order, request=request, resend=True)
+        self.message_user(request, f"Queued confirmation email for {queryset.count()} order(s).", level=messages.SUCCESS)
 
     resend_confirmation_email.short_description = 'Resend confirmation email'
 
@@ -170,8 +171,9 @@ class PictureAdmin(admin.ModelAdmin):
         'original_image_preview',
         'thumbnail_preview',
         'square_image_preview',
+        'derivatives_status',
     )
-    list_filter = ('item', 'user')
+    list_filter = ('item', 'user', 'derivatives_status')
     search_fields = (
         'item__name',
         'user__username',
@@ -193,7 +195,7 @@ class PictureAdmin(admin.ModelAdmin):
         'thumbnail_preview_inline',
         'square_image_preview_inline',
     )
-    actions = ['create_thumbnail_action', 'create_square_image_action']
+    actions = ['regenerate_derivatives_action']
 
     def get_queryset(self, request):
         # Eager load related item and user to prevent N+1 queries
@@ -270,44 +272,14 @@ class PictureAdmin(admin.ModelAdmin):
 
     user_link_inline.short_description = 'Uploaded By'
 
-    def create_thumbnail_action(self, request, queryset):
-        processed_count = 0
-        for picture in queryset:
-            try:
-                # Assuming your Picture model has a method 'generate_thumbnail'
-                picture.generate_thumbnail()
-                processed_count += 1
-            except AttributeError:
-                self.message_user(request, f"Picture object {picture.id} does not have a 'generate_thumbnail' method.",
-                                  messages.ERROR)
-                return
-            except Exception as e:
-                self.message_user(request, f"Error generating thumbnail for {picture.id}: {e}", messages.ERROR)
-        if processed_count > 0:
-            self.message_user(request, f"Successfully generated thumbnails for {processed_count} pictures.",
-                              messages.SUCCESS)
-
-    create_thumbnail_action.short_description = "Create Thumbnail(s)"
-
-    def create_square_image_action(self, request, queryset):
-        processed_count = 0
-        for picture in queryset:
-            try:
-                # Assuming your Picture model has a method 'generate_square_image'
-                picture.generate_square_image()
-                processed_count += 1
-            except AttributeError:
-                self.message_user(request,
-                                  f"Picture object {picture.id} does not have a 'generate_square_image' method.",
-                                  messages.ERROR)
-                return
-            except Exception as e:
-                self.message_user(request, f"Error generating square image for {picture.id}: {e}", messages.ERROR)
-        if processed_count > 0:
-            self.message_user(request, f"Successfully generated square images for {processed_count} pictures.",
-                              messages.SUCCESS)
-
-    create_square_image_action.short_description = "Create Square Image(s)"
+    def regenerate_derivatives_action(self, request, queryset):
+        # Processing happens in `manage.py run_worker` / `manage.py regenerate_pictures --queued`,
+        # the admin request only marks the pictures
+        queued_count = queryset.exclude(picture='').update(derivatives_status=Picture.DerivativesStatus.PENDING)
+        self.message_user(request, f"Queued {queued_count} pictures for thumbnail, square image and rendition "
+                                   f"regeneration.", messages.SUCCESS)
+
+    regenerate_derivatives_action.short_description = "Regenerate thumbnails, squares and renditions"
 
 
 @admin.register(News)
@@ -352,13 +324,15 @@ class IssuerAdmin(admin.ModelAdmin):
 
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
-    list_display = ('id', 'invoice_number', 'order', 'issuer', 'created_at', 'due_date', 'is_paid', 'total_amount')
-    list_filter = ('is_paid', 'issuer', 'created_at')
+    list_display = ('id', 'invoice_number', 'order', 'issuer', 'created_at', 'due_date', 'is_paid', 'total_amount',
+                    'pdf_status')
+    list_filter = ('is_paid', 'issuer', 'created_at', 'pdf_status')
     search_fields = ('invoice_number', 'order__id', 'order__user__email')
     ordering = ('-created_at',)
-    actions = ['generate_pdf_action', 'regenerate_pdf_action']
+    date_hierarchy = 'created_at'
+    actions = ['generate_pdf_action', 'regenerate_pdf_action', 'export_zip_action', 'export_merged_pdf_action']
 
-    readonly_fields = ('pdf_preview', 'created_at', 'updated_at')
+    readonly_fields = ('pdf_preview', 'pdf_status', 'pdf_fingerprint', 'created_at', 'updated_at')
 
     def pdf_preview(self, obj):
         if obj.pdf_file:
@@ -369,45 +343,127 @@ class InvoiceAdmin(admin.ModelAdmin):
 
     fields = (
         'invoice_number', 'order', 'issuer', 'created_at', 'updated_at',
-        'is_paid', 'due_date', 'total_amount', 'currency', 'pdf_file', 'pdf_preview'
+        'is_paid', 'due_date', 'total_amount', 'currency', 'pdf_file', 'pdf_status', 'pdf_fingerprint', 'pdf_preview'
     )
 
     def generate_pdf_action(self, request, queryset):
-        generated_count = 0
-        for invoice in queryset:
-            if not invoice.pdf_file:
-                invoice.generate_pdf()
-                generated_count += 1
-
-        if generated_count > 0:
-            self.message_user(request, f"Successfully generated PDF for {generated_count} invoice(s).", messages.SUCCESS)
+        invoice_ids = self.queue_pdfs(queryset.filter(models.Q(pdf_file='') | models.Q(pdf_file__isnull=True)))
+        if invoice_ids:
+            self.render_queued(request, invoice_ids)
         else:
-            self.message_user(request, "No PDFs were generated. All selected invoices already have PDFs.", messages.INFO)
+            self.message_user(request, "No PDFs were queued. All selected invoices already have PDFs.", messages.INFO)
 
     generate_pdf_action.short_description = "Generate PDF if not generated"
-    
+
     def regenerate_pdf_action(self, request, queryset):
-        regenerated_count = 0
-        for invoice in queryset:
-            try:
-                # Regenerate PDF regardless of whether it already exists
-                success = invoice.generate_pdf()
-                if success:
-                    regenerated_count += 1
-                else:
-                    self.message_user(request, f"Failed to regenerate PDF for invoice {invoice.invoice_number}.", messages.ERROR)
-            except Exception as e:
-                self.message_user(request, f"Error regenerating PDF for invoice {invoice.invoice_number}: {e}", messages.ERROR)
-        
-        if regenerated_count > 0:
-            self.message_user(request, f"Successfully regenerated PDF for {regenerated_count} invoice(s).", messages.SUCCESS)
+        invoice_ids = self.queue_pdfs(queryset)
+        if invoice_ids:
+            # ensure_pdf() keeps the PDFs whose invoice did not change
+            self.render_queued(request, invoice_ids)
         else:
-            self.message_user(request, "No PDFs were regenerated. Please check for errors.", messages.WARNING)
-    
+            self.message_user(request, "No PDFs were queued. The selected invoices are being generated already.",
+                              messages.WARNING)
+
     regenerate_pdf_action.short_description = "Regenerate PDF (even if already exists)"
 
+    def queue_pdfs(self, invoices):
+        """Mark the PDFs of `invoices` for rendering, except those being rendered; returns their ids"""
+        invoice_ids = list(invoices.exclude(pdf_status=Invoice.PdfStatus.PROCESSING).values_list('pk', flat=True))
+        Invoice.objects.filter(pk__in=invoice_ids).update(pdf_status=Invoice.PdfStatus.PENDING)
+        return invoice_ids
+
+    def render_queued(self, request, invoice_ids):
+        """Render queued invoices in parallel worker processes, reporting timing and failures.
+
+        More than INVOICE_ADMIN_RENDER_LIMIT invoices are left to `manage.py run_worker`.
+        Returns the ids of the invoices still without a PDF.
+        """
+        if len(invoice_ids) > settings.INVOICE_ADMIN_RENDER_LIMIT:
+            self.message_user(request, f"{len(invoice_ids)} invoice(s) are too many to render here and were queued "
+                                       f"for generation in the background.", messages.WARNING)
+            return invoice_ids
+
+        numbers = dict(Invoice.objects.filter(pk__in=invoice_ids).values_list('pk', 'invoice_number'))
+        workers = min(settings.INVOICE_RENDER_WORKERS or os.cpu_count(), len(invoice_ids))
+        durations = []
+        failures = []
+        started = time.perf_counter()
+        # Spawned rather than forked: the web server process may be running threads
+        for invoice_id, ready, seconds, error in render_invoices(invoice_ids, workers, start_method='spawn'):
+            if ready:
+                durations.append(seconds)
+                logger.info('Rendered invoice %s in %.1f ms', numbers[invoice_id], seconds * 1000)
+            else:
+                failures.append(invoice_id)
+                logger.error('Rendering invoice %s failed: %s', numbers[invoice_id], error)
+
+        if durations:
+            elapsed = time.perf_counter() - started
+            self.message_user(request, f"{len(durations)} PDF(s) ready after {elapsed:.1f} s with {workers} "
+                                       f"process(es) (per invoice: mean {sum(durations) / len(durations) * 1000:.0f} "
+                                       f"ms, max {max(durations) * 1000:.0f} ms).", messages.SUCCESS)
+        if failures:
+            self.message_user(request, f"Rendering failed for: {', '.join(numbers[pk] for pk in failures)}. "
+                                       f"They are rendered again on download.", messages.ERROR)
+        return failures
+
+    def export_zip_action(self, request, queryset):
+        return self.export_pdfs(request, queryset, invoice_pdf.iter_zip, 'application/zip', 'invoices.zip')
+
+    export_zip_action.short_description = "Download PDFs as ZIP"
+
+    def export_merged_pdf_action(self, request, queryset):
+        return self.export_pdfs(request, queryset, invoice_pdf.iter_merged_pdf, 'application/pdf', 'invoices.pdf')
+
+    export_merged_pdf_action.short_description = "Download PDFs merged into one PDF"
+
+    def export_pdfs(self, request, queryset, iter_export, content_type, file_name):
+        # Missing PDFs are rendered first; if some are still missing the export is tried again later
+        missing_ids = self.queue_pdfs(queryset.exclude(pdf_status=Invoice.PdfStatus.READY, pdf_file__gt=''))
+        if missing_ids:
+            missing_ids = self.render_queued(request, missing_ids)
+        if missing_ids or queryset.filter(pdf_status=Invoice.PdfStatus.PROCESSING).exists():
+            self.message_user(request, "Some of the selected invoices have no PDF yet. Download again once they "
+                                       "are generated.", messages.WARNING)
+            return None
+
+        response = StreamingHttpResponse(iter_export(queryset.order_by('created_at', 'pk').iterator()),
+                                         content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        return response
+
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
-        # Generate PDF if it doesn't exist
-        if not obj.pdf_file:
-            obj.generate_pdf()
+        # Queue the PDF for the worker if it doesn't exist or no longer shows the invoice as saved
+        if obj.pdf_status != Invoice.PdfStatus.PROCESSING \
+                and (not obj.pdf_file or obj.pdf_fingerprint != obj.compute_pdf_fingerprint()):
+            Invoice.objects.filter(pk=obj.pk).update(pdf_status=Invoice.PdfStatus.PENDING)
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'template', 'target_type', 'target_id', 'status', 'attempts', 'next_attempt_at',
+                    'created_at', 'sent_at')
+    list_filter = ('status', 'template')
+    search_fields = ('idempotency_key', 'last_error')
+    ordering = ('-created_at',)
+    actions = ['retry_action']
+
+    # Emails are queued by the shop; the admin only watches delivery and retries dead letters
+    readonly_fields = ('template', 'target_type', 'target_id', 'context', 'idempotency_key', 'status', 'attempts',
+                       'next_attempt_at', 'last_error', 'created_at', 'sent_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry_action(self, request, queryset):
+        retried_count = queryset.exclude(status__in=[OutgoingEmail.Status.SENT, OutgoingEmail.Status.PROCESSING]) \
+            .update(status=OutgoingEmail.Status.PENDING, attempts=0, next_attempt_at=timezone.now())
+
+        if retried_count > 0:
+            self.message_user(request, f"Queued {retried_count} email(s) for sending.", messages.SUCCESS)
+        else:
+            self.message_user(request, "No emails were queued. The selected emails are sent or being sent.",
+                              messages.INFO)
+
+    retry_action.short_description = "Send now (failed or waiting for a retry)"
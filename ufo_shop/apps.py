@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class UfoShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'ufo_shop'
\ No newline at end of file
+    name = 'ufo_shop'
+
+    def ready(self):
+        from ufo_shop import checks  # noqa: F401 (registers the system checks)
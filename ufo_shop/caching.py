@@ -0,0 +1,111 @@
+"""
+Caching helpers for the anonymous catalog pages and item card fragments.
+
+Cache entries are never deleted explicitly. Instead every cached page or
+fragment key contains the current "version" of the scopes it depends on,
+and model save/delete hooks bump those versions. Stale entries then simply
+stop being read and expire on their own.
+
+Item card fragments are only cached with a cache shared by all processes
+(see card_cache_timeout()): pictures are finished by `manage.py run_worker`,
+whose version bumps never reach the web processes' own LocMemCache.
+
+Scopes:
+    CATALOG      - items, pictures and categories (shop list, item detail, home)
+    HOME         - news and the top sellers leaderboard (home page only)
+    item_scope() - a single item and its pictures (item card fragments)
+    order_scope() - a single order and its items (session cached cart count)
+"""
+import hashlib
+import time
+from typing import Iterable, Tuple
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.middleware.csrf import get_token
+
+CATALOG = 'catalog'
+HOME = 'home'
+
+# Rendered in place of the CSRF token while a page is rendered for the cache,
+# replaced with the visitor's own token every time the page is served.
+CSRF_TOKEN_PLACEHOLDER = '__ufo_shop_csrf_token__'
+
+
+def item_scope(item_id) -> str:
+    return f'item:{item_id}'
+
+
+def order_scope(order_id) -> str:
+    return f'order:{order_id}'
+
+
+def _version_key(scope: str) -> str:
+    return f'ufo_shop:version:{scope}'
+
+
+def get_versions(scopes: Iterable[str]) -> Tuple[int, ...]:
+    """Return the current version of each scope, initialising missing ones."""
+    scopes = list(scopes)
+    keys = [_version_key(scope) for scope in scopes]
+    stored = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in stored}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        stored.update(missing)
+    return tuple(stored[key] for key in keys)
+
+
+def invalidate(*scopes: str):
+    """Bump the version of the given scopes so entries depending on them are no longer used."""
+    version = time.time_ns()
+    cache.set_many({_version_key(scope): version for scope in scopes}, timeout=None)
+
+
+def is_shared_cache() -> bool:
+    """Whether the default cache is seen by every process; LocMemCache lives in a single one."""
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def card_cache_timeout() -> int:
+    """Seconds item card fragments are cached, 0 when they are not (ITEM_CARD_CACHE_TIMEOUT, shared cache only)."""
+    return settings.ITEM_CARD_CACHE_TIMEOUT if is_shared_cache() else 0
+
+
+def prime_card_versions(items) -> list:
+    """Fetch the card fragment versions of `items` with one get_many instead of one per card.
+
+    Returns the items as a list, each with the version Item.cache_version will return.
+    """
+    items = list(items)
+    if items and card_cache_timeout():
+        versions = get_versions([item_scope(item.pk) for item in items])
+        for item, version in zip(items, versions):
+            item._cache_version = version
+    return items
+
+
+def is_page_cacheable(request) -> bool:
+    """Only anonymous GET/HEAD requests without pending flash messages are served from the page cache."""
+    if not getattr(settings, 'CATALOG_PAGE_CACHE_TIMEOUT', 0):
+        return False
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # len() loads the stored messages without marking them as used
+    return len(messages.get_messages(request)) == 0
+
+
+def page_cache_key(request, scopes: Iterable[str]) -> str:
+    versions = '.'.join(str(version) for version in get_versions(scopes))
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    language = getattr(request, 'LANGUAGE_CODE', settings.LANGUAGE_CODE)
+    return f'ufo_shop:page:{language}:{versions}:{path}'
+
+
+def fill_csrf_token(content: str, request) -> str:
+    """Put the visitor's CSRF token into a page rendered with CSRF_TOKEN_PLACEHOLDER."""
+    return content.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request))
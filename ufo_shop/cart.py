@@ -0,0 +1,98 @@
+"""
+Request-scoped shopping cart.
+
+CartMiddleware attaches a Cart to every request as `request.cart`. The cart
+order and its items are loaded lazily on first access and then reused by the
+cart_info context processor and all cart/checkout views, so a request loads
+them at most once. Call invalidate() after changing the cart's items.
+
+The item count shown in the navbar is also stored in the session, so ordinary
+page views do not query the cart at all. Views that change the cart write the
+new count through with update_count(). The stored count is recounted when the
+order's cache version changed (OrderItem.save/delete, e.g. admin edits) or
+when it is older than CART_COUNT_MAX_AGE, which also heals bulk updates that
+bypass the model hooks.
+"""
+import time
+
+from django.conf import settings
+from django.utils.functional import cached_property
+
+from ufo_shop import caching
+from ufo_shop.models import Order
+
+CART_COUNT_SESSION_KEY = 'cart_count'
+
+
+class Cart:
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def order(self):
+        """The user's IN_CART order, or None for anonymous users and users without a cart"""
+        user = self.request.user
+        if not user.is_authenticated:
+            return None
+        return Order.objects.filter(user=user, status=Order.Status.IN_CART).first()
+
+    @cached_property
+    def items(self):
+        """Order items of the cart (with their Item) as a list"""
+        if self.order is None:
+            return []
+        return list(self.order.orderitem_set.select_related('item'))
+
+    @property
+    def count(self):
+        """Sum of item amounts in the cart, served from the session while it is fresh"""
+        user = self.request.user
+        if not user.is_authenticated:
+            return 0
+        if 'items' not in self.__dict__:
+            stored = self.request.session.get(CART_COUNT_SESSION_KEY)
+            if self._is_fresh(stored):
+                return stored['count']
+        return self._store_count()
+
+    def update_count(self):
+        """Reload the cart and write its item count through to the session"""
+        self.invalidate()
+        return self._store_count()
+
+    def _order_version(self, order_id):
+        if order_id is None:
+            return None
+        return caching.get_versions([caching.order_scope(order_id)])[0]
+
+    def _is_fresh(self, stored):
+        if not stored or stored.get('user_id') != self.request.user.pk:
+            return False
+        if time.time() - stored.get('at', 0) > settings.CART_COUNT_MAX_AGE:
+            return False
+        return stored.get('version') == self._order_version(stored.get('order_id'))
+
+    def _store_count(self):
+        count = sum(order_item.amount for order_item in self.items)
+        order_id = self.order.pk if self.order else None
+        self.request.session[CART_COUNT_SESSION_KEY] = {
+            'user_id': self.request.user.pk,
+            'order_id': order_id,
+            'version': self._order_version(order_id),
+            'count': count,
+            'at': time.time(),
+        }
+        return count
+
+    def get_or_create(self):
+        if self.order is None:
+            self.order, created = Order.objects.get_or_create(
+                user=self.request.user,
+                status=Order.Status.IN_CART
+            )
+        return self.order
+
+    def invalidate(self):
+        """Forget the loaded cart so the next access reloads it"""
+        self.__dict__.pop('order', None)
+        self.__dict__.pop('items', None)
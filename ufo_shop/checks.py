@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register()
+def check_invoice_fonts(app_configs, **kwargs):
+    """Warn about INVOICE_PDF_FONTS that are not installed, instead of only logging it on the first invoice"""
+    from ufo_shop.invoice_pdf import missing_fonts
+
+    return [
+        Warning(
+            f"Invoice font {family!r} not found: {', '.join(names)}.",
+            hint="Install the font or change INVOICE_PDF_FONTS; invoices are rendered in Helvetica, "
+                 "which has no Czech diacritics.",
+            id='ufo_shop.W001',
+        )
+        for family, names in missing_fonts(settings.INVOICE_PDF_FONTS).items()
+    ]
@@ -0,0 +1,34 @@
+"""
+Claiming queued rows for processing (see ufo_shop/tasks.py).
+
+A row is claimed by flipping its status field to PROCESSING with a conditional
+UPDATE, so several workers (and Invoice.ensure_pdf() in web processes) can
+claim side by side on any database without row locks. Rows claimed by a
+process that died are handed out again after WORKER_CLAIM_TIMEOUT.
+
+Kept apart from tasks.py, which imports the models, so that models can use it.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+
+def claim(queryset, status_field, pending_status, processing_status, claimed_at_field, limit):
+    """Claim up to `limit` pending rows of `queryset` (or rows with a stale claim) for this worker.
+
+    Returns the claimed model instances.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.WORKER_CLAIM_TIMEOUT)
+    claimable = Q(**{status_field: pending_status}) | Q(
+        **{status_field: processing_status, f'{claimed_at_field}__lt': stale}
+    )
+
+    candidate_ids = list(queryset.filter(claimable).order_by('pk').values_list('pk', flat=True)[:limit])
+    claimed_ids = [
+        pk for pk in candidate_ids
+        if queryset.filter(claimable, pk=pk).update(**{status_field: processing_status, claimed_at_field: now})
+    ]
+    return list(queryset.filter(pk__in=claimed_ids).order_by('pk'))
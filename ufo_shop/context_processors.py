@@ -1,5 +1,6 @@
 from django.db.models import Sum
 from .models import Order
+from .caching import CSRF_TOKEN_PLACEHOLDER, card_cache_timeout
 
 
 def cart_info(request):
@@ -9,9 +10,28 @@ def cart_info(request):
     cart_count = 0
     user = getattr(request, 'user', None)
     if user and user.is_authenticated:
-        try:
-            cart = Order.objects.get(user=user, status=Order.Status.IN_CART)
-            cart_count = cart.orderitem_set.aggregate(total=Sum('amount'))['total'] or 0
-        except Order.DoesNotExist:
-            cart_count = 0
+        cart = getattr(request, 'cart', None)
+        if cart is not None:
+            # Request-scoped cart from CartMiddleware, shared with the cart views
+            cart_count = cart.count
+        else:
+            try:
+                cart = Order.objects.get(user=user, status=Order.Status.IN_CART)
+                cart_count = cart.orderitem_set.aggregate(total=Sum('amount'))['total'] or 0
+            except Order.DoesNotExist:
+                cart_count = 0
     return {'cart_count': cart_count}
+
+
+def page_cache_csrf(request):
+    """Render a placeholder instead of the CSRF token while a page is rendered for the page cache.
+    The placeholder is replaced with the visitor's own token when the page is served.
+    """
+    if getattr(request, 'is_page_cache_render', False):
+        return {'csrf_token': CSRF_TOKEN_PLACEHOLDER}
+    return {}
+
+
+def item_card_cache(request):
+    """Seconds item_card.html caches the card fragments for, 0 when it renders them every time."""
+    return {'item_card_cache_timeout': card_cache_timeout()}
@@ -0,0 +1,138 @@
+"""
+Downloads of stored files (invoice PDFs) with HTTP caching and byte ranges.
+
+serve_file() answers
+- conditional requests (If-None-Match / If-Modified-Since) with 304 without
+  touching storage,
+- `Range: bytes=...` requests with 206 and just that part of the file; ranges
+  are honoured only while If-Range (if sent) still matches, and only single
+  ranges: a request for several ranges gets the whole file, as RFC 9110 allows,
+- everything else with the whole file and `Accept-Ranges: bytes`.
+
+With `offload` the file is not streamed by the Django worker at all: the
+response only names the file in an X-Accel-Redirect (nginx) or X-Sendfile
+(Apache mod_xsendfile, lighttpd) header and the front-end server sends it,
+handling ranges itself. That needs the file on the local filesystem; files of
+other storages are streamed by Django as before.
+"""
+import re
+from urllib.parse import quote
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+OFFLOAD_ACCEL_REDIRECT = 'x-accel-redirect'
+OFFLOAD_SENDFILE = 'x-sendfile'
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """(start, end) of a single `Range: bytes=...` header, both inclusive.
+
+    Returns None when the header is missing, malformed or names several ranges, so the
+    whole file is served. Raises ValueError when the range lies outside the file (416).
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Range starts after the end of the file")
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    """Whether a Range may be applied: no If-Range, or one naming the current version"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # Only strong validators qualify
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and last_modified is not None and date == int(last_modified.timestamp())
+
+
+def _iter_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _local_path(field_file):
+    try:
+        return field_file.path
+    except NotImplementedError:
+        # Remote storage
+        return None
+
+
+def serve_file(request, field_file, content_type, filename, etag, last_modified=None, offload=None,
+               accel_prefix=None):
+    """Response sending `field_file` as an attachment named `filename`.
+
+    `etag` must be a strong, quoted entity tag that changes whenever the content does;
+    `last_modified` is an aware datetime. `offload` is None, OFFLOAD_ACCEL_REDIRECT (with
+    `accel_prefix`, the URL of nginx's internal location aliased to the storage root)
+    or OFFLOAD_SENDFILE.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        path = _local_path(field_file) if offload else None
+        if path and offload == OFFLOAD_ACCEL_REDIRECT:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = quote(f"{accel_prefix.rstrip('/')}/{field_file.name}")
+        elif path and offload == OFFLOAD_SENDFILE:
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = path
+        else:
+            response = _file_response(request, field_file, content_type, etag, last_modified)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+def _file_response(request, field_file, content_type, etag, last_modified):
+    size = field_file.size
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size) \
+            if _if_range_matches(request, etag, last_modified) else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(field_file.open('rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_iter_range(field_file.open('rb'), start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -1,5 +1,6 @@
 from django import forms
 import os
+import tempfile
 from PIL import Image
 
 from django.contrib.auth.forms import AuthenticationForm
@@ -9,7 +10,9 @@ from django.db import models
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Fieldset, Submit, Row, Column, Div, HTML
 
-from ufo_shop import settings
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from ufo_shop import imaging
 from ufo_shop.models import Item, Order, OrderItem, Location
 
 # Payment method choices - only QR code is allowed
@@ -71,11 +74,67 @@ class SignUpForm(UserCreationForm):
         )
 
 
+class PictureUploadField(forms.ImageField):
+    """Image upload checked against PICTURE_UPLOAD_MAX_PIXELS using the image header only.
+
+    Images with a side longer than PICTURE_UPLOAD_MAX_DIMENSION are downsized
+    into a new temporary file, so the rest of the picture pipeline never handles
+    full resolution phone photos.
+    """
+    default_error_messages = {
+        'too_many_pixels': "The image is too large (%(width)s x %(height)s pixels).",
+    }
+
+    def to_python(self, data):
+        f = super().to_python(data)
+        if f is None:
+            return None
+
+        f.seek(0)
+        width, height = imaging.read_size(f)
+        if width * height > settings.PICTURE_UPLOAD_MAX_PIXELS:
+            raise forms.ValidationError(self.error_messages['too_many_pixels'], code='too_many_pixels',
+                                        params={'width': width, 'height': height})
+        f.seek(0)
+        if max(width, height) <= settings.PICTURE_UPLOAD_MAX_DIMENSION:
+            return f
+
+        downsized = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+        try:
+            imaging.downsize(f, settings.PICTURE_UPLOAD_MAX_DIMENSION, downsized)
+        except (OSError, ValueError) as e:
+            # Truncated files or modes the encoder cannot write
+            downsized.close()
+            raise forms.ValidationError(self.error_messages['invalid_image'], code='invalid_image') from e
+        size = downsized.tell()
+        downsized.seek(0)
+        f.close()
+        return UploadedFile(downsized, f.name, f.content_type, size, f.charset, f.content_type_extra)
+
+
+class MultipleFileInput(forms.FileInput):
+    allow_multiple_selected = True
+
+
+class MultiplePictureUploadField(PictureUploadField):
+    """PictureUploadField accepting several files at once; cleans to a list of files"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_file_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_file_clean(f, initial) for f in data]
+        return [single_file_clean(data, initial)] if data else []
+
+
 class ItemForm(forms.ModelForm):
-    images = forms.ImageField(
+    images = MultiplePictureUploadField(
         label="Upload Images",
-        widget=forms.FileInput(),
-        required=False  # Make it optional if items can be created without images initially
+        required=False,  # Make it optional if items can be created without images initially
+        help_text="You can select several images at once, they are added in the selected order."
     )
 
     # Fields for color variants
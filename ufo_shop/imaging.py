@@ -0,0 +1,132 @@
+"""
+Image processing helpers shared by Picture and the image related commands.
+
+The original upload is decoded once per processing pass. For JPEG files the
+decoder is asked (via Image.draft) to decode directly at a reduced scale that
+is still large enough for the biggest derivative, which is much faster and
+uses a fraction of the memory of a full 12MP decode.
+"""
+import math
+from io import BytesIO
+
+from PIL import Image as PilImage, features
+
+# Pillow reports JPEGs with embedded previews (many phone photos) as MPO; both decode at reduced scale
+JPEG_FORMATS = ('JPEG', 'MPO')
+
+
+def open_for_derivatives(fp, min_size):
+    """Open and decode an image, letting JPEG decode at the smallest scale with both sides >= min_size"""
+    img = PilImage.open(fp)
+    if img.format in JPEG_FORMATS:
+        img.draft(None, (min_size, min_size))
+    img.load()
+    return img
+
+
+def square_crop(img, size):
+    """Center-crop `img` to a square and resize it to size x size"""
+    return cover(img, size, size)
+
+
+def cover(img, width, height):
+    """Center-crop `img` to the aspect ratio of width x height and resize it to exactly that size"""
+    img_width, img_height = img.size
+    crop_width = min(img_width, img_height * width / height)
+    crop_height = min(img_height, img_width * height / width)
+    left = (img_width - crop_width) / 2
+    top = (img_height - crop_height) / 2
+    return img.resize((width, height), PilImage.Resampling.LANCZOS,
+                      box=(left, top, left + crop_width, top + crop_height))
+
+
+def thumbnail(img, size):
+    """Scale `img` down to fit in size x size, keeping the aspect ratio"""
+    thumb_img = img.copy()
+    thumb_img.thumbnail((size, size), PilImage.Resampling.LANCZOS)
+    return thumb_img
+
+
+def encode(img, img_format, quality):
+    """Encode `img` and return the bytes"""
+    buffer = BytesIO()
+    img.save(buffer, format=img_format, quality=quality)
+    return buffer.getvalue()
+
+
+# Output formats renditions can be encoded in: MIME type, file extension, the
+# Pillow feature the encoder needs (None = always available) and encoder quality
+RENDITION_FORMATS = {
+    'AVIF': {'mime_type': 'image/avif', 'extension': 'avif', 'feature': 'avif', 'quality': 60},
+    'WEBP': {'mime_type': 'image/webp', 'extension': 'webp', 'feature': 'webp', 'quality': 80},
+    'JPEG': {'mime_type': 'image/jpeg', 'extension': 'jpg', 'feature': None, 'quality': 85},
+}
+
+
+def supported_formats(formats):
+    """The given rendition formats that this Pillow build can encode, in the same order"""
+    return [
+        img_format for img_format in formats
+        if img_format in RENDITION_FORMATS
+        and (RENDITION_FORMATS[img_format]['feature'] is None
+             or features.check(RENDITION_FORMATS[img_format]['feature']))
+    ]
+
+
+def rendition_widths(img, widths):
+    """The widths of the square renditions to generate for `img`.
+
+    Widths larger than the image are skipped, except that the smallest one is
+    always generated (upscaled if necessary) so every picture has a rendition.
+    """
+    side = min(img.size)
+    widths = sorted(set(widths))
+    return [width for width in widths if width <= side] or widths[:1]
+
+
+def encode_rendition(img, img_format):
+    """Encode `img` in one of RENDITION_FORMATS and return the bytes"""
+    if img_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    return encode(img, img_format, quality=RENDITION_FORMATS[img_format]['quality'])
+
+
+def read_size(fp):
+    """(width, height) of an image read from its header, without decoding the pixels"""
+    with PilImage.open(fp) as img:
+        return img.size
+
+
+def downsize(fp, max_dimension, out):
+    """Write the image in `fp` scaled to fit max_dimension x max_dimension to the file object `out`.
+
+    The full resolution pixels are never resampled: JPEG files are decoded at a
+    reduced scale (Image.draft) and other formats are reduced by an integer
+    factor. Since JPEG decoding scales by powers of two, the longer side of the
+    result may end up anywhere between half of max_dimension and max_dimension.
+    Returns the (width, height) written.
+    """
+    img = PilImage.open(fp)
+    # Only the primary image of an MPO is kept, as a plain JPEG
+    img_format = 'JPEG' if img.format == 'MPO' else img.format
+    if img_format == 'JPEG':
+        scale = max_dimension / 2 / max(img.size)
+        img.draft(None, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    img.load()
+    factor = math.ceil(max(img.size) / max_dimension)
+    if factor > 1:
+        img = reducible(img).reduce(factor)
+    img.save(out, format=img_format, quality=90)
+    return img.size
+
+
+def reducible(img):
+    """`img` in a mode Image.reduce() averages correctly: palette, bilevel and 16-bit images are converted"""
+    if img.mode in ('P', 'PA'):
+        has_alpha = img.mode == 'PA' or 'transparency' in img.info
+        return img.convert('RGBA' if has_alpha else 'RGB')
+    if img.mode == '1':
+        return img.convert('L')
+    if img.mode.startswith('I;16'):
+        return img.convert('I')
+    return img
@@ -0,0 +1,260 @@
+"""
+Invoice PDF rendering with xhtml2pdf.
+
+Invoices are drawn in a TrueType font with Czech diacritics (Helvetica has
+none) and with the issuer's logo or the static fallback logo. A new process
+pays for importing xhtml2pdf and reportlab, registering the fonts and loading
+the template on its first invoice; warm_up() does that once per process and
+render() reuses it:
+
+- `manage.py run_worker` calls warm_up() when it starts, so its first invoice
+  renders as fast as the others. The pools of backfill_invoices and
+  render_invoices warm up before forking their processes, which inherit it
+  instead of paying for the imports each; web processes warm up on their
+  first render.
+- The fonts in INVOICE_PDF_FONTS are found in reportlab's TTFSearchPath (the
+  usual font directories of Linux, macOS and Windows), registered with
+  reportlab once and made known to xhtml2pdf under their CSS family name, so
+  the template can use them without an @font-face that would parse the TTF
+  files on every render. Fonts that are not installed are reported by
+  `manage.py check`; the invoices fall back to Helvetica.
+- The template is loaded once instead of being looked up on every render.
+- Images under STATIC_URL and MEDIA_URL are resolved by link_callback() to
+  data: URIs kept in memory, so renders do not read them from disk (or from
+  remote media storage) again. Uploaded files never change under the same
+  name, so the cache needs no invalidation. Raster images are scaled down to
+  IMAGE_MAX_SIZE first: reportlab compresses and embeds every pixel of an
+  image on each render, however small it is drawn.
+- reportlab writes binary instead of ASCII85 encoded image streams, which
+  it would encode in pure Python without its C accelerator.
+
+Compare the speed of a pool with the old renderer with
+`manage.py benchmark_invoice_rendering`.
+
+template_version() identifies the template and fonts a PDF was rendered
+with. It is part of Invoice.compute_pdf_fingerprint(), so after changing
+either, regenerated invoices are rendered again instead of keeping their file.
+
+iter_zip() and iter_merged_pdf() export many rendered invoices at once, as
+chunks for a StreamingHttpResponse or a file.
+"""
+import base64
+import functools
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import zipfile
+from io import BytesIO
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.files.storage import default_storage
+from django.template.loader import get_template
+from PIL import Image as PilImage, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_NAME = 'ufo_shop/invoice_pdf.html'
+# Three times the 120x50 px .logo box of the template, enough for print
+IMAGE_MAX_SIZE = (360, 150)
+
+
+def find_font(name):
+    """Path of a TrueType font given by its path or by its file name in reportlab's TTFSearchPath, None if missing"""
+    from reportlab import rl_config
+
+    if os.path.isabs(name):
+        return name if os.path.exists(name) else None
+    for directory in rl_config.TTFSearchPath:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def missing_fonts(fonts):
+    """{CSS family: [file names]} of the fonts of INVOICE_PDF_FONTS that are not installed"""
+    missing = {}
+    for family, files in fonts.items():
+        names = [name for name in files.values() if find_font(name) is None]
+        if names:
+            missing[family] = names
+    return missing
+
+
+def register_fonts(fonts):
+    """Register {CSS family: {'normal': file, 'bold': file}} with reportlab and xhtml2pdf"""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from xhtml2pdf import default
+
+    missing = missing_fonts(fonts)
+    for family, files in fonts.items():
+        if family in missing:
+            logger.warning('Invoice font %s not found (%s), using Helvetica', family, ', '.join(missing[family]))
+            continue
+        base_name = family.replace(' ', '')
+        names = {style: base_name if style == 'normal' else f'{base_name}-{style.title()}' for style in files}
+        for style, name in files.items():
+            pdfmetrics.registerFont(TTFont(names[style], find_font(name)))
+        normal, bold = names['normal'], names.get('bold', names['normal'])
+        pdfmetrics.registerFontFamily(normal, normal=normal, bold=bold, italic=normal, boldItalic=bold)
+        # Every xhtml2pdf document starts from a copy of this table
+        default.DEFAULT_FONT[family.lower()] = normal
+
+
+@functools.lru_cache(maxsize=None)
+def warm_up():
+    """Import xhtml2pdf, register the fonts and load the template; returns the template"""
+    from reportlab import rl_config
+    from xhtml2pdf import pisa  # noqa: F401 (imports reportlab)
+
+    rl_config.useA85 = 0
+    register_fonts(settings.INVOICE_PDF_FONTS)
+    return get_template(TEMPLATE_NAME)
+
+
+@functools.lru_cache(maxsize=None)
+def template_version():
+    """Hash of the template source and INVOICE_PDF_FONTS, computed once per process"""
+    source = get_template(TEMPLATE_NAME).template.source
+    fonts = json.dumps(settings.INVOICE_PDF_FONTS, sort_keys=True)
+    return hashlib.sha256(f"{source}\n{fonts}".encode()).hexdigest()
+
+
+def _read_asset(uri):
+    """Bytes of a static or media file referenced by `uri`, None for other URIs and missing files"""
+    if uri.startswith(settings.STATIC_URL):
+        path = unquote(uri[len(settings.STATIC_URL):])
+        if settings.STATIC_ROOT and os.path.exists(os.path.join(settings.STATIC_ROOT, path)):
+            full_path = os.path.join(settings.STATIC_ROOT, path)
+        else:
+            full_path = finders.find(path)
+        if not full_path:
+            return None
+        with open(full_path, 'rb') as f:
+            return f.read()
+    if uri.startswith(settings.MEDIA_URL):
+        name = unquote(uri[len(settings.MEDIA_URL):])
+        if not default_storage.exists(name):
+            return None
+        with default_storage.open(name) as f:
+            return f.read()
+    return None
+
+
+def _fit_image(data):
+    """PNG of a raster image scaled down to IMAGE_MAX_SIZE, None when it is small enough or not an image"""
+    try:
+        img = PilImage.open(BytesIO(data))
+    except UnidentifiedImageError:
+        return None
+    if img.width <= IMAGE_MAX_SIZE[0] and img.height <= IMAGE_MAX_SIZE[1]:
+        return None
+    img.thumbnail(IMAGE_MAX_SIZE, PilImage.Resampling.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=64)
+def asset_data_uri(uri):
+    """data: URI with the content of a static or media file, None when `uri` is not one"""
+    data = _read_asset(uri)
+    if data is None:
+        return None
+    mime_type = mimetypes.guess_type(uri)[0] or 'application/octet-stream'
+    fitted = _fit_image(data)
+    if fitted is not None:
+        data, mime_type = fitted, 'image/png'
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode()}"
+
+
+def link_callback(uri, rel):
+    """xhtml2pdf link_callback serving static and media files from the in-memory cache"""
+    return asset_data_uri(uri) or uri
+
+
+def render(context):
+    """PDF bytes of the invoice template rendered with `context`, None when xhtml2pdf reports an error"""
+    from xhtml2pdf import pisa
+
+    html = warm_up().render(context)
+    buffer = BytesIO()
+    pisa_status = pisa.CreatePDF(html, dest=buffer, encoding='utf-8', link_callback=link_callback)
+    if pisa_status.err:
+        return None
+    return buffer.getvalue()
+
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkBuffer:
+    """Write-only file object collecting what is written until it is drained"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def export_file_name(invoice):
+    return f"invoice_{invoice.invoice_number}.pdf"
+
+
+def iter_zip(invoices):
+    """Chunks of a ZIP archive with the PDFs of `invoices` (which must have one).
+
+    Each PDF is copied from storage in EXPORT_CHUNK_SIZE pieces and handed out as
+    soon as it is compressed, so neither the PDFs nor the archive are held in memory.
+    """
+    buffer = _ChunkBuffer()
+    names = set()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for invoice in invoices:
+            name = export_file_name(invoice)
+            if name in names:
+                name = f"invoice_{invoice.invoice_number}_{invoice.pk}.pdf"
+            names.add(name)
+            with invoice.pdf_file.open('rb') as pdf, archive.open(name, 'w') as entry:
+                while chunk := pdf.read(EXPORT_CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield from buffer.drain()
+            yield from buffer.drain()
+    yield from buffer.drain()
+
+
+def iter_merged_pdf(invoices):
+    """Chunks of a single PDF with the pages of all PDFs of `invoices` (which must have one).
+
+    The PDFs are copied one at a time by pdf_merge.MergedPdf and handed out as soon as
+    they are written, so memory does not grow with the size of the export.
+    """
+    from ufo_shop.pdf_merge import MergedPdf
+
+    buffer = _ChunkBuffer()
+    merged = MergedPdf(buffer)
+    for invoice in invoices:
+        with invoice.pdf_file.open('rb') as pdf:
+            merged.add(pdf, invoice.invoice_number)
+        yield from buffer.drain()
+    merged.close()
+    yield from buffer.drain()
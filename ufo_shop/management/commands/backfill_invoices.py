@@ -0,0 +1,78 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+
+from ufo_shop.management.pool import render_invoices
+from ufo_shop.models import Invoice, Order
+
+
+class Command(BaseCommand):
+    help = "Create the missing invoices of placed orders in batches.\n\n" \
+           "The PDFs of the new invoices are left to `manage.py run_worker`, or rendered\n" \
+           "right away in parallel with --render."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Invoices inserted per query")
+        parser.add_argument('--render', action='store_true', help="Render the PDFs of the created invoices")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Number of processes rendering PDFs (with --render)")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the orders without an invoice")
+
+    def handle(self, *args, **options):
+        missing = Order.objects.exclude(status=Order.Status.IN_CART) \
+            .filter(~Exists(Invoice.objects.filter(order=OuterRef('pk')))).order_by('pk')
+        if options['dry_run']:
+            self.stdout.write(f"Orders without an invoice: {missing.count()}")
+            return
+
+        try:
+            issuer = Invoice.default_issuer()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        created_ids = []
+        last_pk = 0
+        while True:
+            # Re-queried per batch: orders invoiced meanwhile (e.g. at checkout) drop out
+            batch = list(missing.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            invoices = Invoice.objects.bulk_create([Invoice.for_order(order, issuer) for order in batch])
+            created_ids.extend(invoice.pk for invoice in invoices)
+            self.stdout.write(f"Created {len(created_ids)} invoices")
+
+        if not created_ids:
+            self.stdout.write(self.style.SUCCESS("All orders have an invoice."))
+            return
+        if not options['render']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Created {len(created_ids)} invoices, their PDFs are queued for `manage.py run_worker`."
+            ))
+            return
+
+        self.render(created_ids, options['workers'])
+
+    def render(self, invoice_ids, workers):
+        self.stdout.write(f"Rendering {len(invoice_ids)} PDFs with {workers} workers")
+        ready = 0
+        failures = []
+        started = time.perf_counter()
+        for invoice_id, done, _, error in render_invoices(invoice_ids, workers, chunksize=10):
+            if done:
+                ready += 1
+            else:
+                failures.append(invoice_id)
+                self.stderr.write(f"Invoice {invoice_id}: {error}")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Rendered: {ready}, failed: {len(failures)} in {elapsed:.1f} s")
+        if failures:
+            self.stdout.write(self.style.WARNING(
+                f"Failed invoices (rendered again on download or via the admin regenerate action): "
+                f"{', '.join(str(invoice_id) for invoice_id in failures)}"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("Invoices backfilled."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from ufo_shop.models import Item
+
+
+class Command(BaseCommand):
+    help = "Set Item.primary_picture to the first picture of each item.\n\n" \
+           "Run once after migrating, or any time the pointer got out of sync\n" \
+           "(e.g. after bulk deletes that bypass Picture.delete)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing-only', action='store_true',
+                            help="Only fill items that have no primary picture yet")
+
+    def handle(self, *args, **options):
+        items = Item.objects.all()
+        if options['missing_only']:
+            items = items.filter(primary_picture__isnull=True)
+
+        updated = items.refresh_primary_pictures()
+        without_picture = Item.objects.filter(primary_picture__isnull=True).count()
+
+        self.stdout.write(f"Items updated: {updated}")
+        self.stdout.write(f"Items without any picture: {without_picture}")
+        self.stdout.write(self.style.SUCCESS("Primary pictures backfilled."))
@@ -0,0 +1,96 @@
+import multiprocessing
+import resource
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PilImage
+
+from ufo_shop import imaging
+
+
+# The pipelines run in spawned processes that import this module without setting
+# Django up, so nothing at module level may touch the models.
+
+def legacy_derivatives(data, square_size, thumbnail_size):
+    """The pre single-pass pipeline: every derivative re-opens and fully decodes the original"""
+    img = PilImage.open(BytesIO(data))
+    square_img = img.copy()
+    width, height = square_img.size
+    size = min(width, height)
+    left, top = (width - size) // 2, (height - size) // 2
+    square_img = square_img.crop((left, top, left + size, top + size))
+    square_img = square_img.resize((square_size, square_size), PilImage.Resampling.LANCZOS)
+    imaging.encode(square_img, img.format, quality=90)
+
+    img = PilImage.open(BytesIO(data))
+    thumb_img = img.copy()
+    thumb_img.thumbnail((thumbnail_size, thumbnail_size), PilImage.Resampling.LANCZOS)
+    imaging.encode(thumb_img, img.format, quality=85)
+
+
+def single_pass_derivatives(data, square_size, thumbnail_size):
+    """Picture.process_image(): one reduced-scale decode feeding all derivatives"""
+    img = imaging.open_for_derivatives(BytesIO(data), square_size)
+    imaging.encode(imaging.square_crop(img, square_size), img.format, quality=90)
+    imaging.encode(imaging.thumbnail(img, thumbnail_size), img.format, quality=85)
+
+
+PIPELINES = {
+    'legacy': legacy_derivatives,
+    'single-pass': single_pass_derivatives,
+}
+
+
+def _run(pipeline, data, sizes, repeat, queue):
+    # Runs in a fresh process so ru_maxrss only reflects this pipeline
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for _ in range(repeat):
+        PIPELINES[pipeline](data, *sizes)
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed / repeat, peak_kb, peak_kb - baseline_kb))
+
+
+class Command(BaseCommand):
+    help = "Compare wall time and peak RSS of picture derivative generation pipelines.\n\n" \
+           "Without --image a synthetic 12MP (4000x3000) JPEG is used."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', help="Path to a JPEG/PNG to process instead of the synthetic image")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per pipeline (time is averaged)")
+
+    def handle(self, *args, **options):
+        from ufo_shop.models import SQUARE_IMAGE_SIZE, THUMBNAIL_SIZE
+
+        if options['image']:
+            try:
+                with open(options['image'], 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                raise CommandError(f"Cannot read image: {e}")
+        else:
+            buffer = BytesIO()
+            PilImage.effect_noise((4000, 3000), 64).convert('RGB').save(buffer, format='JPEG', quality=90)
+            data = buffer.getvalue()
+
+        with PilImage.open(BytesIO(data)) as img:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"== {img.format} {img.size[0]}x{img.size[1]}, {len(data) / 1024 / 1024:.1f} MB, "
+                f"{options['repeat']} run(s) per pipeline =="
+            ))
+
+        context = multiprocessing.get_context('spawn')
+        for pipeline in PIPELINES:
+            queue = context.Queue()
+            process = context.Process(
+                target=_run, args=(pipeline, data, (SQUARE_IMAGE_SIZE, THUMBNAIL_SIZE), options['repeat'], queue)
+            )
+            process.start()
+            seconds, peak_kb, growth_kb = queue.get()
+            process.join()
+            self.stdout.write(
+                f"{pipeline:<12} {seconds * 1000:8.1f} ms/image   "
+                f"peak RSS {peak_kb / 1024:7.1f} MB (+{growth_kb / 1024:.1f} MB while processing)"
+            )
@@ -0,0 +1,101 @@
+import multiprocessing
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def legacy_render(invoice_id):
+    """The pre-warm-up Invoice.generate_pdf(): imports, template lookup and ASCII85 images on every call"""
+    from django.conf import settings
+    from django.template.loader import get_template
+    from reportlab import rl_config
+    from xhtml2pdf import pisa
+    from ufo_shop.models import Invoice
+
+    rl_config.useA85 = 1
+    invoice = Invoice.objects.get(pk=invoice_id)
+    context = {
+        'invoice': invoice,
+        'issuer': invoice.issuer,
+        'order': invoice.order,
+        'items': invoice.order.orderitem_set.all(),
+        'qr_code': invoice.order.get_payment_qr_code(),
+        'STATIC_ROOT': settings.STATIC_ROOT,
+    }
+    html = get_template('ufo_shop/invoice_pdf.html').render(context)
+    buffer = BytesIO()
+    pisa.CreatePDF(html, dest=buffer, encoding='utf-8')
+    return buffer.getvalue()
+
+
+def warmed_render(invoice_id):
+    """ufo_shop.invoice_pdf: imports, template and reportlab settings done once per pool"""
+    from ufo_shop import invoice_pdf
+    from ufo_shop.models import Invoice
+
+    return invoice_pdf.render(Invoice.objects.get(pk=invoice_id).pdf_context())
+
+
+PIPELINES = {
+    'legacy': (legacy_render, None),
+    'warmed': (warmed_render, 'ufo_shop.invoice_pdf.warm_up'),
+}
+
+
+def _run(pipeline, invoice_ids, workers, start_method, queue):
+    # Runs in a fresh process, which starts a pool the way render_invoices and backfill_invoices do
+    import django
+    django.setup()
+    import logging
+    from ufo_shop.management.pool import worker_pool
+
+    # xhtml2pdf warns about every glyph Helvetica lacks (in legacy); that output is not what is measured
+    logging.disable(logging.WARNING)
+    render, warm_up = PIPELINES[pipeline]
+    started = time.perf_counter()
+    with worker_pool(workers, warm_up=warm_up, start_method=start_method) as pool:
+        list(pool.map(render, invoice_ids))
+    elapsed = time.perf_counter() - started
+    queue.put(elapsed)
+
+
+class Command(BaseCommand):
+    help = "Compare invoice PDF rendering before and after the warmed rendering engine\n" \
+           "(ufo_shop/invoice_pdf.py). Each pipeline starts a fresh process with a pool of\n" \
+           "--workers processes, like render_invoices and backfill_invoices, and renders the\n" \
+           "invoices in it; the time includes starting the pool.\n\n" \
+           "'legacy' is the old code, whose PDFs lack the Czech font and the logos;\n" \
+           "'warmed' is the current one.\n\n" \
+           "Renders existing invoices; nothing is saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoice', type=int, action='append', dest='invoices', help="Invoice id (repeatable)")
+        parser.add_argument('--count', type=int, default=5, help="Number of latest invoices without --invoice")
+        parser.add_argument('--repeat', type=int, default=4, help="Renders of each invoice")
+        parser.add_argument('--workers', type=int, default=4, help="Processes of the pool")
+
+    def handle(self, *args, **options):
+        from ufo_shop.models import Invoice
+
+        invoice_ids = options['invoices'] or list(
+            Invoice.objects.order_by('-pk').values_list('pk', flat=True)[:options['count']]
+        )
+        if not invoice_ids:
+            raise CommandError("No invoices to render, create some with `manage.py backfill_invoices`")
+
+        renders = invoice_ids * options['repeat']
+        # The pool uses the start method the commands get by default; spawned processes would default to spawn
+        start_method = multiprocessing.get_start_method()
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"== {len(renders)} render(s) of {len(invoice_ids)} invoice(s) in {options['workers']} worker(s), "
+            f"{start_method} start method =="
+        ))
+        context = multiprocessing.get_context('spawn')
+        for pipeline in PIPELINES:
+            queue = context.Queue()
+            process = context.Process(target=_run, args=(pipeline, renders, options['workers'], start_method, queue))
+            process.start()
+            elapsed = queue.get()
+            process.join()
+            self.stdout.write(f"{pipeline:<8} {elapsed:6.2f} s   {len(renders) / elapsed:6.1f} invoices/s")
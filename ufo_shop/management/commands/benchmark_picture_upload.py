@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image as PilImage
+
+from ufo_shop.management.commands.benchmark_image_processing import legacy_derivatives, single_pass_derivatives
+
+BOUNDARY = 'ufo-shop-benchmark'
+
+
+def _parse_upload(body_path, handler_classes):
+    from django.http.multipartparser import MultiPartParser
+
+    meta = {
+        'CONTENT_TYPE': f'multipart/form-data; boundary={BOUNDARY}',
+        'CONTENT_LENGTH': os.path.getsize(body_path),
+    }
+    with open(body_path, 'rb') as body:
+        _, files = MultiPartParser(meta, body, [handler() for handler in handler_classes]).parse()
+    return files['images']
+
+
+def legacy_upload(body_path, sizes):
+    """Django's default upload handlers, ImageField validation and full resolution derivatives"""
+    from django import forms
+    from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+    uploaded = forms.ImageField().clean(_parse_upload(body_path, [MemoryFileUploadHandler,
+                                                                  TemporaryFileUploadHandler]))
+    uploaded.seek(0)
+    legacy_derivatives(uploaded.read(), *sizes)
+
+
+def streaming_upload(body_path, sizes):
+    """Upload streamed to a temporary file, header validation and draft downsizing, then derivatives"""
+    from django.core.files.uploadhandler import TemporaryFileUploadHandler
+    from ufo_shop.forms import PictureUploadField
+
+    uploaded = PictureUploadField().clean(_parse_upload(body_path, [TemporaryFileUploadHandler]))
+    single_pass_derivatives(uploaded.read(), *sizes)
+
+
+PIPELINES = {
+    'legacy': legacy_upload,
+    'streaming': streaming_upload,
+}
+
+
+def _run(pipeline, body_path, sizes, queue):
+    # Runs in a fresh process so ru_maxrss only reflects this upload
+    import django
+    django.setup()
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    PIPELINES[pipeline](body_path, sizes)
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, peak_kb, peak_kb - baseline_kb))
+
+
+class Command(BaseCommand):
+    help = "Measure peak RSS and time of a single picture upload, from the multipart request\n" \
+           "body to the generated derivatives, for the legacy and the streaming upload path.\n\n" \
+           "Without --image a synthetic 24MP (6000x4000) JPEG is uploaded."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', help="Path to a JPEG/PNG to upload instead of the synthetic image")
+
+    def handle(self, *args, **options):
+        from ufo_shop.models import SQUARE_IMAGE_SIZE, THUMBNAIL_SIZE
+
+        if options['image']:
+            try:
+                with open(options['image'], 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                raise CommandError(f"Cannot read image: {e}")
+            file_name = os.path.basename(options['image'])
+        else:
+            buffer = BytesIO()
+            PilImage.effect_noise((6000, 4000), 64).convert('RGB').save(buffer, format='JPEG', quality=95)
+            data = buffer.getvalue()
+            file_name = 'photo.jpg'
+
+        with PilImage.open(BytesIO(data)) as img:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"== {img.format} {img.size[0]}x{img.size[1]}, {len(data) / 1024 / 1024:.1f} MB upload =="
+            ))
+
+        with tempfile.NamedTemporaryFile(suffix='.multipart') as body:
+            body.write(
+                f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="images"; filename="{file_name}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+            )
+            body.write(data)
+            body.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+            body.flush()
+            del data
+
+            context = multiprocessing.get_context('spawn')
+            for pipeline in PIPELINES:
+                queue = context.Queue()
+                process = context.Process(
+                    target=_run, args=(pipeline, body.name, (SQUARE_IMAGE_SIZE, THUMBNAIL_SIZE), queue)
+                )
+                process.start()
+                seconds, peak_kb, growth_kb = queue.get()
+                process.join()
+                self.stdout.write(
+                    f"{pipeline:<10} {seconds * 1000:8.1f} ms/upload   "
+                    f"peak RSS {peak_kb / 1024:7.1f} MB (+{growth_kb / 1024:.1f} MB during the upload)"
+                )
@@ -0,0 +1,49 @@
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image as PilImage
+
+from ufo_shop import qr
+from ufo_shop.models import Order
+
+RENDERERS = {
+    'styled': qr.render_styled_png,
+    'fast': qr.render_fast_png,
+}
+
+# (order id, total, contact email) of typical orders
+SAMPLE_ORDERS = [
+    (7, 350, 'jan@example.cz'),
+    (1234, 12990, 'zakaznik.s.dlouhym.jmenem@priklad-domeny.cz'),
+    (987654, 1499, 'a@b.cz'),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare payment QR code renderers (see ufo_shop/qr.py) on typical SPD payloads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50, help="Renders per payload and renderer")
+
+    def handle(self, *args, **options):
+        payloads = [
+            Order(id=order_id, total=total, contact_email=email)._build_qr_payload()
+            for order_id, total, email in SAMPLE_ORDERS
+        ]
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"== {len(payloads)} payloads ({min(map(len, payloads))}-{max(map(len, payloads))} chars), "
+            f"{options['repeat']} renders each =="
+        ))
+
+        for name, renderer in RENDERERS.items():
+            started = time.perf_counter()
+            for payload in payloads:
+                for _ in range(options['repeat']):
+                    png_bytes = renderer(payload)
+            elapsed = time.perf_counter() - started
+            per_code_ms = elapsed / (len(payloads) * options['repeat']) * 1000
+            size = PilImage.open(BytesIO(png_bytes)).size
+            self.stdout.write(
+                f"{name:<8} {per_code_ms:7.2f} ms/code   last PNG {len(png_bytes)} bytes, {size[0]}x{size[1]} px"
+            )
@@ -0,0 +1,122 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from ufo_shop import caching
+from ufo_shop.models import Picture, RENDITIONS_UPLOAD_TO
+from ufo_shop.storage import picture_storage
+
+PICTURES_ROOT = 'item_pictures'
+FILE_FIELDS = ('picture', 'thumbnail', 'square_image')
+
+
+def walk(storage, path):
+    """Names of all files below `path` in `storage`"""
+    try:
+        directories, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for file_name in files:
+        yield f"{path}/{file_name}"
+    for directory in directories:
+        yield from walk(storage, f"{path}/{directory}")
+
+
+class Command(BaseCommand):
+    help = "Move picture files to content-addressed names, sharing identical files.\n\n" \
+           "Run once after migrating to the content-addressed picture storage. Files that\n" \
+           "are no longer referenced afterwards are deleted and the reclaimed bytes reported.\n" \
+           "Safe to run again, already migrated files are left alone."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be reclaimed")
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help=f"Also delete files under {PICTURES_ROOT}/ that no picture references "
+                                 f"(e.g. left behind by items deleted with their pictures)")
+
+    def handle(self, *args, **options):
+        storage = picture_storage()
+        dry_run = options['dry_run']
+        sizes = {name: storage.size(name) for name in walk(storage, PICTURES_ROOT)}
+        self.stdout.write(f"Files under {PICTURES_ROOT}/: {len(sizes)}, {filesizeformat(sum(sizes.values()))}")
+
+        new_names = {}
+        references = 0
+        missing = 0
+        pictures_updated = 0
+        item_ids = set()
+        for picture in Picture.objects.order_by('pk').iterator():
+            changes = {}
+            for field in FILE_FIELDS:
+                name = getattr(picture, field).name
+                if not name:
+                    continue
+                if name not in sizes:
+                    missing += 1
+                    continue
+                references += 1
+                new_name = self.migrate_file(storage, name, Picture._meta.get_field(field).upload_to, dry_run)
+                new_names[name] = new_name
+                if new_name != name:
+                    changes[field] = new_name
+
+            renditions = {}
+            for img_format, names in picture.renditions.items():
+                renditions[img_format] = {}
+                for width, name in names.items():
+                    if name not in sizes:
+                        missing += 1
+                        renditions[img_format][width] = name
+                        continue
+                    references += 1
+                    new_names[name] = self.migrate_file(storage, name, RENDITIONS_UPLOAD_TO, dry_run)
+                    renditions[img_format][width] = new_names[name]
+            if renditions != picture.renditions:
+                changes['renditions'] = renditions
+
+            if changes:
+                pictures_updated += 1
+                item_ids.add(picture.item_id)
+                if not dry_run:
+                    # update() skips Picture.save, nothing has to be regenerated
+                    Picture.objects.filter(pk=picture.pk).update(**changes)
+                    if 'renditions' in changes:
+                        picture.renditions = renditions
+                        picture.sync_rendition_files()
+
+        unique_bytes = {new_name: sizes[old_name] for old_name, new_name in new_names.items()}
+        referenced_bytes = sum(unique_bytes.values())
+        orphans = [name for name in sizes if name not in new_names and name not in unique_bytes]
+        kept_bytes = referenced_bytes
+        if not options['delete_orphans']:
+            kept_bytes += sum(sizes[name] for name in orphans)
+
+        if not dry_run:
+            if item_ids:
+                caching.invalidate(caching.CATALOG, *(caching.item_scope(item_id) for item_id in item_ids))
+            to_delete = [old for old, new in new_names.items() if old != new]
+            if options['delete_orphans']:
+                to_delete.extend(orphans)
+            Picture.delete_unreferenced(to_delete)
+
+        self.stdout.write(f"Pictures updated: {pictures_updated}")
+        self.stdout.write(f"Distinct files referenced: {len(unique_bytes)} (from {references} references)")
+        self.stdout.write(f"Unreferenced files: {len(orphans)}"
+                          + ("" if options['delete_orphans'] else " (kept, see --delete-orphans)"))
+        if missing:
+            self.stdout.write(self.style.WARNING(f"References to missing files: {missing}"))
+        reclaimed = filesizeformat(sum(sizes.values()) - kept_bytes)
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(f"Would reclaim {reclaimed}."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Reclaimed {reclaimed}."))
+
+    def migrate_file(self, storage, name, upload_to, dry_run):
+        """Store the file `name` under its content address and return the new name"""
+        content_name = os.path.join(upload_to, os.path.basename(name))
+        with storage.open(name, 'rb') as f:
+            if dry_run:
+                return storage.content_name(content_name, File(f))
+            return storage.save(content_name, File(f))
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ufo_shop.models import Item, ItemSalesSummary, News, Order, OrderItem, User
+
+# Substrings of EXPLAIN output that mean an index is used, per database vendor
+INDEX_MARKERS = {
+    'sqlite': ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY', 'USING PRIMARY KEY'),
+    'postgresql': ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan'),
+}
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN for the shop's hot queries and report whether an index is used.\n\n" \
+           "Works on SQLite and PostgreSQL. Note that on tiny tables PostgreSQL may\n" \
+           "prefer a sequential scan even when a suitable index exists."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plan', action='store_true', help="Print the full EXPLAIN output")
+
+    def get_hot_queries(self):
+        user = User.objects.order_by('pk').first()
+        user_id = user.pk if user else 0
+        cart = Order.objects.filter(status=Order.Status.IN_CART).order_by('pk').first()
+        order_id = cart.pk if cart else 0
+        item = Item.objects.order_by('pk').first()
+        item_id = item.pk if item else 0
+
+        return [
+            ('Shop listing (ItemListView)',
+             Item.objects.filter(is_active=True, is_variant=False).order_by('-created_at', '-id')[:13]),
+            ('Cart lookup (cart_info)',
+             Order.objects.filter(user_id=user_id, status=Order.Status.IN_CART)),
+            ('Cart line (AddToCartView)',
+             OrderItem.objects.filter(order_id=order_id, item_id=item_id)),
+            ('Completed orders by date (stats)',
+             Order.objects.filter(status__in=Order.COMPLETED_STATUSES).order_by('created_at')),
+            ('Latest news (HomeView)',
+             News.objects.filter(is_active=True).order_by('-published_at')[:5]),
+            ('Top sellers (HomeView)',
+             ItemSalesSummary.objects.order_by('-quantity_sold')[:6]),
+        ]
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        markers = INDEX_MARKERS.get(vendor)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"== EXPLAIN hot queries ({vendor}) =="))
+        if markers is None:
+            self.stdout.write(self.style.WARNING(f"Index detection is not implemented for '{vendor}', showing raw plans."))
+
+        missing = 0
+        for name, queryset in self.get_hot_queries():
+            plan = queryset.explain()
+            if markers is None:
+                self.stdout.write(f"\n{name}\n{plan}")
+                continue
+
+            uses_index = any(marker in plan for marker in markers)
+            if uses_index:
+                self.stdout.write(self.style.SUCCESS(f"[index]    {name}"))
+            else:
+                missing += 1
+                self.stdout.write(self.style.WARNING(f"[no index] {name}"))
+            if options['verbose_plan'] or not uses_index:
+                for line in plan.splitlines():
+                    self.stdout.write(f"    {line}")
+
+        if markers is not None:
+            if missing:
+                self.stdout.write(self.style.WARNING(f"\n{missing} hot query(ies) do not use an index."))
+            else:
+                self.stdout.write(self.style.SUCCESS("\nAll hot queries use an index."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ufo_shop.models import ItemSalesSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the top sellers leaderboard from completed orders.\n\n" \
+           "Order.save() keeps the leaderboard up to date incrementally; run this\n" \
+           "on a schedule (e.g. nightly cron) to correct drift caused by bulk\n" \
+           "updates or admin edits of order items."
+
+    def handle(self, *args, **options):
+        rows = ItemSalesSummary.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Top sellers leaderboard rebuilt ({rows} item(s))."))
@@ -0,0 +1,122 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from ufo_shop.management.pool import worker_pool
+from ufo_shop.models import Picture
+
+
+def _regenerate(picture_id, missing_only):
+    """Runs in a pool process. Returns (picture id, processed, error message)"""
+    try:
+        picture = Picture.objects.get(pk=picture_id)
+        if missing_only:
+            if not picture.missing_derivatives():
+                return picture_id, False, None
+            picture.generate_derivatives()
+        else:
+            picture.generate_derivatives(Picture.DERIVATIVE_FIELDS)
+        return picture_id, True, None
+    except Exception as e:
+        return picture_id, False, f"{type(e).__name__}: {e}"
+
+
+class Command(BaseCommand):
+    help = "Regenerate thumbnails, square images and renditions of pictures in parallel.\n\n" \
+           "Pictures are processed in id order and the last finished chunk is written to a\n" \
+           "checkpoint file, so an interrupted run continues where it stopped when started\n" \
+           "again with the same filters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+        parser.add_argument('--item', type=int, action='append', dest='items', help="Item id (repeatable)")
+        parser.add_argument('--merchandiser', help="Only pictures of items of this merchandiser (email)")
+        parser.add_argument('--missing-only', action='store_true',
+                            help="Only generate missing derivatives instead of regenerating all")
+        parser.add_argument('--queued', action='store_true',
+                            help="Only pictures queued for regeneration (e.g. by the admin action)")
+        parser.add_argument('--chunk-size', type=int, default=100, help="Pictures per checkpoint")
+        parser.add_argument('--checkpoint', default=str(settings.BASE_DIR / 'regenerate_pictures.checkpoint'),
+                            help="Checkpoint file path")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+
+    def handle(self, *args, **options):
+        filters = {key: options[key] for key in ('items', 'merchandiser', 'missing_only', 'queued')}
+        last_pk = 0 if options['restart'] else self.read_checkpoint(options['checkpoint'], filters)
+        if last_pk:
+            self.stdout.write(f"Resuming after picture {last_pk} (use --restart to start over)")
+
+        picture_ids = list(self.get_queryset(filters).filter(pk__gt=last_pk).order_by('pk')
+                           .values_list('pk', flat=True))
+        total = len(picture_ids)
+        self.stdout.write(f"Pictures to process: {total} with {options['workers']} workers")
+        if not total:
+            self.clear_checkpoint(options['checkpoint'])
+            return
+
+        processed = skipped = 0
+        failures = []
+        started = time.perf_counter()
+        with worker_pool(options['workers']) as pool:
+            for start in range(0, total, options['chunk_size']):
+                chunk = picture_ids[start:start + options['chunk_size']]
+                for picture_id, done, error in pool.map(_regenerate, chunk, [options['missing_only']] * len(chunk)):
+                    if error:
+                        failures.append((picture_id, error))
+                        self.stderr.write(f"Picture {picture_id}: {error}")
+                    elif done:
+                        processed += 1
+                    else:
+                        skipped += 1
+                self.write_checkpoint(options['checkpoint'], filters, chunk[-1])
+
+                finished = start + len(chunk)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{finished}/{total} pictures, {processed / elapsed:.1f} images/s")
+
+        self.clear_checkpoint(options['checkpoint'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Processed: {processed}, skipped (nothing missing): {skipped}, failed: {len(failures)}")
+        self.stdout.write(f"Time: {elapsed:.1f} s, {processed / elapsed:.1f} images/s")
+        if failures:
+            self.stdout.write(self.style.WARNING(
+                f"Failed pictures: {', '.join(str(picture_id) for picture_id, _ in failures)}"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("Pictures regenerated."))
+
+    def get_queryset(self, filters):
+        pictures = Picture.objects.exclude(picture='')
+        if filters['items']:
+            pictures = pictures.filter(item_id__in=filters['items'])
+        if filters['merchandiser']:
+            pictures = pictures.filter(item__merchandiser__email=filters['merchandiser'])
+        if filters['queued']:
+            pictures = pictures.filter(derivatives_status=Picture.DerivativesStatus.PENDING)
+        if filters['missing_only']:
+            pictures = pictures.filter(Q(thumbnail='') | Q(thumbnail__isnull=True) | Q(square_image='')
+                                       | Q(square_image__isnull=True) | Q(renditions={}))
+        return pictures
+
+    def read_checkpoint(self, path, filters):
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if checkpoint.get('filters') != filters:
+            self.stdout.write(self.style.WARNING("Ignoring checkpoint written with different filters"))
+            return 0
+        return checkpoint['last_pk']
+
+    def write_checkpoint(self, path, filters, last_pk):
+        with open(path, 'w') as f:
+            json.dump({'filters': filters, 'last_pk': last_pk}, f)
+
+    def clear_checkpoint(self, path):
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,104 @@
+import os
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from ufo_shop import invoice_pdf
+from ufo_shop.management.pool import render_invoices
+from ufo_shop.models import Invoice
+
+
+class Command(BaseCommand):
+    help = "Render invoice PDFs in parallel worker processes and optionally export them.\n\n" \
+           "By default only invoices without a ready PDF are rendered; --all renders the\n" \
+           "selected invoices again, keeping the PDFs whose invoice did not change. With\n" \
+           "--zip or --merged the PDFs of all selected invoices are written to one ZIP\n" \
+           "archive or one merged PDF afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            help="Invoices created on or after this date (YYYY-MM-DD)")
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help="Invoices created on or before this date (YYYY-MM-DD)")
+        parser.add_argument('--issuer', type=int, action='append', dest='issuers', help="Issuer id (repeatable)")
+        parser.add_argument('--queued', action='store_true',
+                            help="Only render invoices queued for rendering (e.g. by the admin actions)")
+        parser.add_argument('--all', action='store_true',
+                            help="Render selected invoices that have a PDF again if their content changed")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of worker processes")
+        parser.add_argument('--zip', help="Write the PDFs of the selected invoices to this ZIP file")
+        parser.add_argument('--merged', help="Write the selected invoices to this single PDF file")
+
+    def handle(self, *args, **options):
+        if options['zip'] and options['merged']:
+            raise CommandError("Use either --zip or --merged")
+
+        invoices = self.get_queryset(options)
+        if options['queued']:
+            to_render = invoices.filter(pdf_status=Invoice.PdfStatus.PENDING)
+        elif options['all']:
+            # Unfinished claims are left alone; ensure_pdf() waits for them
+            invoices.exclude(pdf_status=Invoice.PdfStatus.PROCESSING).update(pdf_status=Invoice.PdfStatus.PENDING)
+            to_render = invoices
+        else:
+            to_render = invoices.exclude(pdf_status=Invoice.PdfStatus.READY, pdf_file__gt='')
+        invoice_ids = list(to_render.order_by('pk').values_list('pk', flat=True))
+
+        failures = self.render(invoice_ids, options['workers']) if invoice_ids else []
+        if not invoice_ids:
+            self.stdout.write("No invoices to render.")
+
+        if options['zip'] or options['merged']:
+            self.export(invoices.exclude(pk__in=failures), options['zip'], options['merged'])
+        if failures:
+            self.stdout.write(self.style.WARNING(
+                f"Failed invoices (rendered again by the next run or on download): "
+                f"{', '.join(str(invoice_id) for invoice_id in failures)}"
+            ))
+
+    def get_queryset(self, options):
+        invoices = Invoice.objects.all()
+        if options['date_from']:
+            invoices = invoices.filter(created_at__date__gte=options['date_from'])
+        if options['date_to']:
+            invoices = invoices.filter(created_at__date__lte=options['date_to'])
+        if options['issuers']:
+            invoices = invoices.filter(issuer_id__in=options['issuers'])
+        return invoices
+
+    def render(self, invoice_ids, workers):
+        """Render the invoices in a process pool, reporting each one; returns the ids of failed invoices"""
+        numbers = dict(Invoice.objects.filter(pk__in=invoice_ids).values_list('pk', 'invoice_number'))
+        self.stdout.write(f"Rendering {len(invoice_ids)} invoices with {workers} workers")
+        durations = []
+        failures = []
+        started = time.perf_counter()
+        for invoice_id, ready, seconds, error in render_invoices(invoice_ids, workers):
+            if ready:
+                durations.append(seconds)
+                self.stdout.write(f"{numbers[invoice_id]:<20} {seconds * 1000:8.1f} ms")
+            else:
+                failures.append(invoice_id)
+                self.stderr.write(f"{numbers[invoice_id]:<20} {seconds * 1000:8.1f} ms  FAILED: {error}")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Rendered: {len(durations)}, failed: {len(failures)} in {elapsed:.1f} s "
+                          f"({len(durations) / elapsed:.1f} invoices/s)")
+        if durations:
+            self.stdout.write(f"Per invoice: mean {sum(durations) / len(durations) * 1000:.1f} ms, "
+                              f"max {max(durations) * 1000:.1f} ms")
+        return failures
+
+    def export(self, invoices, zip_path, merged_path):
+        invoices = invoices.filter(pdf_status=Invoice.PdfStatus.READY) \
+            .exclude(Q(pdf_file='') | Q(pdf_file__isnull=True)).order_by('created_at', 'pk')
+        if zip_path:
+            path, chunks = zip_path, invoice_pdf.iter_zip(invoices.iterator())
+        else:
+            path, chunks = merged_path, invoice_pdf.iter_merged_pdf(invoices.iterator())
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {invoices.count()} invoices to {path}"))
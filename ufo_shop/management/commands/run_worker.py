@@ -0,0 +1,54 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from ufo_shop import invoice_pdf
+from ufo_shop.tasks import TASK_HANDLERS
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run the background worker that processes queued work (see ufo_shop/tasks.py).\n\n" \
+           "Run it next to gunicorn, e.g. as a separate systemd service. Several\n" \
+           "workers may run at the same time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process everything that is queued and exit")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--batch-size', type=int, default=10, help="Rows claimed per handler call")
+
+    def handle(self, *args, **options):
+        if options['verbosity'] > 1:
+            logging.basicConfig(level=logging.INFO)
+
+        # The template and xhtml2pdf imports are loaded once, not by the first invoice
+        invoice_pdf.warm_up()
+        self.stdout.write(self.style.SUCCESS("Worker started."))
+        try:
+            while True:
+                processed = self.run_handlers(options['batch_size'])
+                if processed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS("Worker stopped."))
+
+    def run_handlers(self, batch_size):
+        processed = 0
+        for handler in TASK_HANDLERS:
+            try:
+                count = handler(limit=batch_size)
+            except Exception:
+                # E.g. the database or SMTP server is down; the other handlers and later loops carry on
+                logger.exception('Task handler %s failed', handler.__name__)
+                self.stderr.write(f"{handler.__name__} failed, see the log")
+                continue
+            if count:
+                self.stdout.write(f"{handler.__name__}: {count}")
+            processed += count
+        return processed
@@ -0,0 +1,59 @@
+"""
+Process pools of the bulk management commands (render_invoices,
+backfill_invoices, regenerate_pictures) and the invoice admin actions.
+
+worker_pool() starts the processes with Django set up and, optionally, a
+warm-up function run once per process. Forked processes inherit what the
+parent warmed up, so it is done once per pool instead. render_invoices()
+renders invoice PDFs in such a pool.
+"""
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.db import connections
+from django.utils.module_loading import import_string
+
+
+def _init_worker(warm_up):
+    # Spawned workers start without Django; forked ones already have it set up
+    django.setup()
+    if warm_up:
+        import_string(warm_up)()
+
+
+@contextmanager
+def worker_pool(workers, warm_up=None, start_method=None):
+    """ProcessPoolExecutor of `workers` processes, each calling the function at dotted path `warm_up` first.
+
+    `start_method` is a multiprocessing start method, the platform's default if None.
+    """
+    context = multiprocessing.get_context(start_method)
+    if warm_up and context.get_start_method() == 'fork':
+        import_string(warm_up)()
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(warm_up,)) as pool:
+        yield pool
+
+
+def render_invoice(invoice_id):
+    """Runs in a pool process. Returns (invoice id, ready, seconds, error message)"""
+    from ufo_shop.models import Invoice
+
+    started = time.perf_counter()
+    try:
+        # ensure_pdf() claims the invoice, so a running `run_worker` never renders it a second time
+        ready = Invoice.objects.get(pk=invoice_id).ensure_pdf()
+        return invoice_id, ready, time.perf_counter() - started, None if ready else "PDF not rendered"
+    except Exception as e:
+        return invoice_id, False, time.perf_counter() - started, f"{type(e).__name__}: {e}"
+
+
+def render_invoices(invoice_ids, workers, chunksize=4, start_method=None):
+    """Render the PDFs of `invoice_ids` in a worker_pool; yields render_invoice() results in order"""
+    with worker_pool(workers, warm_up='ufo_shop.invoice_pdf.warm_up', start_method=start_method) as pool:
+        yield from pool.map(render_invoice, invoice_ids, chunksize=chunksize)
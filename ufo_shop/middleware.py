@@ -7,6 +7,9 @@ string by the WSGI server. Django rejects such values as invalid HTTP_HOST.
 
 This middleware normalizes HTTP_HOST by taking the first value before a comma.
 It is intentionally minimal and only prepended in production settings.
+
+CartMiddleware attaches a lazily loaded, request-scoped cart as `request.cart`
+(see ufo_shop.cart). It must come after AuthenticationMiddleware.
 """
 from typing import Callable
 
@@ -23,3 +26,13 @@ class NormalizeHostMiddleware:
             # Overwrite the header in META so Django sees a valid host
             request.META['HTTP_HOST'] = first
         return self.get_response(request)
+
+
+class CartMiddleware:
+    def __init__(self, get_response: Callable):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from ufo_shop.cart import Cart
+        request.cart = Cart(request)
+        return self.get_response(request)
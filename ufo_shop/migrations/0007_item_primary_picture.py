@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ufo_shop', '0006_user_merchandiser_request_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='primary_picture',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='ufo_shop.picture', verbose_name='Primary Picture'),
+        ),
+    ]
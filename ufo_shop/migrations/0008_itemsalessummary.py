@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_item_sales_summary(apps, schema_editor):
+    OrderItem = apps.get_model('ufo_shop', 'OrderItem')
+    ItemSalesSummary = apps.get_model('ufo_shop', 'ItemSalesSummary')
+    # PAID, SHIPPED, FULFILLED
+    quantities = OrderItem.objects.filter(
+        order__status__in=[3, 4, 5]
+    ).values('item_id').annotate(quantity=models.Sum('amount'))
+    ItemSalesSummary.objects.bulk_create(
+        [ItemSalesSummary(item_id=row['item_id'], quantity_sold=row['quantity']) for row in quantities]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ufo_shop', '0007_item_primary_picture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemSalesSummary',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_summary', serialize=False, to='ufo_shop.item', verbose_name='Item')),
+                ('quantity_sold', models.IntegerField(default=0, verbose_name='Quantity Sold')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'verbose_name': 'Item Sales Summary',
+                'verbose_name_plural': 'Item Sales Summaries',
+                'indexes': [models.Index(fields=['-quantity_sold'], name='itemsales_quantity_sold_idx')],
+            },
+        ),
+        migrations.RunPython(populate_item_sales_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+IN_CART = 1
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    """Merge extra IN_CART orders of a user into the oldest one so the unique constraint can be added.
+
+    Lines of the same item are merged into one with the summed amount, like adding an item
+    that is already in the cart does.
+    """
+    Order = apps.get_model('ufo_shop', 'Order')
+    OrderItem = apps.get_model('ufo_shop', 'OrderItem')
+    user_ids = Order.objects.filter(status=IN_CART).values('user_id').annotate(
+        carts=models.Count('id')
+    ).filter(carts__gt=1).values_list('user_id', flat=True)
+    for user_id in user_ids:
+        cart, *duplicates = Order.objects.filter(user_id=user_id, status=IN_CART).order_by('id')
+        OrderItem.objects.filter(order__in=duplicates).update(order=cart)
+        Order.objects.filter(pk__in=[duplicate.pk for duplicate in duplicates]).delete()
+
+        lines = {}
+        for line in OrderItem.objects.filter(order=cart).order_by('id'):
+            first = lines.setdefault(line.item_id, line)
+            if first is not line:
+                first.amount += line.amount
+                first.pickup_location_id = first.pickup_location_id or line.pickup_location_id
+                first.save(update_fields=['amount', 'pickup_location'])
+                line.delete()
+
+
+# A migration of its own, so it commits in its own transaction: on PostgreSQL the deferred foreign
+# key checks of the deleted orders must not be pending when 0010_hot_path_indexes creates the
+# partial unique index
+class Migration(migrations.Migration):
+    dependencies = [
+        ('ufo_shop', '0008_itemsalessummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+    ]
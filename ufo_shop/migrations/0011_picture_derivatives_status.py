@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ufo_shop', '0010_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='picture',
+            name='derivatives_claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Derivatives Claimed At'),
+        ),
+        migrations.AddField(
+            model_name='picture',
+            name='derivatives_status',
+            field=models.IntegerField(choices=[(1, 'Pending'), (2, 'Processing'), (3, 'Ready'), (4, 'Failed')], default=3, verbose_name='Derivatives Status'),
+        ),
+        migrations.AddIndex(
+            model_name='picture',
+            index=models.Index(condition=models.Q(('derivatives_status', 3), _negated=True), fields=['derivatives_status'], name='picture_derivatives_status_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ufo_shop', '0011_picture_derivatives_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='picture',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Renditions'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:25
+
+import ufo_shop.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ufo_shop', '0012_picture_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='picture',
+            name='picture',
+            field=models.ImageField(storage=ufo_shop.storage.picture_storage, upload_to='item_pictures/originals/', verbose_name='Original Image'),
+        ),
+        migrations.AlterField(
+            model_name='picture',
+            name='square_image',
+            field=models.ImageField(blank=True, null=True, storage=ufo_shop.storage.picture_storage, upload_to='item_pictures/squares/', verbose_name='Squared Image (e.g., 500x500)'),
+        ),
+        migrations.AlterField(
+            model_name='picture',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=ufo_shop.storage.picture_storage, upload_to='item_pictures/thumbnails/', verbose_name='Thumbnail (150x150)'),
+        ),
+    ]
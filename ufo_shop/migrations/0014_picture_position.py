@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ufo_shop', '0013_content_addressed_pictures'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='picture',
+            options={'ordering': ['position', 'pk'], 'verbose_name': 'Picture', 'verbose_name_plural': 'Pictures'},
+        ),
+        migrations.AddField(
+            model_name='picture',
+            name='position',
+            field=models.PositiveIntegerField(default=0, verbose_name='Position'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:37
+
+from django.db import migrations, models
+
+
+def mark_existing_pdfs_ready(apps, schema_editor):
+    Invoice = apps.get_model('ufo_shop', 'Invoice')
+    # READY; invoices without a PDF stay PENDING for the worker
+    Invoice.objects.exclude(pdf_file='').exclude(pdf_file__isnull=True).update(pdf_status=3)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ufo_shop', '0014_picture_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='PDF Claimed At'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_status',
+            field=models.IntegerField(choices=[(1, 'Pending'), (2, 'Processing'), (3, 'Ready'), (4, 'Failed')], default=1, verbose_name='PDF Status'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('pdf_status', 3), _negated=True), fields=['pdf_status'], name='invoice_pdf_status_idx'),
+        ),
+        migrations.RunPython(mark_existing_pdfs_ready, migrations.RunPython.noop),
+    ]
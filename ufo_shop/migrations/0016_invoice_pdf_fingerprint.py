@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ufo_shop', '0015_invoice_pdf_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64, verbose_name='PDF Fingerprint'),
+        ),
+    ]
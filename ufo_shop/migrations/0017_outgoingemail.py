@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-18 14:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('ufo_shop', '0016_invoice_pdf_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('template', models.CharField(max_length=50, verbose_name='Template')),
+                ('target_id', models.PositiveBigIntegerField(verbose_name='Target ID')),
+                ('context', models.JSONField(blank=True, default=dict, verbose_name='Context')),
+                ('idempotency_key', models.CharField(max_length=200, unique=True, verbose_name='Idempotency Key')),
+                ('status', models.IntegerField(choices=[(1, 'Pending'), (2, 'Processing'), (3, 'Sent'), (4, 'Failed')], default=1, verbose_name='Status')),
+                ('claimed_at', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Claimed At')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next Attempt At')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sent At')),
+                ('target_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype', verbose_name='Target Type')),
+            ],
+            options={
+                'verbose_name': 'Outgoing Email',
+                'verbose_name_plural': 'Outgoing Emails',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 3), _negated=True), fields=['status', 'next_attempt_at'], name='outgoingemail_status_idx')],
+            },
+        ),
+    ]
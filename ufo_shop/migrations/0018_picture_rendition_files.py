@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:37
+
+import django.db.models.deletion
+import ufo_shop.storage
+from django.db import migrations, models
+
+
+def fill_rendition_files(apps, schema_editor):
+    """Create the PictureRendition rows of the renditions generated so far"""
+    Picture = apps.get_model('ufo_shop', 'Picture')
+    PictureRendition = apps.get_model('ufo_shop', 'PictureRendition')
+    rows = []
+    for picture in Picture.objects.exclude(renditions={}).only('pk', 'renditions').iterator():
+        names = {name for names_by_width in picture.renditions.values() for name in names_by_width.values()}
+        rows.extend(PictureRendition(picture_id=picture.pk, name=name) for name in names)
+    PictureRendition.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ufo_shop', '0017_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='picture',
+            name='picture',
+            field=models.ImageField(db_index=True, storage=ufo_shop.storage.picture_storage, upload_to='item_pictures/originals/', verbose_name='Original Image'),
+        ),
+        migrations.AlterField(
+            model_name='picture',
+            name='square_image',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=ufo_shop.storage.picture_storage, upload_to='item_pictures/squares/', verbose_name='Squared Image (e.g., 500x500)'),
+        ),
+        migrations.AlterField(
+            model_name='picture',
+            name='thumbnail',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=ufo_shop.storage.picture_storage, upload_to='item_pictures/thumbnails/', verbose_name='Thumbnail (150x150)'),
+        ),
+        migrations.CreateModel(
+            name='PictureRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=255, verbose_name='Storage Name')),
+                ('picture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rendition_files', to='ufo_shop.picture', verbose_name='Picture')),
+            ],
+            options={
+                'verbose_name': 'Picture Rendition',
+                'verbose_name_plural': 'Picture Renditions',
+                'constraints': [models.UniqueConstraint(fields=('picture', 'name'), name='picturerendition_picture_name_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_rendition_files, migrations.RunPython.noop),
+    ]
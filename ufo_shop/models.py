@@ -3,19 +3,37 @@ from PIL import Image as PilImage, ImageDraw
 from io import BytesIO
 from django.core.files.base import ContentFile
 import os
-import qrcode
 import base64
+import functools
+from collections import Counter
+import hashlib
+import json
 import math
-from qrcode.image.styledpil import StyledPilImage
-from qrcode.image.styles.moduledrawers import HorizontalBarsDrawer
+import time
 
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.db import models
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.html import mark_safe
+from django.utils.module_loading import import_string
+from django.templatetags.static import static
 from django.conf import settings
 
+from ufo_shop import caching, imaging
+from ufo_shop.claiming import claim
+from ufo_shop.storage import picture_storage
+
 THUMBNAIL_SIZE = 150
 SQUARE_IMAGE_SIZE = 1024
+# Shown instead of a picture whose derivatives are still being generated
+PICTURE_PENDING_PLACEHOLDER = 'media/icons/image-pending.svg'
+# Storage directory of the srcset renditions (see Picture.renditions)
+RENDITIONS_UPLOAD_TO = 'item_pictures/renditions/'
 
 # Bank account details for QR code payment
 BANK_ACCOUNT = {
@@ -97,6 +115,38 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def _item_ids(self):
+        return list(self.item_set.values_list('pk', flat=True)) if self.pk else []
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_items(self._item_ids())
+
+    def delete(self, *args, **kwargs):
+        # Collect the affected items before the category is gone, invalidate once it is:
+        # a card rendered in between would otherwise be cached with the category under the new version
+        item_ids = self._item_ids()
+        result = super().delete(*args, **kwargs)
+        invalidate_items(item_ids)
+        return result
+
+
+def invalidate_items(item_ids):
+    """Invalidate the catalog and the card fragments of `item_ids`"""
+    caching.invalidate(caching.CATALOG, *[caching.item_scope(item_id) for item_id in item_ids])
+
+
+class ItemQuerySet(models.QuerySet):
+    def for_cards(self):
+        """Prefetch everything item_card.html needs so a page of cards costs a constant number of queries."""
+        return self.select_related('merchandiser', 'primary_picture').prefetch_related('category')
+
+    def refresh_primary_pictures(self):
+        """Point primary_picture of every item in the queryset at its first picture (by position)."""
+        first_picture = Picture.objects.filter(item=models.OuterRef('pk')).order_by('position', 'pk').values('pk')[:1]
+        return self.update(primary_picture=models.Subquery(first_picture))
+
+
 class Item(models.Model):
     name = models.CharField("Item Name", max_length=255)
     merchandiser = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Merchandiser")
@@ -116,10 +166,22 @@ class Item(models.Model):
                                    related_name='variants', verbose_name="Parent Item")
     is_variant = models.BooleanField("Is Variant", default=False)
     color = models.CharField("Color", max_length=50, blank=True, null=True)
+    # Denormalized pointer to the picture shown on listing cards, maintained by Picture.save/delete.
+    # Item.save() never writes it.
+    primary_picture = models.ForeignKey('Picture', on_delete=models.SET_NULL, null=True, blank=True,
+                                        related_name='+', editable=False, verbose_name="Primary Picture")
+
+    objects = ItemQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Item"
         verbose_name_plural = "Items"
+        indexes = [
+            models.Index(fields=['is_active', 'is_variant'], name='item_active_variant_idx'),
+            # Shop listing: active parent items, newest first (matches the cursor pagination ordering)
+            models.Index(fields=['-created_at', '-id'], name='item_shop_listing_idx',
+                         condition=models.Q(is_active=True, is_variant=False)),
+        ]
 
     def __str__(self):
         if self.color and self.is_variant:
@@ -135,6 +197,28 @@ class Item(models.Model):
             # If this is a parent, get all variants
             return self.variants.all()
 
+    def _primary_picture_url(self, *fields):
+        picture = self.primary_picture
+        if picture is None:
+            return ''
+        for field in fields:
+            image = getattr(picture, field)
+            if image:
+                return image.url
+        if picture.derivatives_in_progress:
+            return static(PICTURE_PENDING_PLACEHOLDER)
+        return ''
+
+    @property
+    def primary_image_url(self):
+        """URL of the image shown on listing cards (square image, falling back to the thumbnail)"""
+        return self._primary_picture_url('square_image', 'thumbnail')
+
+    @property
+    def primary_thumbnail_url(self):
+        """URL of the small preview image (thumbnail, falling back to the square image)"""
+        return self._primary_picture_url('thumbnail', 'square_image')
+
     def has_variants(self):
         """Check if this item has color variants"""
         return self.variants.exists()
@@ -147,6 +231,60 @@ class Item(models.Model):
         """Override save to automatically calculate price with service fee"""
         self.price = self.calculate_price_with_service_fee()
         super().save(*args, **kwargs)
+        caching.invalidate(caching.CATALOG, caching.item_scope(self.pk))
+        self.__dict__.pop('_cache_version', None)
+
+    def delete(self, *args, **kwargs):
+        item_id = self.pk
+        result = super().delete(*args, **kwargs)
+        caching.invalidate(caching.CATALOG, caching.item_scope(item_id))
+        return result
+
+    def reorder_pictures(self, positions):
+        """Reorder the item's pictures by {picture id: position} and make the first one primary.
+
+        Positions only need to be comparable; pictures missing from `positions` or
+        sharing a position keep their current relative order.
+        """
+        pictures = list(self.pictures.all())
+        pictures.sort(key=lambda picture: positions.get(picture.pk, picture.position))
+        changed = [picture for position, picture in enumerate(pictures) if picture.position != position]
+        if not changed:
+            return
+        for position, picture in enumerate(pictures):
+            picture.position = position
+        Picture.objects.bulk_update(changed, ['position'])
+        Item.objects.filter(pk=self.pk).refresh_primary_pictures()
+        self.refresh_from_db(fields=['primary_picture'])
+        caching.invalidate(caching.CATALOG, caching.item_scope(self.pk))
+
+    @property
+    def cache_version(self):
+        """Version of this item's cached card fragment, bumped by item, category and picture changes.
+
+        caching.prime_card_versions() fetches it for a whole page of cards at once.
+        """
+        if not hasattr(self, '_cache_version'):
+            self._cache_version = caching.get_versions([caching.item_scope(self.pk)])[0]
+        return self._cache_version
+
+
+@receiver(m2m_changed, sender=Item.category.through)
+def item_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate items whose categories changed.
+
+    Item.save() invalidates before a form saves the categories, so a card rendered in
+    between would be cached with the old ones under the item's new version.
+    """
+    if action == 'pre_clear' and reverse:
+        instance._cleared_item_ids = instance._item_ids()
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            invalidate_items([instance.pk])
+        elif action == 'post_clear':
+            invalidate_items(instance.__dict__.pop('_cleared_item_ids', []))
+        else:
+            invalidate_items(pk_set)
 
 
 class Order(models.Model):
@@ -158,6 +296,9 @@ class Order(models.Model):
         FULFILLED = 5, 'Fulfilled'
         CANCELLED = 6, 'Cancelled'
 
+    # Statuses whose items count as sold
+    COMPLETED_STATUSES = (Status.PAID, Status.SHIPPED, Status.FULFILLED)
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Customer")
     status = models.IntegerField("Status", choices=Status.choices, default=Status.IN_CART)
 
@@ -191,13 +332,44 @@ class Order(models.Model):
     class Meta:
         verbose_name = "Order"
         verbose_name_plural = "Orders"
+        indexes = [
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
+        constraints = [
+            # A user has at most one cart
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status=1), name='order_one_cart_per_user'),
+        ]
 
     def __str__(self):
         return f'{self.user.email} - {self.id} - {self.status}'
 
-    def calculate_totals(self):
-        """Calculate subtotal and total for the order"""
-        order_items = self.orderitem_set.all()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded status so save() can detect status transitions
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        loaded_status = getattr(self, '_loaded_status', None)
+        was_completed = loaded_status in self.COMPLETED_STATUSES
+        super().save(*args, **kwargs)
+        is_completed = self.status in self.COMPLETED_STATUSES
+
+        # Keep the top sellers leaderboard in sync when the order starts or stops counting as sold
+        if was_completed != is_completed:
+            ItemSalesSummary.record_order(self, sign=1 if is_completed else -1)
+        # A cart leaving IN_CART changes the user's cart count cached in the session
+        if loaded_status != self.status:
+            caching.invalidate(caching.order_scope(self.pk))
+        self._loaded_status = self.status
+
+    def calculate_totals(self, order_items=None):
+        """Calculate subtotal and total for the order.
+        Pass already loaded order items (with their item) to avoid querying them again."""
+        if order_items is None:
+            order_items = self.orderitem_set.select_related('item')
         self.subtotal = sum(item.item.price * item.amount for item in order_items)
         # For now, shipping is free
         self.shipping_cost = 0
@@ -206,7 +378,8 @@ class Order(models.Model):
         self.total = self.subtotal + self.shipping_cost
         return self.total
 
-    def _convert_to_iban(self, account_number):
+    @staticmethod
+    def _convert_to_iban(account_number):
         """
         Convert Czech bank account number to IBAN format
         Format: CZ + check digits + bank code (4 digits) + account number (up to 16 digits)
@@ -250,7 +423,8 @@ class Order(models.Model):
         return iban
 
     def get_payment_qr_code(self):
-        """Generate a stylish QR code for payment and return as an <img> tag with base64 data URI (for web rendering)."""
+        """Generate a stylish QR code for payment and return as an <img> tag with base64 data URI
+        (for the invoice PDF and emails; web pages use the order_payment_qr URL instead)."""
         if not self.id:
             return None
 
@@ -263,8 +437,7 @@ class Order(models.Model):
 
     def _build_qr_payload(self):
         """Build the QR payload string according to Czech QR payment standard."""
-        account_number = BANK_ACCOUNT['account_number']
-        iban = self._convert_to_iban(account_number)
+        iban = bank_account_iban()
         amount = float(self.total)
         currency = BANK_ACCOUNT['currency']
         message = f"Order #{self.id} - {self.contact_email}"
@@ -272,28 +445,34 @@ class Order(models.Model):
         # Format the QR code data according to the Czech QR payment standard
         return f"SPD*1.0*ACC:{iban}*AM:{amount:.2f}*CC:{currency}*MSG:{message}*X-VS:{variable_symbol}*RN:Mates-UfoShop"
 
+    @property
+    def payment_qr_etag(self):
+        """Hash of the QR payload and renderer; changes whenever the order id, total or contact email change"""
+        return hashlib.sha256(f"{settings.PAYMENT_QR_RENDERER}:{self._build_qr_payload()}".encode()).hexdigest()
+
     def get_payment_qr_png_bytes(self) -> bytes:
-        """Generate a PNG image (bytes) for the payment QR code (suitable for email attachments)."""
+        """PNG image (bytes) of the payment QR code (suitable for email attachments).
+
+        Rendering the styled code is slow, so the PNG is cached under the hash of its
+        payload: a changed total or contact email simply misses the cache.
+        """
         if not self.id:
             return b''
-        qr_data = self._build_qr_payload()
-        qr = qrcode.QRCode(
-            version=None,
-            error_correction=qrcode.constants.ERROR_CORRECT_M,
-            box_size=6,
-            border=2,
-            image_factory=StyledPilImage,
-        )
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        img = qr.make_image(
-            module_drawer=HorizontalBarsDrawer(),
-            fill_color="black",
-            back_color="white"
-        )
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return buffered.getvalue()
+        cache_key = f'payment-qr:{self.payment_qr_etag}'
+        png_bytes = cache.get(cache_key)
+        if png_bytes is None:
+            png_bytes = self._render_payment_qr_png()
+            cache.set(cache_key, png_bytes, settings.PAYMENT_QR_CACHE_TIMEOUT)
+        return png_bytes
+
+    def _render_payment_qr_png(self):
+        return import_string(settings.PAYMENT_QR_RENDERER)(self._build_qr_payload())
+
+
+@functools.lru_cache(maxsize=None)
+def bank_account_iban():
+    """IBAN of BANK_ACCOUNT, computed once per process"""
+    return Order._convert_to_iban(BANK_ACCOUNT['account_number'])
 
 
 class OrderItem(models.Model):
@@ -306,10 +485,124 @@ class OrderItem(models.Model):
     class Meta:
         verbose_name = "Order Item"
         verbose_name_plural = "Order Items"
+        indexes = [
+            models.Index(fields=['order', 'item'], name='orderitem_order_item_idx'),
+        ]
 
     def __str__(self):
         return f'#{self.order.id} {self.item.name} - {self.amount}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the line counted in the top sellers leaderboard, see save()
+        instance._loaded_sale = (instance.__dict__.get('order_id'), instance.__dict__.get('item_id'),
+                                 instance.__dict__.get('amount'))
+        return instance
+
+    def _is_sold(self, order_id):
+        """Whether order `order_id` is completed, without a query when it is the loaded self.order"""
+        if order_id == self.order_id and OrderItem.order.is_cached(self):
+            return self.order.status in Order.COMPLETED_STATUSES
+        return Order.objects.filter(pk=order_id, status__in=Order.COMPLETED_STATUSES).exists()
+
+    def save(self, *args, **kwargs):
+        loaded_sale = getattr(self, '_loaded_sale', None)
+        super().save(*args, **kwargs)
+        # Cart counts cached in sessions are checked against this version
+        caching.invalidate(caching.order_scope(self.order_id))
+
+        # Lines of completed orders that are added or edited change the top sellers leaderboard
+        sale = (self.order_id, self.item_id, self.amount)
+        if sale != loaded_sale:
+            quantities = Counter()
+            if loaded_sale is not None and self._is_sold(loaded_sale[0]):
+                quantities[loaded_sale[1]] -= loaded_sale[2]
+            if self._is_sold(self.order_id):
+                quantities[self.item_id] += self.amount
+            ItemSalesSummary.add_quantities(quantities)
+        self._loaded_sale = sale
+
+    def delete(self, *args, **kwargs):
+        order_id, item_id, amount = getattr(self, '_loaded_sale', (self.order_id, self.item_id, self.amount))
+        is_sold = self._is_sold(order_id)
+        result = super().delete(*args, **kwargs)
+        caching.invalidate(caching.order_scope(order_id))
+        if is_sold:
+            ItemSalesSummary.add_quantities({item_id: -amount})
+        return result
+
+
+class ItemSalesSummary(models.Model):
+    """Materialized top sellers leaderboard: sold quantity per item.
+
+    Updated incrementally by Order.save() when an order starts or stops counting
+    as sold and by OrderItem.save()/delete() when lines of a completed order
+    change. Bulk updates and deletes (QuerySet.update(), cascades) bypass those,
+    so the refresh_top_sellers management command rebuilds it periodically.
+    """
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True,
+                                related_name='sales_summary', verbose_name="Item")
+    quantity_sold = models.IntegerField("Quantity Sold", default=0)
+    updated_at = models.DateTimeField("Updated At", auto_now=True)
+
+    class Meta:
+        verbose_name = "Item Sales Summary"
+        verbose_name_plural = "Item Sales Summaries"
+        indexes = [
+            models.Index(fields=['-quantity_sold'], name='itemsales_quantity_sold_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.item.name} - {self.quantity_sold}'
+
+    @classmethod
+    def record_order(cls, order, sign=1):
+        """Add (sign=1) or subtract (sign=-1) the quantities of an order to the leaderboard"""
+        quantities = order.orderitem_set.values('item_id').annotate(quantity=models.Sum('amount'))
+        cls.add_quantities({row['item_id']: sign * row['quantity'] for row in quantities})
+
+    @classmethod
+    def add_quantities(cls, quantities):
+        """Add {item id: quantity} (negative to subtract) to the leaderboard"""
+        quantities = {item_id: quantity for item_id, quantity in quantities.items() if quantity}
+        if not quantities:
+            return
+        with transaction.atomic():
+            for item_id, quantity in quantities.items():
+                summary, created = cls.objects.get_or_create(item_id=item_id)
+                cls.objects.filter(pk=summary.pk).update(quantity_sold=models.F('quantity_sold') + quantity)
+        caching.invalidate(caching.HOME)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute the whole leaderboard from completed orders. Returns the number of rows."""
+        quantities = OrderItem.objects.filter(
+            order__status__in=Order.COMPLETED_STATUSES
+        ).values('item_id').annotate(quantity=models.Sum('amount'))
+        summaries = [cls(item_id=row['item_id'], quantity_sold=row['quantity']) for row in quantities]
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(summaries)
+        caching.invalidate(caching.HOME)
+        return len(summaries)
+
+    @classmethod
+    def top_items(cls, limit=6):
+        """Return up to `limit` active items ordered by sold quantity, padded with newest items"""
+        items = [
+            summary.item for summary in cls.objects.filter(
+                item__is_active=True, quantity_sold__gt=0
+            ).select_related('item__primary_picture').order_by('-quantity_sold')[:limit]
+        ]
+        if len(items) < limit:
+            items += list(
+                Item.objects.filter(is_active=True).exclude(
+                    pk__in=[item.pk for item in items]
+                ).select_related('primary_picture').order_by('-created_at')[:limit - len(items)]
+            )
+        return items
+
 
 class Picture(models.Model):
     # picture = models.ImageField("Image", upload_to='ufo_shop/static/shop/images/')
@@ -326,26 +619,59 @@ class Picture(models.Model):
         blank=True,
         null=True,
     )
+    # Files are content-addressed and may be shared by several pictures, see ufo_shop/storage.py
+    # Indexed for Picture.is_referenced()
     picture = models.ImageField(
         "Original Image",
-        upload_to='item_pictures/originals/'
+        upload_to='item_pictures/originals/',
+        storage=picture_storage,
+        db_index=True
     )
     thumbnail = models.ImageField(
         "Thumbnail (150x150)",
         upload_to='item_pictures/thumbnails/',
+        storage=picture_storage,
         null=True,
-        blank=True
+        blank=True,
+        db_index=True
     )
     square_image = models.ImageField(
         "Squared Image (e.g., 500x500)",
         upload_to='item_pictures/squares/',
+        storage=picture_storage,
         null=True,
-        blank=True
+        blank=True,
+        db_index=True
     )
 
+    # Display order within the item; the first picture is the item's primary picture
+    position = models.PositiveIntegerField("Position", default=0)
+
+    # Everything generated from the original
+    DERIVATIVE_FIELDS = ('thumbnail', 'square_image', 'renditions')
+
+    class DerivativesStatus(models.IntegerChoices):
+        PENDING = 1, 'Pending'
+        PROCESSING = 2, 'Processing'
+        READY = 3, 'Ready'
+        FAILED = 4, 'Failed'
+
+    # Square renditions for srcset, {format: {width: storage name}}; see PICTURE_RENDITION_WIDTHS/FORMATS
+    renditions = models.JSONField("Renditions", default=dict, blank=True, editable=False)
+
+    # Thumbnail/square generation state; pending pictures are picked up by `manage.py run_worker`
+    derivatives_status = models.IntegerField("Derivatives Status", choices=DerivativesStatus.choices,
+                                             default=DerivativesStatus.READY)
+    derivatives_claimed_at = models.DateTimeField("Derivatives Claimed At", blank=True, null=True, editable=False)
+
     class Meta:
         verbose_name = "Picture"
         verbose_name_plural = "Pictures"
+        ordering = ['position', 'pk']
+        indexes = [
+            models.Index(fields=['derivatives_status'], name='picture_derivatives_status_idx',
+                         condition=~models.Q(derivatives_status=3)),
+        ]
 
     def __str__(self):
         # Provide a more descriptive string representation
@@ -353,24 +679,93 @@ class Picture(models.Model):
             return f"Picture for {self.item.name} ({os.path.basename(self.picture.name if self.picture else (self.thumbnail.name if self.thumbnail else self.square_image.name))})"
         return os.path.basename(self.picture.name if self.picture else (self.thumbnail.name if self.thumbnail else self.square_image.name))
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Where the picture was when loaded: moving it changes the primary picture of the items, see save()
+        instance._loaded_placement = (instance.__dict__.get('item_id'), instance.__dict__.get('position'))
+        return instance
+
     def delete(self, *args, **kwargs):
-        # Store paths to image files
-        thumbnail_path = self.thumbnail.path if self.thumbnail else None
-        square_image_path = self.square_image.path if self.square_image else None
-        picture_path = self.picture.path if self.picture else None
+        # Store names of the image files
+        file_names = self.file_names()
+        item_id = self.item_id
 
         # Delete the model instance
         super().delete(*args, **kwargs)
 
-        # Delete the image files from storage
-        if thumbnail_path and os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
+        # If this was the item's primary picture (now nulled by SET_NULL), promote the next one
+        Item.objects.filter(pk=item_id, primary_picture__isnull=True).refresh_primary_pictures()
+        self._refresh_cached_item()
+        caching.invalidate(caching.CATALOG, caching.item_scope(item_id))
+
+        # Delete the image files no other picture shares
+        self.delete_unreferenced(file_names)
+
+    def _refresh_cached_item(self):
+        """Reload primary_picture of the item instance this picture holds after an UPDATE changed it,
+        so that saving the instance later does not undo the change."""
+        if Picture.item.is_cached(self):
+            self.item.refresh_from_db(fields=['primary_picture'])
 
-        if square_image_path and os.path.exists(square_image_path):
-            os.remove(square_image_path)
+    @classmethod
+    def create_batch(cls, item, files, user=None):
+        """Create pictures for all uploaded `files` with a single bulk insert.
 
-        if picture_path and os.path.exists(picture_path):
-            os.remove(picture_path)
+        The pictures are appended after the item's existing pictures in the given
+        order. Their derivatives are queued for the worker together, or generated
+        one after another right away without PICTURE_DERIVATIVES_ASYNC.
+        """
+        last_position = item.pictures.aggregate(models.Max('position'))['position__max']
+        first_position = 0 if last_position is None else last_position + 1
+        pictures = cls.objects.bulk_create([
+            cls(item=item, user=user, picture=f, position=first_position + index,
+                derivatives_status=cls.DerivativesStatus.PENDING)
+            for index, f in enumerate(files)
+        ])
+        # bulk_create() bypasses save(): do its bookkeeping once for the whole batch
+        if Item.objects.filter(pk=item.pk, primary_picture__isnull=True).refresh_primary_pictures():
+            # A later item.save() (ModelFormMixin saves the form again) must not undo it
+            item.refresh_from_db(fields=['primary_picture'])
+        caching.invalidate(caching.CATALOG, caching.item_scope(item.pk))
+
+        if not settings.PICTURE_DERIVATIVES_ASYNC:
+            for picture in pictures:
+                picture.generate_derivatives()
+        return pictures
+
+    def file_names(self):
+        """Storage names of the original, the derivatives and the renditions"""
+        names = [image.name for image in (self.picture, self.thumbnail, self.square_image) if image]
+        names.extend(self.rendition_names())
+        return names
+
+    def rendition_names(self):
+        """Storage names of the renditions"""
+        return {name for names_by_width in self.renditions.values() for name in names_by_width.values()}
+
+    def sync_rendition_files(self):
+        """Mirror the names in `renditions` to PictureRendition rows, which is_referenced() looks up"""
+        names = self.rendition_names()
+        stored = set(self.rendition_files.values_list('name', flat=True))
+        if stored - names:
+            self.rendition_files.filter(name__in=stored - names).delete()
+        PictureRendition.objects.bulk_create([PictureRendition(picture=self, name=name) for name in names - stored])
+
+    @classmethod
+    def is_referenced(cls, name):
+        """Whether a picture uses the stored file `name`; exact, indexed lookups only"""
+        if cls.objects.filter(models.Q(picture=name) | models.Q(thumbnail=name) | models.Q(square_image=name)).exists():
+            return True
+        return PictureRendition.objects.filter(name=name).exists()
+
+    @classmethod
+    def delete_unreferenced(cls, names):
+        """Delete the given stored files unless a picture still references them"""
+        storage = picture_storage()
+        for name in set(names):
+            if not cls.is_referenced(name):
+                storage.delete(name)
 
     def _check_if_derivatives_needed(self):
         if self.pk:
@@ -381,47 +776,91 @@ class Picture(models.Model):
                 return True  # Should not happen often in save context, but safe
         return True  # New instance
 
-    def generate_square_image(self):
-        img = PilImage.open(self.picture)
-        square_img = img.copy()
-        width, height = square_img.size
-        size = min(width, height)
-
-        # Crop to square from center
-        left = (width - size) // 2
-        top = (height - size) // 2
-        right = left + size
-        bottom = top + size
-        square_img = square_img.crop((left, top, right, bottom))
-
-        # Resize the square crop to the target size
-        square_img = square_img.resize((SQUARE_IMAGE_SIZE, SQUARE_IMAGE_SIZE), PilImage.Resampling.LANCZOS)
-
-        # Save square image to buffer
-        square_io = BytesIO()
-        img_name = os.path.basename(self.picture.name)
-        base_name, ext = os.path.splitext(img_name)
-        square_img.save(square_io, format=img.format, quality=90)
-        square_filename = f"{base_name}_sq{SQUARE_IMAGE_SIZE}{ext}"
-        # self.square_image=square_img
-        # self.save()
-        self.square_image.save(square_filename, ContentFile(square_io.getvalue()), save=True)
-
-
-    def generate_thumbnail(self):
-        img = PilImage.open(self.picture)
+    @staticmethod
+    def rendition_formats():
+        """Configured rendition formats that can be encoded here, in order of preference"""
+        if not settings.PICTURE_RENDITION_WIDTHS:
+            return []
+        return imaging.supported_formats(settings.PICTURE_RENDITION_FORMATS)
+
+    def missing_derivatives(self):
+        """Names of the derivative fields that still have to be generated"""
+        missing = [field for field in ('thumbnail', 'square_image') if not getattr(self, field)]
+        if not self.renditions and self.rendition_formats():
+            missing.append('renditions')
+        return missing
+
+    def _generate_renditions(self, img, base_name):
+        renditions = {}
+        for width in imaging.rendition_widths(img, settings.PICTURE_RENDITION_WIDTHS):
+            square_img = imaging.square_crop(img, width)
+            for img_format in self.rendition_formats():
+                extension = imaging.RENDITION_FORMATS[img_format]['extension']
+                name = self.picture.storage.save(
+                    f"{RENDITIONS_UPLOAD_TO}{base_name}_{width}.{extension}",
+                    ContentFile(imaging.encode_rendition(square_img, img_format))
+                )
+                renditions.setdefault(img_format, {})[str(width)] = name
+        return renditions
+
+    def rendition_sources(self):
+        """(MIME type, srcset) per generated rendition format, most preferred first"""
+        sources = []
+        for img_format, options in imaging.RENDITION_FORMATS.items():
+            names = self.renditions.get(img_format)
+            if not names:
+                continue
+            storage = self.picture.storage
+            srcset = ', '.join(
+                f"{storage.url(names[width])} {width}w" for width in sorted(names, key=int)
+            )
+            sources.append((options['mime_type'], srcset))
+        return sources
+
+    def largest_rendition_url(self):
+        """URL of the largest rendition in the least preferred (most compatible) format"""
+        for img_format in reversed(imaging.RENDITION_FORMATS):
+            names = self.renditions.get(img_format)
+            if names:
+                return self.picture.storage.url(names[max(names, key=int)])
+        return ''
+
+    def process_image(self, fields=DERIVATIVE_FIELDS):
+        """Decode the original once and store the requested derivatives on their fields.
+
+        The files are written to storage but the model is not saved; callers persist
+        all fields with a single save(update_fields=...).
+        """
         img_name = os.path.basename(self.picture.name)
         base_name, ext = os.path.splitext(img_name)
 
-        thumb_size = (THUMBNAIL_SIZE, THUMBNAIL_SIZE)
-        thumb_img = img.copy()
-        thumb_img.thumbnail(thumb_size, PilImage.Resampling.LANCZOS)
-
-        # Save thumbnail to buffer  
-        thumb_io = BytesIO()
-        thumb_img.save(thumb_io, format=img.format, quality=85)
-        thumb_filename = f"{base_name}_thumb{ext}"
-        self.thumbnail.save(thumb_filename, ContentFile(thumb_io.getvalue()), save=True)
+        decode_size = SQUARE_IMAGE_SIZE
+        if 'renditions' in fields and settings.PICTURE_RENDITION_WIDTHS:
+            decode_size = max(decode_size, *settings.PICTURE_RENDITION_WIDTHS)
+        self.picture.open('rb')
+        try:
+            img = imaging.open_for_derivatives(self.picture, decode_size)
+        finally:
+            self.picture.close()
+        img_format = img.format
+
+        outputs = {}
+        if 'square_image' in fields:
+            square_img = imaging.square_crop(img, SQUARE_IMAGE_SIZE)
+            outputs['square_image'] = (f"{base_name}_sq{SQUARE_IMAGE_SIZE}{ext}",
+                                       imaging.encode(square_img, img_format, quality=90))
+        if 'thumbnail' in fields:
+            thumb_img = imaging.thumbnail(img, THUMBNAIL_SIZE)
+            outputs['thumbnail'] = (f"{base_name}_thumb{ext}", imaging.encode(thumb_img, img_format, quality=85))
+
+        for field, (filename, content) in outputs.items():
+            getattr(self, field).save(filename, ContentFile(content), save=False)
+        generated = list(outputs)
+
+        if 'renditions' in fields and self.rendition_formats():
+            self.renditions = self._generate_renditions(img, base_name)
+            generated.append('renditions')
+        return generated
 
     def resize_large_image(self):
         """Resize image if it's larger than 2MB"""
@@ -454,19 +893,84 @@ class Picture(models.Model):
             return True
         return False
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+    @property
+    def derivatives_in_progress(self):
+        return self.derivatives_status in (self.DerivativesStatus.PENDING, self.DerivativesStatus.PROCESSING)
 
-        # Store original force_insert and force_update values
-        force_insert = kwargs.pop('force_insert', False)
-        force_update = kwargs.pop('force_update', False)
+    def generate_derivatives(self, fields=None):
+        """Generate derivatives, tracking progress in derivatives_status.
 
-        generate_derivatives = self._check_if_derivatives_needed()
-        # is_new_instance = not self.pk
-        if not self.thumbnail:
-            self.generate_thumbnail()
-        if not self.square_image:
-            self.generate_square_image()
+        By default only the missing thumbnail, square image and renditions are generated,
+        taking them over from an identical picture where possible. Pass `fields` (e.g.
+        DERIVATIVE_FIELDS) to regenerate those from the original.
+        """
+        # PROCESSING stops the final save from scheduling the work again
+        self.derivatives_status = self.DerivativesStatus.PROCESSING
+        old_file_names = self.file_names()
+        try:
+            copied = []
+            if fields is None:
+                missing = self.missing_derivatives()
+                copied = self._copy_identical_derivatives(missing)
+                fields = [field for field in missing if field not in copied]
+            generated = self.process_image(fields) if fields else []
+        except Exception:
+            self.derivatives_status = self.DerivativesStatus.FAILED
+            self.save(update_fields=['derivatives_status'])
+            raise
+        self.derivatives_status = self.DerivativesStatus.READY
+        self.save(update_fields=[*copied, *generated, 'derivatives_status'])
+        self.delete_unreferenced(set(old_file_names) - set(self.file_names()))
+
+    def _copy_identical_derivatives(self, fields):
+        """Take over derivatives from a processed picture with the same original (re-upload, variant copy)"""
+        donor = Picture.objects.filter(picture=self.picture.name, derivatives_status=self.DerivativesStatus.READY) \
+            .exclude(pk=self.pk).first()
+        if donor is None:
+            return []
+        copied = []
+        for field in fields:
+            value = getattr(donor, field)
+            if value:
+                setattr(self, field, value if field == 'renditions' else value.name)
+                copied.append(field)
+        return copied
+
+    def save(self, *args, **kwargs):
+        is_new_instance = self._state.adding
+        needs_derivatives = bool(self.picture) and bool(self.missing_derivatives()) \
+            and self.derivatives_status != self.DerivativesStatus.PROCESSING
+        run_async = needs_derivatives and settings.PICTURE_DERIVATIVES_ASYNC
+        if run_async:
+            # Leave the image processing to the background worker
+            self.derivatives_status = self.DerivativesStatus.PENDING
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'derivatives_status'}
+        super().save(*args, **kwargs)
+        if is_new_instance:
+            renditions_saved = bool(self.renditions)
+        else:
+            renditions_saved = kwargs.get('update_fields') is None or 'renditions' in kwargs['update_fields']
+        if renditions_saved:
+            self.sync_rendition_files()
+
+        item_ids = {self.item_id}
+        if is_new_instance:
+            # The first picture of an item becomes its primary picture
+            if Item.objects.filter(pk=self.item_id, primary_picture__isnull=True).update(primary_picture=self):
+                self._refresh_cached_item()
+        else:
+            loaded_item_id, loaded_position = getattr(self, '_loaded_placement', (self.item_id, self.position))
+            if (loaded_item_id, loaded_position) != (self.item_id, self.position):
+                # Moved to another item or position: the first picture of both items may have changed
+                item_ids.add(loaded_item_id)
+                Item.objects.filter(pk__in=item_ids).refresh_primary_pictures()
+                self._refresh_cached_item()
+        self._loaded_placement = (self.item_id, self.position)
+        caching.invalidate(caching.CATALOG, *[caching.item_scope(item_id) for item_id in item_ids])
+
+        if needs_derivatives and not run_async:
+            self.generate_derivatives()
 
         # # First save to get a pk if this is a new instance
         # if is_new_instance:
@@ -529,6 +1033,29 @@ class Picture(models.Model):
         #         os.remove(original_path)
 
 
+class PictureRendition(models.Model):
+    """A rendition file of a picture, mirrored from Picture.renditions by Picture.sync_rendition_files().
+
+    Stored files are shared between pictures (see ufo_shop/storage.py); this indexed copy
+    of the names lets Picture.is_referenced() match a file exactly instead of searching
+    the JSON of every picture.
+    """
+    picture = models.ForeignKey(Picture, on_delete=models.CASCADE, related_name='rendition_files',
+                                verbose_name="Picture")
+    # Content-addressed storage name, e.g. item_pictures/renditions/ab/ab12...ef.webp
+    name = models.CharField("Storage Name", max_length=255, db_index=True)
+
+    class Meta:
+        verbose_name = "Picture Rendition"
+        verbose_name_plural = "Picture Renditions"
+        constraints = [
+            models.UniqueConstraint(fields=['picture', 'name'], name='picturerendition_picture_name_uniq'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
 class Issuer(models.Model):
     """Model to store invoice issuers"""
     name = models.CharField("Name", max_length=200)
@@ -571,104 +1098,186 @@ class Invoice(models.Model):
     currency = models.CharField("Currency", max_length=3, default="CZK")
     pdf_file = models.FileField("PDF File", upload_to='invoices/', blank=True, null=True)
 
+    class PdfStatus(models.IntegerChoices):
+        PENDING = 1, 'Pending'
+        PROCESSING = 2, 'Processing'
+        READY = 3, 'Ready'
+        FAILED = 4, 'Failed'
+
+    # PDF generation state; pending invoices are picked up by `manage.py run_worker`
+    pdf_status = models.IntegerField("PDF Status", choices=PdfStatus.choices, default=PdfStatus.PENDING)
+    pdf_claimed_at = models.DateTimeField("PDF Claimed At", blank=True, null=True, editable=False)
+    # Hash of everything the PDF shows (see compute_pdf_fingerprint); an unchanged PDF is not rendered again
+    pdf_fingerprint = models.CharField("PDF Fingerprint", max_length=64, blank=True, default='', editable=False)
+
     class Meta:
         verbose_name = "Invoice"
         verbose_name_plural = "Invoices"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['pdf_status'], name='invoice_pdf_status_idx', condition=~models.Q(pdf_status=3)),
+        ]
 
     def __str__(self):
         return f"Invoice {self.invoice_number} for Order {self.order.id}"
 
     @classmethod
-    def create_from_order(cls, order, issuer=None):
-        """Create an invoice from an order"""
-        # Check if an invoice already exists for this order
-        existing_invoice = cls.objects.filter(order=order).first()
-        if existing_invoice:
-            return existing_invoice  # Return existing invoice instead of creating a new one
-
+    def default_issuer(cls):
+        """The default issuer, or the first one if none is marked as default"""
+        issuer = Issuer.objects.filter(is_default=True).first()
         if not issuer:
-            # Get default issuer
-            issuer = Issuer.objects.filter(is_default=True).first()
+            issuer = Issuer.objects.first()
             if not issuer:
-                # If no default issuer, get the first one
-                issuer = Issuer.objects.first()
-                if not issuer:
-                    raise ValueError("No issuers found in the system")
+                raise ValueError("No issuers found in the system")
+        return issuer
 
-        # Generate invoice number (e.g., INV-YYYY-ORDERID)
-        from django.utils import timezone
-        invoice_number = f"INV-{timezone.now().year}-{order.id}"
+    @classmethod
+    def for_order(cls, order, issuer):
+        """Unsaved invoice of `order` with a pending PDF"""
 
-        # Create invoice
-        invoice = cls.objects.create(
-            invoice_number=invoice_number,
+        return cls(
+            # Generate invoice number (e.g., INV-YYYY-ORDERID)
+            invoice_number=f"INV-{timezone.now().year}-{order.id}",
             order=order,
             issuer=issuer,
             due_date=timezone.now().date() + timezone.timedelta(days=14),  # 14 days due date
             total_amount=order.total,
-            currency="CZK"  # Default currency
+            currency="CZK",  # Default currency
+            pdf_status=cls.PdfStatus.PENDING,
         )
 
-        # Generate PDF
-        invoice.generate_pdf()
+    @classmethod
+    def create_from_order(cls, order, issuer=None):
+        """Create an invoice from an order"""
+        # Check if an invoice already exists for this order
+        existing_invoice = cls.objects.filter(order=order).first()
+        if existing_invoice:
+            return existing_invoice  # Return existing invoice instead of creating a new one
+
+        # Create invoice
+        invoice = cls.for_order(order, issuer or cls.default_issuer())
+        invoice.save()
+
+        # The PDF is left to the background worker (or the first download)
+        if not settings.INVOICE_PDF_ASYNC:
+            invoice.generate_pdf()
 
         return invoice
 
+    @property
+    def pdf_ready(self):
+        return self.pdf_status == self.PdfStatus.READY and bool(self.pdf_file)
+
+    @property
+    def pdf_etag(self):
+        """Changes whenever the PDF file does: a re-rendered PDF gets another file name or fingerprint"""
+        return hashlib.sha256(f"{self.pdf_file.name}:{self.pdf_fingerprint}".encode()).hexdigest()
+
+    def ensure_pdf(self):
+        """Make sure the PDF exists, generating it in this process unless someone else already is.
+
+        The invoice row is claimed like a worker claims it (see ufo_shop/claiming.py), which acts as
+        a lock: concurrent downloads and the worker never render the same invoice twice. When the
+        invoice is claimed elsewhere, waits up to INVOICE_PDF_WAIT_TIMEOUT seconds for it.
+        Returns whether the PDF is ready.
+        """
+
+        if self.pdf_ready:
+            return True
+
+        invoices = Invoice.objects.filter(pk=self.pk)
+        # Failed invoices and ready ones that lost their file are generated again
+        invoices.filter(models.Q(pdf_status=self.PdfStatus.FAILED) | models.Q(pdf_file='')
+                        | models.Q(pdf_file__isnull=True)) \
+            .exclude(pdf_status=self.PdfStatus.PROCESSING).update(pdf_status=self.PdfStatus.PENDING)
+        if claim(invoices, 'pdf_status', self.PdfStatus.PENDING, self.PdfStatus.PROCESSING, 'pdf_claimed_at', 1):
+            return self.generate_pdf()
+
+        deadline = time.monotonic() + settings.INVOICE_PDF_WAIT_TIMEOUT
+        while True:
+            self.refresh_from_db(fields=['pdf_status', 'pdf_file'])
+            if self.pdf_status != self.PdfStatus.PROCESSING or time.monotonic() >= deadline:
+                return self.pdf_ready
+            time.sleep(0.2)
+
     def generate_pdf(self):
-        """Generate PDF version of the invoice using xhtml2pdf"""
-        import os
-        import tempfile
-        from io import BytesIO
-        from django.core.files.base import ContentFile
-        from django.conf import settings
-        from django.template.loader import get_template
-        from django.template import Context
-        from xhtml2pdf import pisa
-        from django.http import HttpResponse
-
-        # Get order items
-        items = self.order.orderitem_set.all()
-
-        # Get QR code for payment
-        qr_code = self.order.get_payment_qr_code()
-
-        # Create a BytesIO buffer to receive the PDF data
-        buffer = BytesIO()
-
-        # Prepare context for the template
-        context = {
+        """Generate PDF version of the invoice, tracking progress in pdf_status. Returns whether it succeeded.
+
+        When the fingerprint of the PDF inputs matches the stored one and the file still exists,
+        the file is kept instead of being rendered again.
+        """
+        try:
+            context = self.pdf_context()
+            fingerprint = self.compute_pdf_fingerprint(context)
+            pdf_exists = bool(self.pdf_file) and self.pdf_file.storage.exists(self.pdf_file.name)
+            if pdf_exists and fingerprint == self.pdf_fingerprint:
+                self.pdf_status = self.PdfStatus.READY
+                self.save(update_fields=['pdf_status', 'updated_at'])
+                return True
+            pdf_content = self._render_pdf(context)
+        except Exception:
+            self.pdf_status = self.PdfStatus.FAILED
+            self.save(update_fields=['pdf_status', 'updated_at'])
+            raise
+        if pdf_content is None:
+            self.pdf_status = self.PdfStatus.FAILED
+            self.save(update_fields=['pdf_status', 'updated_at'])
+            return False
+
+        # Save PDF to model
+        old_name = self.pdf_file.name if self.pdf_file else None
+        self.pdf_file.save(f"invoice_{self.invoice_number}.pdf", ContentFile(pdf_content), save=False)
+        self.pdf_status = self.PdfStatus.READY
+        self.pdf_fingerprint = fingerprint
+        self.save(update_fields=['pdf_file', 'pdf_status', 'pdf_fingerprint', 'updated_at'])
+        # The replaced file is removed once the new one is saved, so invoices/ keeps one file per invoice
+        if old_name and old_name != self.pdf_file.name:
+            self.pdf_file.storage.delete(old_name)
+        return True
+
+    def _render_pdf(self, context=None):
+        """PDF bytes of the invoice rendered with xhtml2pdf, None when xhtml2pdf reports an error"""
+        from ufo_shop import invoice_pdf
+
+        return invoice_pdf.render(context or self.pdf_context())
+
+    def pdf_context(self):
+        """Context of the invoice PDF template"""
+        return {
             'invoice': self,
             'issuer': self.issuer,
             'order': self.order,
-            'items': items,
-            'qr_code': qr_code,
+            'items': self.order.orderitem_set.select_related('item'),
+            # Get QR code for payment
+            'qr_code': self.order.get_payment_qr_code(),
             'STATIC_ROOT': settings.STATIC_ROOT,
         }
 
-        # Render the template
-        template = get_template('ufo_shop/invoice_pdf.html')
-        html = template.render(context)
-
-        # Create the PDF
-        pisa_status = pisa.CreatePDF(
-            html,                   # the HTML to convert
-            dest=buffer,            # the BytesIO buffer
-            encoding='utf-8'
-        )
+    def compute_pdf_fingerprint(self, context=None):
+        """SHA-256 of the invoice, issuer, order and item fields the PDF shows, its payment QR code
+        and the template version. Evaluates the items of `context`, so rendering it queries them no more.
+        """
+        from ufo_shop import invoice_pdf
 
-        # Check if PDF generation was successful
-        if pisa_status.err:
-            return False
+        context = context or self.pdf_context()
+        issuer, order = context['issuer'], context['order']
 
-        # Get the PDF content from the BytesIO buffer
-        pdf_content = buffer.getvalue()
-        buffer.close()
+        def amount(value):
+            # Decimals read from the database and entered in forms differ in their trailing zeros
+            return f"{value:.2f}"
 
-        # Save PDF to model
-        self.pdf_file.save(f"invoice_{self.invoice_number}.pdf", ContentFile(pdf_content), save=True)
-        
-        return True
+        inputs = [
+            invoice_pdf.template_version(),
+            [self.invoice_number, self.created_at.date() if self.created_at else None, self.due_date,
+             amount(self.total_amount), self.currency],
+            [issuer.name, issuer.address, issuer.city, issuer.postal_code, issuer.country, issuer.registration_id,
+             issuer.tax_id, issuer.bank_account, issuer.iban, issuer.swift, issuer.logo.name or ''],
+            [order.id, order.user.get_full_name(), order.contact_email, order.contact_phone, order.shipping_address,
+             order.shipping_city, order.shipping_zip, order.shipping_country, amount(order.shipping_cost)],
+            [[item.item_id, item.item.name, amount(item.item.price), item.amount] for item in context['items']],
+            order.payment_qr_etag,
+        ]
+        return hashlib.sha256(json.dumps(inputs, default=str).encode()).hexdigest()
 
 
 class News(models.Model):
@@ -682,6 +1291,132 @@ class News(models.Model):
         verbose_name = "News"
         verbose_name_plural = "News"
         ordering = ['-published_at']
+        indexes = [
+            models.Index(fields=['-published_at'], name='news_active_published_idx',
+                         condition=models.Q(is_active=True)),
+        ]
 
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        caching.invalidate(caching.HOME)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        caching.invalidate(caching.HOME)
+        return result
+
+
+class OutgoingEmail(models.Model):
+    """Email queued for `manage.py run_worker`, which sends it with retries (see ufo_shop/utils/emailing.py).
+
+    The message is built when it is sent, by the builder registered for `template` in
+    emailing.EMAIL_BUILDERS, from the `target` object and `context` (values only known to the
+    request, e.g. absolute URLs). `idempotency_key` identifies the (template, object) pair, so
+    queueing the same email twice (e.g. a double-submitted checkout) sends it once.
+
+    Only sending is retried: an email whose message cannot be built (deleted target, missing
+    template, DEFAULT_FROM_EMAIL not set) is dead-lettered at once.
+    """
+    template = models.CharField("Template", max_length=50)
+    target_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, verbose_name="Target Type")
+    target_id = models.PositiveBigIntegerField("Target ID")
+    target = GenericForeignKey('target_type', 'target_id')
+    context = models.JSONField("Context", default=dict, blank=True)
+    idempotency_key = models.CharField("Idempotency Key", max_length=200, unique=True)
+
+    class Status(models.IntegerChoices):
+        PENDING = 1, 'Pending'
+        PROCESSING = 2, 'Processing'
+        SENT = 3, 'Sent'
+        FAILED = 4, 'Failed'
+
+    # FAILED emails ran out of attempts (dead letters); they are only sent again from the admin
+    status = models.IntegerField("Status", choices=Status.choices, default=Status.PENDING)
+    claimed_at = models.DateTimeField("Claimed At", blank=True, null=True, editable=False)
+    attempts = models.PositiveSmallIntegerField("Attempts", default=0)
+    next_attempt_at = models.DateTimeField("Next Attempt At", default=timezone.now)
+    last_error = models.TextField("Last Error", blank=True, default='')
+    created_at = models.DateTimeField("Created At", auto_now_add=True)
+    sent_at = models.DateTimeField("Sent At", blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Outgoing Email"
+        verbose_name_plural = "Outgoing Emails"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outgoingemail_status_idx',
+                         condition=~models.Q(status=3)),
+        ]
+
+    def __str__(self):
+        return self.idempotency_key
+
+    @classmethod
+    def queue(cls, template, target, context=None, resend=False):
+        """Queue `template` for `target` unless it is queued already; returns the OutgoingEmail.
+
+        With `resend`, an email that was sent or failed already is queued again.
+        """
+        target_type = ContentType.objects.get_for_model(target)
+        email, created = cls.objects.get_or_create(
+            idempotency_key=f"{template}:{target_type.app_label}.{target_type.model}:{target.pk}",
+            defaults={'template': template, 'target_type': target_type, 'target_id': target.pk,
+                      'context': context or {}},
+        )
+        if resend and not created:
+            cls.objects.filter(pk=email.pk, status__in=[cls.Status.SENT, cls.Status.FAILED]).update(
+                status=cls.Status.PENDING, attempts=0, next_attempt_at=timezone.now(), context=context or {},
+            )
+        return email
+
+    def retry_delay(self):
+        """Seconds before the next attempt: EMAIL_OUTBOX_RETRY_DELAY doubled after every failed attempt"""
+        delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (self.attempts - 1)
+        return min(delay, settings.EMAIL_OUTBOX_MAX_RETRY_DELAY)
+
+    def send(self, connection=None):
+        """Build and send the email, scheduling a retry or dead-lettering it on errors. Returns whether it was sent"""
+        from ufo_shop.utils.emailing import EMAIL_BUILDERS, outbox_connection
+
+        try:
+            if self.target is None:
+                raise ValueError(f"{self.target_type.model} {self.target_id} no longer exists")
+            message = EMAIL_BUILDERS[self.template](self.target, self.context)
+        except Exception as e:
+            # A deleted target, a missing template or setting do not come back by retrying
+            self.record_failure(e, permanent=True)
+            return False
+        try:
+            message.connection = connection or outbox_connection()
+            message.send(fail_silently=False)
+        except Exception as e:
+            self.record_failure(e)
+            return False
+
+        self.attempts += 1
+        self.status = self.Status.SENT
+        self.sent_at = timezone.now()
+        self.last_error = ''
+        self.save(update_fields=['status', 'attempts', 'sent_at', 'last_error'])
+        return True
+
+    def postpone(self, error):
+        """Try again after EMAIL_OUTBOX_RETRY_DELAY without counting an attempt (the mail server was unreachable)"""
+        self.status = self.Status.PENDING
+        self.next_attempt_at = timezone.now() + timezone.timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY)
+        self.last_error = f"{type(error).__name__}: {error}"
+        self.save(update_fields=['status', 'next_attempt_at', 'last_error'])
+
+    def record_failure(self, error, permanent=False):
+        """Count a failed attempt: schedule a retry after retry_delay(), or dead-letter the email"""
+        self.attempts += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        if permanent or self.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            self.status = self.Status.FAILED
+        else:
+            self.status = self.Status.PENDING
+            self.next_attempt_at = timezone.now() + timezone.timedelta(seconds=self.retry_delay())
+        self.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error'])
@@ -0,0 +1,123 @@
+"""
+Keyset (cursor) pagination for catalog listings.
+
+Offset pagination needs a COUNT over the whole filtered queryset and an
+OFFSET scan that gets slower with every page. Cursor pagination instead
+remembers the (created_at, id) of the last item shown and asks the database
+for the next rows after it, so every page costs the same as the first one.
+
+Cursors are opaque URL-safe tokens; clients must not build them by hand.
+"""
+import base64
+import hashlib
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+from ufo_shop import caching
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+@dataclass
+class CursorPage:
+    object_list: List = field(default_factory=list)
+    next_cursor: Optional[str] = None
+    previous_cursor: Optional[str] = None
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(obj, direction, field_name='created_at'):
+    payload = json.dumps([direction, getattr(obj, field_name).isoformat(), obj.pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (direction, value, pk) of a cursor token, raising Http404 for tampered tokens."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in (NEXT, PREVIOUS):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(value), int(pk)
+    except (ValueError, TypeError, json.JSONDecodeError):
+        raise Http404("Invalid cursor")
+
+
+def paginate_by_cursor(queryset, page_size, token=None, field_name='created_at'):
+    """Return a CursorPage of `queryset` ordered newest first by (field_name, pk)."""
+    descending = queryset.order_by(f'-{field_name}', '-pk')
+    if not token:
+        rows = list(descending[:page_size + 1])
+        return CursorPage(
+            object_list=rows[:page_size],
+            next_cursor=encode_cursor(rows[page_size - 1], NEXT, field_name) if len(rows) > page_size else None,
+        )
+
+    direction, value, pk = decode_cursor(token)
+    if direction == NEXT:
+        # Rows older than the cursor
+        rows = list(descending.filter(
+            Q(**{f'{field_name}__lt': value}) | Q(**{field_name: value, 'pk__lt': pk})
+        )[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        has_next, has_previous = has_more, True
+    else:
+        # Rows newer than the cursor, fetched oldest first and flipped back
+        rows = list(queryset.order_by(field_name, 'pk').filter(
+            Q(**{f'{field_name}__gt': value}) | Q(**{field_name: value, 'pk__gt': pk})
+        )[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next, has_previous = True, has_more
+
+    return CursorPage(
+        object_list=rows,
+        next_cursor=encode_cursor(rows[-1], NEXT, field_name) if rows and has_next else None,
+        previous_cursor=encode_cursor(rows[0], PREVIOUS, field_name) if rows and has_previous else None,
+    )
+
+
+def cached_count(queryset, timeout=60 * 60, scopes=(caching.CATALOG,)):
+    """COUNT(*) of `queryset`, cached until one of `scopes` is invalidated.
+
+    The key is derived from the SQL of the query, so each filter combination
+    is counted once per catalog version instead of on every page view.
+    """
+    sql = str(queryset.query).encode()
+    versions = '.'.join(str(version) for version in caching.get_versions(scopes))
+    key = f'ufo_shop:count:{versions}:{hashlib.md5(sql).hexdigest()}'
+    return cache.get_or_set(key, queryset.count, timeout)
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator whose total count comes from cached_count() instead of a COUNT per request."""
+
+    @cached_property
+    def count(self):
+        if hasattr(self.object_list, 'query'):
+            return cached_count(self.object_list)
+        return super().count
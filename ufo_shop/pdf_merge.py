@@ -0,0 +1,158 @@
+"""
+Merging many PDFs into one without holding them in memory.
+
+pypdf's PdfWriter keeps every page it was given until write(), so merging
+thousands of invoices needs memory for all of them. MergedPdf copies the
+objects of each document to the output as soon as it is added instead: a
+source document is read, its pages and everything they reference are
+renumbered and written, and only the output offsets of the objects are kept
+for the cross-reference table written by close().
+
+Pages are copied with their inherited attributes (resources, boxes, rotation);
+document-level parts of the sources (their outlines, forms, names) are not.
+Each added document gets an outline item pointing at its first page.
+"""
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject, TextStringObject,
+)
+
+# Object numbers of the parts written by close()
+CATALOG, PAGES, OUTLINES = 1, 2, 3
+INHERITED_PAGE_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+
+def _ref(number):
+    """Reference to an object of the merged document"""
+    return IndirectObject(number, 0, None)
+
+
+class MergedPdf:
+    """Writes a PDF merged from the documents passed to add() to `out`, a binary file object with tell()"""
+
+    def __init__(self, out):
+        self.out = out
+        self.offsets = {}
+        self.next_number = OUTLINES + 1
+        self.kids = []
+        self.outline = []
+        out.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _allocate(self):
+        number = self.next_number
+        self.next_number += 1
+        return number
+
+    def add(self, stream, title):
+        """Append the pages of the PDF read from `stream` under the outline item `title`"""
+        reader = PdfReader(stream)
+        numbers = {}
+        pending = []
+
+        def renumber(reference):
+            key = (reference.idnum, reference.generation)
+            if key not in numbers:
+                numbers[key] = self._allocate()
+                pending.append(reference)
+            return numbers[key]
+
+        # References to the source's page tree point to the merged one
+        pages_root = reader.trailer['/Root'].raw_get('/Pages')
+        numbers[(pages_root.idnum, pages_root.generation)] = PAGES
+
+        pages = list(reader.pages)
+        page_numbers = []
+        for page in pages:
+            reference = page.indirect_reference
+            page_numbers.append(numbers.setdefault((reference.idnum, reference.generation), self._allocate()))
+        for page, number in zip(pages, page_numbers):
+            copy = DictionaryObject({key: value for key, value in page.items() if key != '/Parent'})
+            for key in INHERITED_PAGE_KEYS:
+                if key not in copy and page.get_inherited(key) is not None:
+                    copy[NameObject(key)] = page.get_inherited(key)
+            copy[NameObject('/Parent')] = _ref(PAGES)
+            self._write_object(number, copy, renumber)
+        while pending:
+            reference = pending.pop()
+            self._write_object(numbers[(reference.idnum, reference.generation)], reference.get_object(), renumber)
+
+        self.kids.extend(page_numbers)
+        if page_numbers:
+            self.outline.append((self._allocate(), title, page_numbers[0]))
+
+    def close(self):
+        """Write the page tree, the outline, the catalog and the cross-reference table"""
+        self._write_object(PAGES, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(_ref(number) for number in self.kids),
+            NameObject('/Count'): NumberObject(len(self.kids)),
+        }))
+        for index, (number, title, page) in enumerate(self.outline):
+            item = DictionaryObject({
+                NameObject('/Title'): TextStringObject(title),
+                NameObject('/Parent'): _ref(OUTLINES),
+                NameObject('/Dest'): ArrayObject([_ref(page), NameObject('/Fit')]),
+            })
+            if index:
+                item[NameObject('/Prev')] = _ref(self.outline[index - 1][0])
+            if index < len(self.outline) - 1:
+                item[NameObject('/Next')] = _ref(self.outline[index + 1][0])
+            self._write_object(number, item)
+        outlines = DictionaryObject({NameObject('/Type'): NameObject('/Outlines'),
+                                     NameObject('/Count'): NumberObject(len(self.outline))})
+        if self.outline:
+            outlines[NameObject('/First')] = _ref(self.outline[0][0])
+            outlines[NameObject('/Last')] = _ref(self.outline[-1][0])
+        self._write_object(OUTLINES, outlines)
+        self._write_object(CATALOG, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): _ref(PAGES),
+            NameObject('/Outlines'): _ref(OUTLINES),
+        }))
+
+        xref_offset = self.out.tell()
+        size = self.next_number
+        self.out.write(f'xref\n0 {size}\n0000000000 65535 f \n'.encode())
+        for number in range(1, size):
+            self.out.write(f'{self.offsets.get(number, 0):010d} 00000 n \n'.encode())
+        self.out.write(f'trailer\n<< /Size {size} /Root {CATALOG} 0 R >>\n'
+                       f'startxref\n{xref_offset}\n%%EOF\n'.encode())
+
+    def _write_object(self, number, value, renumber=None):
+        self.offsets[number] = self.out.tell()
+        self.out.write(f'{number} 0 obj\n'.encode())
+        self._write_value(value, renumber)
+        self.out.write(b'\nendobj\n')
+
+    def _write_value(self, value, renumber):
+        """Serialize `value`, replacing references into the source document by their merged numbers"""
+        out = self.out
+        if isinstance(value, IndirectObject):
+            number = value.idnum if value.pdf is None else renumber(value)
+            out.write(f'{number} 0 R'.encode())
+        elif isinstance(value, DictionaryObject):
+            # Streams are copied still encoded; their length may have been an indirect object
+            data = StreamObject.get_data(value) if isinstance(value, StreamObject) else None
+            out.write(b'<<')
+            for key, item in value.items():
+                if data is not None and key == '/Length':
+                    continue
+                out.write(b'\n')
+                key.write_to_stream(out)
+                out.write(b' ')
+                self._write_value(item, renumber)
+            if data is not None:
+                out.write(f'\n/Length {len(data)}'.encode())
+            out.write(b'\n>>')
+            if data is not None:
+                out.write(b'\nstream\n')
+                out.write(data)
+                out.write(b'\nendstream')
+        elif isinstance(value, ArrayObject):
+            out.write(b'[')
+            for item in value:
+                out.write(b' ')
+                self._write_value(item, renumber)
+            out.write(b' ]')
+        else:
+            value.write_to_stream(out)
@@ -0,0 +1,127 @@
+"""
+Picture renditions rendered on demand by PictureRenditionView.
+
+`/media/r/<picture id>/<width>x<height>.<avif|webp|jpg>` returns the picture
+center-cropped to that size. Only sizes listed in PICTURE_RENDITION_ENDPOINT_SIZES
+are rendered, so the URL space stays bounded. A rendition is produced from the
+original on its first request and then served from a sharded directory on disk
+(PICTURE_RENDITION_CACHE_DIR). When the directory grows beyond
+PICTURE_RENDITION_CACHE_MAX_SIZE the least recently used files are evicted.
+
+Cache keys hash the original's storage name, which is content-addressed (see
+ufo_shop/storage.py), so a key never refers to stale bytes and doubles as a
+strong ETag.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from ufo_shop import imaging
+
+PRUNE_LOCK_KEY = 'rendition-cache-prune'
+# Seconds between two size checks of the cache directory
+PRUNE_INTERVAL = 60
+# Pruning frees space down to this fraction of the maximum size
+PRUNE_TARGET = 0.9
+# Hits refresh a file's mtime (the LRU clock) at most this often, in seconds
+TOUCH_INTERVAL = 60 * 60
+
+
+def format_for_extension(extension):
+    """The RENDITION_FORMATS key served for a URL extension, or None"""
+    for img_format in imaging.supported_formats(imaging.RENDITION_FORMATS):
+        if imaging.RENDITION_FORMATS[img_format]['extension'] == extension:
+            return img_format
+    return None
+
+
+def is_allowed_size(width, height):
+    return (width, height) in {tuple(size) for size in settings.PICTURE_RENDITION_ENDPOINT_SIZES}
+
+
+def rendition_key(original_name, width, height, img_format):
+    return hashlib.sha256(f"{original_name}:{width}x{height}:{img_format}".encode()).hexdigest()
+
+
+def render(picture, width, height, img_format):
+    """Encode `picture`'s original cropped to width x height"""
+    picture.picture.open('rb')
+    try:
+        img = imaging.open_for_derivatives(picture.picture, max(width, height))
+    finally:
+        picture.picture.close()
+    return imaging.encode_rendition(imaging.cover(img, width, height), img_format)
+
+
+class RenditionCache:
+    def __init__(self, directory=None, max_size=None):
+        self.directory = str(directory or settings.PICTURE_RENDITION_CACHE_DIR)
+        self.max_size = max_size if max_size is not None else settings.PICTURE_RENDITION_CACHE_MAX_SIZE
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key[:2], key[2:4], f"{key}.{extension}")
+
+    def get(self, key, extension):
+        """Path of the cached file, or None on a miss"""
+        path = self.path(key, extension)
+        try:
+            modified = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - modified > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    def put(self, key, extension, content):
+        """Store `content` and return its path"""
+        path = self.path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        if cache.add(PRUNE_LOCK_KEY, True, PRUNE_INTERVAL):
+            self.prune()
+        return path
+
+    def prune(self):
+        """Evict the least recently used files while the cache is over its maximum size.
+
+        Returns the number of bytes freed.
+        """
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_size:
+            return 0
+
+        freed = 0
+        for _, size, path in sorted(files):
+            if total - freed <= self.max_size * PRUNE_TARGET:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            freed += size
+        return freed
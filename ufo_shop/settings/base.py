@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ufo_shop.middleware.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,6 +75,8 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'ufo_shop.context_processors.cart_info',
+                'ufo_shop.context_processors.page_cache_csrf',
+                'ufo_shop.context_processors.item_card_cache',
             ],
         },
     },
@@ -182,6 +185,108 @@ EMAIL_HOST_PASSWORD = ''  # Your Gmail App Password
 # Default sender email address
 DEFAULT_FROM_EMAIL = ''  # Your sender email (e.g., 'UFO Shop <noreply@ufoshop.com>')
 
+# Emails are queued in the outbox (OutgoingEmail) and sent by `manage.py run_worker`; with DEBUG
+# they are printed to the console instead of going through EMAIL_BACKEND.
+# A failed email is retried after EMAIL_OUTBOX_RETRY_DELAY seconds, doubled after every further
+# failure up to EMAIL_OUTBOX_MAX_RETRY_DELAY; after EMAIL_OUTBOX_MAX_ATTEMPTS it is marked failed
+# and only sent again from the admin. While the mail server is unreachable, emails are postponed
+# by EMAIL_OUTBOX_RETRY_DELAY without counting an attempt.
+EMAIL_OUTBOX_RETRY_DELAY = 60
+EMAIL_OUTBOX_MAX_RETRY_DELAY = 60 * 60 * 6
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+
+#############################
+# Caching
+#############################
+# Local-memory cache by default. It is per process, so with several gunicorn
+# workers invalidations only reach the worker that made the change, and item card
+# fragments are not cached at all (see ITEM_CARD_CACHE_TIMEOUT). Override in
+# local_secrets.py / production_secrets.py with a shared backend, e.g.
+#   'django.core.cache.backends.filebased.FileBasedCache' with LOCATION '/var/tmp/ufo_shop_cache'
+#   'django.core.cache.backends.redis.RedisCache' with LOCATION 'redis://127.0.0.1:6379'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ufo-shop',
+    }
+}
+
+# Seconds a full catalog page is cached for anonymous visitors (0 disables page caching)
+CATALOG_PAGE_CACHE_TIMEOUT = 60 * 5
+
+# Seconds an item card fragment is cached (0 disables fragment caching). Cards are only cached with a
+# shared backend: with LocMemCache, the picture changes of `manage.py run_worker` and the other web
+# processes would never invalidate them.
+ITEM_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Seconds a cart item count stored in the session is trusted before it is recounted
+CART_COUNT_MAX_AGE = 60 * 5
+
+# Shop listing pagination: 'cursor' (constant cost on deep pages) or 'offset' (numbered pages)
+SHOP_PAGINATION_MODE = 'cursor'
+
+# Seconds a rendered payment QR code PNG is cached (keyed by its payload, so changes never serve a stale code)
+PAYMENT_QR_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# Function rendering payment QR codes to PNG, see ufo_shop/qr.py
+# ('ufo_shop.qr.render_styled_png' draws the same look with qrcode's slower StyledPilImage)
+PAYMENT_QR_RENDERER = 'ufo_shop.qr.render_fast_png'
+
+#############################
+# Background work
+#############################
+# Generate picture thumbnails/squares in `manage.py run_worker` instead of the upload request
+PICTURE_DERIVATIVES_ASYNC = True
+# Generate invoice PDFs in `manage.py run_worker` (or on the first download) instead of at checkout
+INVOICE_PDF_ASYNC = True
+# Seconds an invoice download waits for a PDF that is being generated elsewhere before giving up
+INVOICE_PDF_WAIT_TIMEOUT = 20
+# Seconds after which a job claimed by a worker that died is handed to another worker
+WORKER_CLAIM_TIMEOUT = 60 * 10
+
+#############################
+# Pictures
+#############################
+# Square renditions generated for every item picture and offered to browsers via srcset.
+# Formats are listed in order of preference; AVIF is skipped when Pillow cannot encode it
+# and the last format is what browsers without <picture> support get.
+PICTURE_RENDITION_WIDTHS = [200, 400, 800, 1024]
+PICTURE_RENDITION_FORMATS = ['AVIF', 'WEBP', 'JPEG']
+
+# Uploads with more pixels are rejected (decompression bomb protection, checked from the header);
+# uploads with a longer side than PICTURE_UPLOAD_MAX_DIMENSION are downsized before they are stored
+PICTURE_UPLOAD_MAX_PIXELS = 50_000_000
+PICTURE_UPLOAD_MAX_DIMENSION = 4096
+
+# Sizes (width, height) served on demand at /media/r/<picture id>/<width>x<height>.<avif|webp|jpg>
+PICTURE_RENDITION_ENDPOINT_SIZES = [(150, 150), (200, 200), (400, 400), (800, 800), (1024, 1024)]
+# Disk cache of the on-demand renditions; least recently used files are evicted above the size limit
+PICTURE_RENDITION_CACHE_DIR = BASE_DIR / 'rendition_cache'
+PICTURE_RENDITION_CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+#############################
+# Invoices
+#############################
+# TrueType fonts registered once per process for invoice PDFs, by CSS font-family name (Helvetica, the
+# fallback, has no Czech diacritics). Files are absolute paths or names found in the system font directories
+# (reportlab's TTFSearchPath); DejaVu comes with most Linux distributions (Debian: fonts-dejavu-core).
+# `manage.py check` warns about missing fonts; see ufo_shop/invoice_pdf.py
+INVOICE_PDF_FONTS = {
+    'DejaVu Sans': {
+        'normal': 'DejaVuSans.ttf',
+        'bold': 'DejaVuSans-Bold.ttf',
+    },
+}
+# The invoice admin actions render up to INVOICE_ADMIN_RENDER_LIMIT missing PDFs right away, in
+# INVOICE_RENDER_WORKERS processes (None: one per CPU); more are queued for `manage.py run_worker`
+INVOICE_ADMIN_RENDER_LIMIT = 200
+INVOICE_RENDER_WORKERS = None
+# Let the front-end server send downloaded invoice PDFs instead of a Django worker (see ufo_shop/downloads.py):
+# None, 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+INVOICE_DOWNLOAD_OFFLOAD = None
+# With 'x-accel-redirect': URL of an nginx internal location aliased to MEDIA_ROOT, e.g.
+#   location /protected-media/ { internal; alias /srv/ufoshop/media/; }
+INVOICE_DOWNLOAD_ACCEL_PREFIX = '/protected-media/'
+
 #############################
 # Crispy forms
 #############################
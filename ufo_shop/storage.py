@@ -0,0 +1,56 @@
+"""
+Content-addressed storage for item pictures.
+
+Files are stored under the SHA-256 of their content instead of the uploaded
+name: `item_pictures/originals/ab/ab12...ef.jpg`. Saving bytes that are
+already stored writes nothing and returns the existing name, so colour
+variants sharing their parent's pictures, re-uploads of the same photo and
+identical derivatives all point at a single blob.
+
+A blob may therefore be referenced by several Picture rows. It is only
+deleted once no row references it any more, see Picture.delete_unreferenced().
+"""
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(content):
+    """SHA-256 hex digest of a django File, leaving it rewound"""
+    digest = hashlib.sha256()
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def content_name(self, name, content):
+        """Storage name of `content` when saved as `name`: same directory, hash as the file name"""
+        digest = content_hash(content)
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], f"{digest}{extension}").replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+def picture_storage():
+    return _picture_storage
+
+
+_picture_storage = ContentAddressedStorage()
@@ -0,0 +1,110 @@
+"""
+Background work executed by `manage.py run_worker`.
+
+There is no separate job table: each kind of work is queued as a status field
+on its own model (e.g. Picture.derivatives_status). A worker claims a row by
+flipping its status to PROCESSING with a conditional UPDATE, so several
+workers can run side by side on any database without row locks. Rows claimed
+by a worker that died are handed out again after WORKER_CLAIM_TIMEOUT.
+
+Every handler takes a `limit` and returns the number of rows it processed;
+the worker keeps calling them until they all return 0 and then sleeps.
+"""
+import logging
+
+from django.utils import timezone
+
+from ufo_shop.claiming import claim
+from ufo_shop.models import Invoice, OutgoingEmail, Picture
+from ufo_shop.utils.emailing import outbox_connection
+
+logger = logging.getLogger(__name__)
+
+
+def process_pending_pictures(limit=10):
+    """Generate derivatives of pictures uploaded with PICTURE_DERIVATIVES_ASYNC or queued for regeneration"""
+    pictures = claim(
+        Picture.objects.all(),
+        'derivatives_status',
+        Picture.DerivativesStatus.PENDING,
+        Picture.DerivativesStatus.PROCESSING,
+        'derivatives_claimed_at',
+        limit,
+    )
+    for picture in pictures:
+        try:
+            # Nothing missing means the picture was queued for regeneration (admin action)
+            picture.generate_derivatives(None if picture.missing_derivatives() else Picture.DERIVATIVE_FIELDS)
+            logger.info('Generated derivatives for picture %s', picture.pk)
+        except Exception:
+            logger.exception('Generating derivatives for picture %s failed', picture.pk)
+    return len(pictures)
+
+
+def process_pending_invoices(limit=10):
+    """Generate PDFs of invoices created with INVOICE_PDF_ASYNC or queued for regeneration"""
+    invoices = claim(
+        Invoice.objects.select_related('order', 'issuer'),
+        'pdf_status',
+        Invoice.PdfStatus.PENDING,
+        Invoice.PdfStatus.PROCESSING,
+        'pdf_claimed_at',
+        limit,
+    )
+    for invoice in invoices:
+        try:
+            if invoice.generate_pdf():
+                logger.info('Generated PDF of invoice %s', invoice.invoice_number)
+            else:
+                logger.error('xhtml2pdf failed to render invoice %s', invoice.invoice_number)
+        except Exception:
+            logger.exception('Generating PDF of invoice %s failed', invoice.invoice_number)
+    return len(invoices)
+
+
+def process_outgoing_emails(limit=10):
+    """Send queued emails over one connection; failed ones are retried with backoff, then dead-lettered"""
+    emails = claim(
+        # Emails waiting for a retry are not due yet
+        OutgoingEmail.objects.filter(next_attempt_at__lte=timezone.now()).select_related('target_type'),
+        'status',
+        OutgoingEmail.Status.PENDING,
+        OutgoingEmail.Status.PROCESSING,
+        'claimed_at',
+        limit,
+    )
+    if not emails:
+        return 0
+    connection = outbox_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        # Mail server unreachable: nothing was tried, so an outage does not use up the emails' attempts
+        logger.warning('Cannot connect to the mail server, postponing %s emails: %s', len(emails), e)
+        for email in emails:
+            email.postpone(e)
+        return len(emails)
+    try:
+        for email in emails:
+            _log_send_result(email, email.send(connection))
+    finally:
+        connection.close()
+    return len(emails)
+
+
+def _log_send_result(email, sent):
+    if sent:
+        logger.info('Sent email %s', email)
+    elif email.status == OutgoingEmail.Status.FAILED:
+        logger.error('Giving up on email %s after %s attempts: %s', email, email.attempts, email.last_error)
+    else:
+        logger.warning('Sending email %s failed, retrying at %s: %s', email, email.next_attempt_at,
+                       email.last_error)
+
+
+# Handlers run by `manage.py run_worker`, in this order
+TASK_HANDLERS = [
+    process_outgoing_emails,
+    process_pending_invoices,
+    process_pending_pictures,
+]
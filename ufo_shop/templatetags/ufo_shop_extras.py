@@ -1,4 +1,6 @@
 from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
 
 register = template.Library()
 
@@ -8,4 +10,25 @@ def multiply(value, arg):
     try:
         return float(value) * float(arg)
     except (ValueError, TypeError):
-        return 0
\ No newline at end of file
+        return 0
+
+@register.simple_tag
+def responsive_image(picture, fallback_url, sizes, **attrs):
+    """Render a <picture> offering the picture's renditions in every generated format.
+
+    Falls back to a plain <img src="fallback_url"> for pictures without renditions.
+    Extra keyword arguments become attributes of the <img>, with underscores
+    turned into dashes (data_bs_toggle="modal" -> data-bs-toggle="modal").
+    """
+    attrs = {name.replace('_', '-'): value for name, value in attrs.items()}
+    sources = picture.rendition_sources() if picture else []
+    if not sources:
+        return format_html('<img src="{}"{}>', fallback_url, flatatt(attrs))
+
+    *preferred, (fallback_type, fallback_srcset) = sources
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        format_html_join('', '<source type="{}" srcset="{}" sizes="{}">',
+                         ((mime_type, srcset, sizes) for mime_type, srcset in preferred)),
+        picture.largest_rendition_url(), fallback_srcset, sizes, flatatt(attrs),
+    )
@@ -0,0 +1,557 @@
+import shutil
+import smtplib
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PilImage
+
+from ufo_shop import caching, invoice_pdf, tasks, views
+from ufo_shop.models import (Category, Invoice, Issuer, Item, ItemSalesSummary, Location, Order, OrderItem,
+                             OutgoingEmail, Picture, User)
+from ufo_shop.storage import picture_storage
+from ufo_shop.utils.emailing import (notify_admins_merchandiser_request, queue_order_confirmation_email,
+                                     queue_welcome_email)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+# A cache shared by processes, which item card fragments need
+SHARED_CACHE_DIR = tempfile.mkdtemp()
+# Queries of the checkout page and of placing an order with a 4 line cart
+CHECKOUT_GET_QUERIES = 15
+CHECKOUT_POST_QUERIES = 29
+
+
+def jpeg_upload(name='picture.jpg', color='red'):
+    buffer = BytesIO()
+    PilImage.new('RGB', (300, 200), color).save(buffer, format='JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, PICTURE_DERIVATIVES_ASYNC=False)
+class ShopTestCase(TestCase):
+    """Shared fixtures: a merchandiser and a customer"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.merchandiser = User.objects.create_user(email='merch@example.cz', password='x', phone='1',
+                                                    is_merchandiser=True)
+        cls.customer = User.objects.create_user(email='customer@example.cz', password='x', phone='2')
+
+    def setUp(self):
+        # Fragments, versions and counts cached by one test must not hide queries of the next
+        cache.clear()
+
+    def create_items(self, count, category=None):
+        items = []
+        for n in range(count):
+            item = Item.objects.create(name=f'Item {n}', merchandiser=self.merchandiser, base_price=100 + n)
+            if category:
+                item.category.add(category)
+            Picture.objects.create(item=item, picture=jpeg_upload(color=(n, 0, 0)))
+            items.append(item)
+        return items
+
+
+class ShopListQueryCountTests(ShopTestCase):
+    def count_shop_queries(self, page_size):
+        cache.clear()
+        with mock.patch.object(views.ItemListView, 'paginate_by', page_size), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shop'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['item_list']), page_size)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.create_items(12, Category.objects.create(name='Shirts'))
+        self.client.force_login(self.customer)
+        # Count the requests of a session that has already made one
+        self.client.get(reverse('shop'))
+
+        small_page = self.count_shop_queries(3)
+        cache.clear()
+        with mock.patch.object(views.ItemListView, 'paginate_by', 12), self.assertNumQueries(small_page):
+            response = self.client.get(reverse('shop'))
+        self.assertEqual(len(response.context['item_list']), 12)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                      'LOCATION': SHARED_CACHE_DIR}})
+class ItemCardCacheTests(ShopTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(SHARED_CACHE_DIR, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Shirts')
+        self.items = self.create_items(6, self.category)
+        # Logged in, so the page is rendered rather than served from the page cache
+        self.client.force_login(self.customer)
+
+    def card_version_fetches(self):
+        """Scope lists of the get_versions() calls for item cards made by a shop page request"""
+        with mock.patch('ufo_shop.caching.get_versions', wraps=caching.get_versions) as get_versions:
+            response = self.client.get(reverse('shop'))
+        self.assertEqual(response.status_code, 200)
+        return [call.args[0] for call in get_versions.call_args_list
+                if any(scope.startswith('item:') for scope in call.args[0])]
+
+    def test_card_versions_are_fetched_once_per_page(self):
+        fetches = self.card_version_fetches()
+        self.assertEqual(len(fetches), 1)
+        self.assertCountEqual(fetches[0], [caching.item_scope(item.pk) for item in self.items])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cards_are_not_cached_with_a_per_process_cache(self):
+        self.assertEqual(self.card_version_fetches(), [])
+        self.assertEqual(self.client.get(reverse('shop')).context['item_card_cache_timeout'], 0)
+
+    def test_saving_categories_after_the_item_invalidates_its_card(self):
+        item = self.items[0]
+        # A view saves the item, then its categories; a card cached in between has the old ones
+        item.save()
+        version = Item.objects.get(pk=item.pk).cache_version
+        item.category.set([Category.objects.create(name='Hats')])
+        self.assertNotEqual(Item.objects.get(pk=item.pk).cache_version, version)
+
+        version = Item.objects.get(pk=item.pk).cache_version
+        Category.objects.get(name='Hats').item_set.clear()
+        self.assertNotEqual(Item.objects.get(pk=item.pk).cache_version, version)
+
+    def test_deleting_a_category_invalidates_its_items_once_it_is_gone(self):
+        invalidated = []
+
+        def invalidate_items(item_ids):
+            self.assertFalse(Category.objects.filter(pk=self.category.pk).exists())
+            invalidated.extend(item_ids)
+
+        with mock.patch('ufo_shop.models.invalidate_items', side_effect=invalidate_items):
+            self.category.delete()
+        self.assertCountEqual(invalidated, [item.pk for item in self.items])
+
+
+class PrimaryPictureTests(ShopTestCase):
+    def primary_picture(self, item):
+        return Item.objects.get(pk=item.pk).primary_picture
+
+    def test_moving_a_picture_updates_both_items(self):
+        old_item, new_item = self.create_items(2)
+        kept = Picture.objects.create(item=old_item, picture=jpeg_upload(color='blue'), position=1)
+        moved = old_item.pictures.get(position=0)
+        # As PictureAdmin does: the picture is moved in front of the other item's picture
+        moved.item = new_item
+        moved.position = 0
+        new_item.pictures.update(position=1)
+        moved.save()
+
+        self.assertEqual(self.primary_picture(old_item), kept)
+        self.assertEqual(self.primary_picture(new_item), moved)
+
+        moved.delete()
+        self.assertEqual(self.primary_picture(new_item), new_item.pictures.get())
+
+    def test_saving_an_item_after_adding_pictures_keeps_its_primary_picture(self):
+        item = Item.objects.create(name='Item', merchandiser=self.merchandiser, base_price=100)
+        pictures = Picture.create_batch(item, [jpeg_upload()])
+        # ModelFormMixin.form_valid() saves the form's item again after the view added the pictures
+        item.save()
+        self.assertEqual(self.primary_picture(item), pictures[0])
+
+        variant = Item.objects.create(name='Variant', merchandiser=self.merchandiser, base_price=100)
+        copy = Picture(item=variant, picture=pictures[0].picture.name)
+        copy.save()
+        variant.save()
+        self.assertEqual(self.primary_picture(variant), copy)
+
+
+class TopSellersTests(ShopTestCase):
+    def sold(self, item):
+        return ItemSalesSummary.objects.filter(item=item).values_list('quantity_sold', flat=True).first() or 0
+
+    def test_lines_of_completed_orders_update_the_leaderboard(self):
+        shirt, hat = self.create_items(2)
+        order = Order.objects.create(user=self.customer, status=Order.Status.ORDERED)
+        line = OrderItem.objects.create(order=order, item=shirt, amount=2)
+        self.assertEqual(self.sold(shirt), 0)
+        order.status = Order.Status.PAID
+        order.save()
+        self.assertEqual(self.sold(shirt), 2)
+
+        # As the OrderItem admin does: lines are loaded without their order
+        line = OrderItem.objects.get(pk=line.pk)
+        line.amount = 5
+        line.save()
+        self.assertEqual(self.sold(shirt), 5)
+        line.item = hat
+        line.save()
+        self.assertEqual((self.sold(shirt), self.sold(hat)), (0, 5))
+        OrderItem.objects.create(order=order, item=shirt, amount=1)
+        self.assertEqual(self.sold(shirt), 1)
+        OrderItem.objects.get(pk=line.pk).delete()
+        self.assertEqual((self.sold(shirt), self.sold(hat)), (1, 0))
+
+        # The incremental updates match a rebuild
+        ItemSalesSummary.rebuild()
+        self.assertEqual((self.sold(shirt), self.sold(hat)), (1, 0))
+
+    def test_cart_lines_do_not_count(self):
+        shirt, = self.create_items(1)
+        cart = Order.objects.create(user=self.customer, status=Order.Status.IN_CART)
+        line = OrderItem.objects.create(order=cart, item=shirt, amount=2)
+        line.amount = 3
+        line.save()
+        line.delete()
+        self.assertFalse(ItemSalesSummary.objects.exists())
+
+
+class PictureFileReferenceTests(ShopTestCase):
+    def test_shared_files_are_deleted_with_their_last_picture(self):
+        item, = self.create_items(1)
+        picture = item.pictures.get()
+        names = picture.rendition_names()
+        self.assertTrue(names)
+        self.assertEqual(set(picture.rendition_files.values_list('name', flat=True)), names)
+        # A colour variant's copy shares the files
+        copy = Picture.objects.create(item=item, picture=picture.picture.name, thumbnail=picture.thumbnail.name,
+                                      square_image=picture.square_image.name, renditions=picture.renditions,
+                                      position=1)
+        storage = picture_storage()
+
+        picture.delete()
+        self.assertTrue(all(storage.exists(name) for name in names))
+        copy.delete()
+        self.assertFalse(any(storage.exists(name) for name in names))
+
+    def test_references_match_whole_names(self):
+        item, = self.create_items(1)
+        name = next(iter(item.pictures.get().rendition_names()))
+        self.assertTrue(Picture.is_referenced(name))
+        self.assertFalse(Picture.is_referenced(name[:-1]))
+        self.assertFalse(Picture.is_referenced(name.rsplit('/', 1)[0]))
+
+    def test_regenerated_renditions_replace_the_rows(self):
+        item, = self.create_items(1)
+        picture = item.pictures.get()
+        picture.renditions = {'webp': {'400': 'item_pictures/renditions/00/new.webp'}}
+        picture.save(update_fields=['renditions'])
+        self.assertEqual(list(picture.rendition_files.values_list('name', flat=True)),
+                         ['item_pictures/renditions/00/new.webp'])
+
+
+class CheckoutQueryCountTests(ShopTestCase):
+    """The cart order and its items are loaded once per request (request.cart), however often views ask"""
+
+    def setUp(self):
+        super().setUp()
+        Issuer.objects.create(name='UFO Shop', address='Street 1', city='Prague', postal_code='11000', is_default=True)
+        self.location = Location.objects.create(name='Office', merchandiser=self.merchandiser, is_universal=True)
+        self.cart = Order.objects.create(user=self.customer, status=Order.Status.IN_CART)
+        for item in self.create_items(4):
+            OrderItem.objects.create(order=self.cart, item=item, amount=2)
+        self.client.force_login(self.customer)
+        # Count the requests of a session that has already made one
+        self.client.get(reverse('cart'))
+
+    def assertCartLoaded(self, queries, order_loads=1, item_loads=1):
+        sql = [query['sql'] for query in queries.captured_queries]
+        cart_loads = [q for q in sql if q.startswith('SELECT') and 'FROM "ufo_shop_order"' in q
+                      and '"ufo_shop_order"."status" = 1' in q]
+        items = [q for q in sql if q.startswith('SELECT') and 'FROM "ufo_shop_orderitem"' in q]
+        self.assertEqual(len(cart_loads), order_loads, cart_loads)
+        self.assertEqual(len(items), item_loads, items)
+
+    def test_checkout_page(self):
+        with CaptureQueriesContext(connection) as queries, self.assertNumQueries(CHECKOUT_GET_QUERIES):
+            response = self.client.get(reverse('checkout'))
+        self.assertEqual(response.status_code, 200)
+        self.assertCartLoaded(queries)
+
+    def test_place_order(self):
+        data = {'contact_email': 'customer@example.cz', 'contact_phone': '2', 'payment_method': 'qr_code'}
+        for order_item in self.cart.orderitem_set.all():
+            data[f'pickup_location_{order_item.id}'] = self.location.pk
+
+        with CaptureQueriesContext(connection) as queries, self.assertNumQueries(CHECKOUT_POST_QUERIES):
+            response = self.client.post(reverse('checkout'), data)
+        self.assertRedirects(response, reverse('order_confirmation', kwargs={'pk': self.cart.pk}),
+                             fetch_redirect_response=False)
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.status, Order.Status.ORDERED)
+        # update_count() looks for a new cart once the order left it, and finds none
+        self.assertCartLoaded(queries, order_loads=2)
+
+
+class DownloadInvoiceTests(ShopTestCase):
+    """Conditional GETs, byte ranges and offloading of invoice downloads (ufo_shop/downloads.py)"""
+    pdf_content = b'%PDF-1.4\n' + bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        issuer = Issuer.objects.create(name='UFO Shop', address='Street 1', city='Prague', postal_code='11000',
+                                       is_default=True)
+        self.order = Order.objects.create(user=self.customer, status=Order.Status.ORDERED, total=100,
+                                          contact_email='customer@example.cz')
+        self.invoice = Invoice.for_order(self.order, issuer)
+        self.invoice.pdf_file.save('invoice.pdf', ContentFile(self.pdf_content), save=False)
+        self.invoice.pdf_status = Invoice.PdfStatus.READY
+        self.invoice.pdf_fingerprint = 'a' * 64
+        self.invoice.save()
+        self.url = reverse('download_invoice', kwargs={'order_id': self.order.pk})
+        self.client.force_login(self.customer)
+
+    def test_full_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.pdf_content)
+        self.assertEqual(response['Content-Length'], str(len(self.pdf_content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], f'"{self.invoice.pdf_etag}"')
+        self.assertIn('Last-Modified', response)
+        self.assertIn('attachment;', response['Content-Disposition'])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_since(self):
+        last_modified = self.client.get(self.url)['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        size = len(self.pdf_content)
+        for header, start, end in [('bytes=0-99', 0, 99), ('bytes=100-', 100, size - 1),
+                                   ('bytes=-50', size - 50, size - 1), (f'bytes=10-{size * 2}', 10, size - 1)]:
+            with self.subTest(header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b''.join(response.streaming_content), self.pdf_content[start:end + 1])
+                self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+                self.assertEqual(response['Content-Length'], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        size = len(self.pdf_content)
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+
+    def test_multiple_ranges_get_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.pdf_content)
+
+    def test_if_range(self):
+        first = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=first['ETag'])
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 206)
+        # The PDF changed since: the whole new file instead of a piece of it
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.pdf_content)
+
+    @override_settings(INVOICE_DOWNLOAD_OFFLOAD='x-accel-redirect', INVOICE_DOWNLOAD_ACCEL_PREFIX='/protected-media/')
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.invoice.pdf_file.name}')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('attachment;', response['Content-Disposition'])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    @override_settings(INVOICE_DOWNLOAD_OFFLOAD='x-sendfile')
+    def test_sendfile(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], self.invoice.pdf_file.path)
+        self.assertEqual(response.content, b'')
+
+    def test_other_users_order(self):
+        self.client.force_login(self.merchandiser)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class MergedInvoiceExportTests(ShopTestCase):
+    """iter_merged_pdf() copies the invoices' pages into one document as it goes (ufo_shop/pdf_merge.py)"""
+
+    def invoice_with_pdf(self, issuer, pages):
+        from pypdf import PdfWriter
+
+        writer = PdfWriter()
+        for width in range(pages):
+            writer.add_blank_page(width=200 + width, height=300)
+        content = BytesIO()
+        writer.write(content)
+        order = Order.objects.create(user=self.customer, status=Order.Status.ORDERED, total=100)
+        invoice = Invoice.for_order(order, issuer)
+        invoice.pdf_file.save('invoice.pdf', ContentFile(content.getvalue()), save=False)
+        invoice.pdf_status = Invoice.PdfStatus.READY
+        invoice.save()
+        return invoice
+
+    def test_merged_pdf(self):
+        from pypdf import PdfReader
+
+        issuer = Issuer.objects.create(name='UFO Shop', address='Street 1', city='Prague', postal_code='11000',
+                                       is_default=True)
+        invoices = [self.invoice_with_pdf(issuer, pages) for pages in (1, 2, 1)]
+
+        chunks = list(invoice_pdf.iter_merged_pdf(iter(invoices)))
+        # Written per invoice, not all at once
+        self.assertGreaterEqual(len(chunks), len(invoices))
+        merged = PdfReader(BytesIO(b''.join(chunks)), strict=True)
+        self.assertEqual([int(page.mediabox.width) for page in merged.pages], [200, 200, 201, 200])
+        self.assertEqual([item.title for item in merged.outline], [invoice.invoice_number for invoice in invoices])
+        self.assertEqual([merged.get_destination_page_number(item) for item in merged.outline], [0, 1, 3])
+
+@override_settings(EMAIL_OUTBOX_RETRY_DELAY=60, EMAIL_OUTBOX_MAX_RETRY_DELAY=3600, EMAIL_OUTBOX_MAX_ATTEMPTS=3)
+class OutgoingEmailTests(ShopTestCase):
+    """The email outbox, sent by tasks.process_outgoing_emails() through the locmem backend"""
+
+    def send_failing(self, exception=smtplib.SMTPException('Mailbox unavailable')):
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=exception):
+            return tasks.process_outgoing_emails()
+
+    def make_due(self):
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+
+    def assertNextAttemptIn(self, email, seconds, before):
+        self.assertGreaterEqual(email.next_attempt_at, before + timedelta(seconds=seconds))
+        self.assertLessEqual(email.next_attempt_at, timezone.now() + timedelta(seconds=seconds))
+
+    def test_queue_is_idempotent(self):
+        email = queue_welcome_email(self.customer)
+        self.assertEqual(queue_welcome_email(self.customer), email)
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+        tasks.process_outgoing_emails()
+        queue_welcome_email(self.customer)
+        self.assertEqual(tasks.process_outgoing_emails(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_send(self):
+        queue_welcome_email(self.customer)
+        self.assertEqual(tasks.process_outgoing_emails(), 1)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.customer.email])
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.Status.SENT)
+        self.assertEqual(email.attempts, 1)
+        self.assertIsNotNone(email.sent_at)
+
+    def test_retry_backoff(self):
+        queue_welcome_email(self.customer)
+        for attempts, delay in [(1, 60), (2, 120)]:
+            before = timezone.now()
+            self.send_failing()
+            email = OutgoingEmail.objects.get()
+            self.assertEqual(email.status, OutgoingEmail.Status.PENDING)
+            self.assertEqual(email.attempts, attempts)
+            self.assertIn('Mailbox unavailable', email.last_error)
+            self.assertNextAttemptIn(email, delay, before)
+            # Not due before its next attempt
+            self.assertEqual(tasks.process_outgoing_emails(), 0)
+            self.make_due()
+
+        tasks.process_outgoing_emails()
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.Status.SENT)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_dead_letter(self):
+        queue_welcome_email(self.customer)
+        for _ in range(2):
+            self.send_failing()
+            self.make_due()
+        with self.assertLogs('ufo_shop.tasks', 'ERROR'):
+            self.send_failing()
+
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.Status.FAILED)
+        self.assertEqual(email.attempts, 3)
+        self.assertEqual(tasks.process_outgoing_emails(), 0)
+
+        # Sending it again from the admin queues it anew
+        OutgoingEmail.queue('welcome', self.customer, email.context, resend=True)
+        tasks.process_outgoing_emails()
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.Status.SENT)
+
+    def test_deleted_target_fails_permanently(self):
+        order = Order.objects.create(user=self.customer, status=Order.Status.ORDERED, total=100,
+                                     contact_email='customer@example.cz')
+        queue_order_confirmation_email(order)
+        order.delete()
+        with self.assertLogs('ufo_shop.tasks', 'ERROR'):
+            tasks.process_outgoing_emails()
+
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.Status.FAILED)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('no longer exists', email.last_error)
+        self.assertEqual(mail.outbox, [])
+
+    @override_settings(DEFAULT_FROM_EMAIL='')
+    def test_build_error_fails_permanently(self):
+        notify_admins_merchandiser_request(self.customer)
+        with mock.patch('ufo_shop.utils.emailing.render_email_template', return_value=''), \
+                self.assertLogs('ufo_shop.tasks', 'ERROR'):
+            tasks.process_outgoing_emails()
+
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.Status.FAILED)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('DEFAULT_FROM_EMAIL', email.last_error)
+
+    def test_unreachable_server_keeps_attempts(self):
+        queue_welcome_email(self.customer)
+        for _ in range(5):
+            before = timezone.now()
+            with mock.patch('django.core.mail.backends.locmem.EmailBackend.open',
+                            side_effect=ConnectionRefusedError('Connection refused')), \
+                    self.assertLogs('ufo_shop.tasks', 'WARNING'):
+                tasks.process_outgoing_emails()
+            email = OutgoingEmail.objects.get()
+            self.assertEqual(email.status, OutgoingEmail.Status.PENDING)
+            self.assertEqual(email.attempts, 0)
+            self.assertNextAttemptIn(email, 60, before)
+            self.make_due()
+
+        tasks.process_outgoing_emails()
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.Status.SENT)
+
+    @override_settings(DEBUG=True)
+    def test_debug_prints_to_console(self):
+        queue_welcome_email(self.customer)
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            tasks.process_outgoing_emails()
+
+        self.assertEqual(mail.outbox, [])
+        self.assertIn(f'To: {self.customer.email}', stdout.getvalue())
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.Status.SENT)
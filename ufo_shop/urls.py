@@ -43,6 +43,10 @@ urlpatterns = [
     path('item/<int:pk>/', views.ItemDetailView.as_view(), name='item-detail'),
     path('merchandiser_shop/', views.MerchandiserShopView.as_view(), name='merchandiser_shop'),
 
+    # Picture renditions rendered on demand; must be routed here before the web server's /media/ alias
+    path('media/r/<int:picture_id>/<int:width>x<int:height>.<str:extension>',
+         views.PictureRenditionView.as_view(), name='picture-rendition'),
+
     # Items CRUD for Merchandisers
     path('item/create/', views.ItemCreateView.as_view(), name='item-create'), # New URL for creating items
     path('item/<int:pk>/edit/', views.ItemUpdateView.as_view(), name='item-edit'),   # New URL for editing items
@@ -53,6 +57,7 @@ urlpatterns = [
     path('cart/update/', views.UpdateCartView.as_view(), name='update_cart'),
     path('checkout/', views.CheckoutView.as_view(), name='checkout'),
     path('order/<int:pk>/confirmation/', views.OrderConfirmationView.as_view(), name='order_confirmation'),
+    path('order/<int:pk>/payment-qr.png', views.OrderPaymentQRView.as_view(), name='order_payment_qr'),
     path('order/<int:order_id>/invoice/download/', views.DownloadInvoiceView.as_view(), name='download_invoice'),
     path('orders/', views.OrderHistoryView.as_view(), name='orders'),
 
@@ -1,7 +1,7 @@
 from typing import Dict, Any, Sequence, Optional
 
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import get_connection, send_mail
 from django.urls import reverse
 
 from django.template.loader import render_to_string
@@ -93,23 +93,42 @@ def send_template_email(
     ufoshop_send_email(recipient_list, subject, html_message, plain_message)
 
 
-def notify_admins_merchandiser_request(user, request=None):
-    """Notify admins that a user requested merchandiser permission.
+def _message(subject, to, html_message, plain_message=None):
+    """EmailMultiAlternatives with the HTML and plain text (if None, generated from HTML) versions"""
+    msg = EmailMultiAlternatives(
+        subject=subject,
+        body=plain_message if plain_message is not None else strip_tags(html_message),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=to,
+    )
+    msg.attach_alternative(html_message, 'text/html')
+    return msg
 
-    Includes a direct link to the Django admin user change page.
-    """
-    # Resolve admin URL for user change
-    admin_path = reverse('admin:ufo_shop_user_change', args=[user.id])
-    try:
-        admin_url = request.build_absolute_uri(admin_path) if request else admin_path
-    except Exception:
-        admin_url = admin_path
 
-    subject = 'Žádost o oprávnění merchandisera'
+def outbox_connection():
+    """Mail connection of the outbox: the console with DEBUG, like ufoshop_send_email(), else EMAIL_BACKEND"""
+    if settings.DEBUG:
+        return get_connection('django.core.mail.backends.console.EmailBackend')
+    return get_connection()
+
+
+# Emails sent by `manage.py run_worker` from the outbox (ufo_shop.models.OutgoingEmail).
+# Each builder takes the email's target object and the context stored when it was queued
+# and returns the message to send.
+
+def build_welcome_email(user, context):
+    html_message = render_email_template('ufo_shop/email/welcome.html', {
+        'user': user,
+        'profile_url': context['profile_url'],
+        'shop_url': context['shop_url'],
+    })
+    return _message('Vítejte v UFO Shopu!', [user.email], html_message)
+
 
+def build_merchandiser_request_email(user, context):
     context = {
         'user': user,
-        'admin_url': admin_url,
+        'admin_url': context['admin_url'],
     }
 
     # Render nicer email using templates
@@ -117,58 +136,23 @@ def notify_admins_merchandiser_request(user, request=None):
     plain_message = render_email_template('ufo_shop/email/merchandiser_request.txt', context)
 
     # Requirement: use only DEFAULT_FROM_EMAIL – send to this address
-    recipient = getattr(settings, 'DEFAULT_FROM_EMAIL', '')
-    recipient_list = [recipient] if recipient else []
-
-    if not recipient_list:
-        # Fallback: just print via debug helper
-        return ufoshop_send_email(
-            recipient_list=['devnull@example.com'],
-            subject=subject,
-            html_message=html_message,
-            plain_message=plain_message,
-        )
-
-    msg = EmailMultiAlternatives(
-        subject=subject,
-        body=plain_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=recipient_list,
-    )
-    msg.attach_alternative(html_message, 'text/html')
-    msg.send(fail_silently=False)
+    if not settings.DEFAULT_FROM_EMAIL:
+        raise ValueError("DEFAULT_FROM_EMAIL is not set")
+    return _message('Žádost o oprávnění merchandisera', [settings.DEFAULT_FROM_EMAIL], html_message, plain_message)
 
 
-def send_order_confirmation_email(order, request=None):
-    """Send order confirmation email with optional inline QR code, reusable from views and admin.
-
-    Args:
-        order: Order instance
-        request: Optional HttpRequest to build absolute URLs
-    """
-    from django.urls import reverse
-    from django.template.loader import render_to_string
-    from django.core.mail import EmailMultiAlternatives
+def build_order_confirmation_email(order, context):
+    """Order confirmation email with an inline payment QR code for QR payments"""
     from email.mime.image import MIMEImage
-    from django.conf import settings
-
-    # Items and URL
-    items = order.orderitem_set.all().select_related('item')
-    try:
-        order_url = request.build_absolute_uri(
-            reverse('order_confirmation', kwargs={'pk': order.id})
-        ) if request else reverse('order_confirmation', kwargs={'pk': order.id})
-    except Exception:
-        order_url = reverse('order_confirmation', kwargs={'pk': order.id})
 
     # BANK_ACCOUNT imported from models to avoid circular import of views
     from ufo_shop.models import BANK_ACCOUNT
 
     context = {
         'order': order,
-        'items': items,
+        'items': order.orderitem_set.all().select_related('item'),
         'user': order.user,
-        'order_url': order_url,
+        'order_url': context['order_url'],
         'BANK_ACCOUNT': BANK_ACCOUNT,
     }
 
@@ -190,19 +174,59 @@ def send_order_confirmation_email(order, request=None):
     context_with_qr = {**context, 'qr_cid': qr_cid} if qr_cid else context
     html_message = render_to_string('ufo_shop/email/order_confirmation.html', context_with_qr)
 
-    # Build and send
-    msg = EmailMultiAlternatives(
-        subject='Potvrzení objednávky',
-        body=plain_message,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=[order.contact_email],
-    )
-    msg.attach_alternative(html_message, 'text/html')
-
+    msg = _message('Potvrzení objednávky', [order.contact_email], html_message, plain_message)
     if qr_cid and qr_bytes:
         image = MIMEImage(qr_bytes, _subtype='png')
         image.add_header('Content-ID', f'<{qr_cid}>')
         image.add_header('Content-Disposition', 'inline', filename=f'order_{order.id}_qr.png')
         msg.attach(image)
+    return msg
+
+
+EMAIL_BUILDERS = {
+    'welcome': build_welcome_email,
+    'merchandiser_request': build_merchandiser_request_email,
+    'order_confirmation': build_order_confirmation_email,
+}
+
+
+def _absolute_url(request, path):
+    try:
+        return request.build_absolute_uri(path) if request else path
+    except Exception:
+        return path
+
+
+def queue_welcome_email(user, request=None):
+    """Queue the welcome email of a newly signed up user"""
+    from ufo_shop.models import OutgoingEmail
+
+    return OutgoingEmail.queue('welcome', user, {
+        'profile_url': _absolute_url(request, reverse('profile')),
+        'shop_url': _absolute_url(request, reverse('shop')),
+    })
+
+
+def notify_admins_merchandiser_request(user, request=None):
+    """Queue an email notifying admins that a user requested merchandiser permission.
+
+    Includes a direct link to the Django admin user change page.
+    """
+    from ufo_shop.models import OutgoingEmail
+
+    admin_path = reverse('admin:ufo_shop_user_change', args=[user.id])
+    return OutgoingEmail.queue('merchandiser_request', user, {'admin_url': _absolute_url(request, admin_path)})
+
+
+def queue_order_confirmation_email(order, request=None, resend=False):
+    """Queue the order confirmation email, reusable from views and admin.
+
+    Args:
+        order: Order instance
+        request: Optional HttpRequest to build absolute URLs
+        resend: Send it again if it was sent already
+    """
+    from ufo_shop.models import OutgoingEmail
 
-    msg.send(fail_silently=False)
+    order_url = _absolute_url(request, reverse('order_confirmation', kwargs={'pk': order.id}))
+    return OutgoingEmail.queue('order_confirmation', order, {'order_url': order_url}, resend=resend)
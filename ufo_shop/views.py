@@ -1,4 +1,3 @@
-from django.template.loader import render_to_string
 from django.views import View
 from django.conf import settings
 # Import UpdateView
@@ -8,16 +7,25 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib import messages
 from django.utils import timezone
-from django.http import HttpResponseRedirect, HttpResponse
-from django.db.models import Count, Sum, F, Q
+from django.http import HttpResponseRedirect, HttpResponse, Http404, FileResponse
+from django.db.models import Count, Exists, OuterRef, Sum, F, Q
 from ufo_shop.models import News
 from django.db.models.functions import TruncMonth, TruncDay
 
 from ufo_shop import forms
-from ufo_shop.models import Item, Category, Picture, Order, OrderItem, Invoice, BANK_ACCOUNT
+from ufo_shop.models import Item, ItemSalesSummary, Category, Picture, Order, OrderItem, Invoice, BANK_ACCOUNT, \
+    PICTURE_PENDING_PLACEHOLDER
 from django.contrib.auth.views import LoginView, LogoutView
 from django.urls import reverse_lazy, reverse
-from ufo_shop.utils.emailing import ufoshop_send_email, send_order_confirmation_email
+from ufo_shop.utils.emailing import queue_order_confirmation_email, queue_welcome_email
+from ufo_shop import caching, downloads, imaging, renditions
+from ufo_shop.pagination import CachedCountPaginator, cached_count, paginate_by_cursor
+from django.core.cache import cache
+from django.templatetags.static import static
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
 
 
 # Error handlers
@@ -57,17 +65,8 @@ class SignUpView(CreateView):
         response = super().form_valid(form)
         user = self.object
 
-        profile_url = self.request.build_absolute_uri(reverse_lazy('profile'))
-        shop_url = self.request.build_absolute_uri(reverse_lazy('shop'))
-        ufoshop_send_email(
-            subject='Vítejte v UFO Shopu!',
-            html_message=render_to_string('ufo_shop/email/welcome.html', {
-                'user': user,
-                'profile_url': profile_url,
-                'shop_url': shop_url
-            }),
-            recipient_list=[user.email],
-        )
+        # Sent by `manage.py run_worker`, SMTP never slows down the signup
+        queue_welcome_email(user, request=self.request)
         return response
 
 
@@ -92,13 +91,10 @@ class ProfileView(LoginRequiredMixin, View):
         else:
             user.merchandiser_request_at = timezone.now()
             user.save(update_fields=['merchandiser_request_at'])
-            # send email to admins
+            # send email to admins (queued for `manage.py run_worker`)
             from ufo_shop.utils.emailing import notify_admins_merchandiser_request
-            try:
-                notify_admins_merchandiser_request(user, request=request)
-                messages.success(request, "Žádost o oprávnění merchandisera byla odeslána administrátorům.")
-            except Exception:
-                messages.warning(request, "Žádost byla zaznamenána, ale nepodařilo se odeslat e-mail administrátorům.")
+            notify_admins_merchandiser_request(user, request=request)
+            messages.success(request, "Žádost o oprávnění merchandisera byla odeslána administrátorům.")
         return redirect('profile')
 
 class MerchandiserSignupView(LoginRequiredMixin,View):
@@ -111,13 +107,45 @@ class MerchandiserSignupView(LoginRequiredMixin,View):
     # def post(self, request):
     pass
 
-class HomeView(View):
+class CatalogPageCacheMixin:
+    """Serve whole pages from the cache for anonymous visitors.
+    Cached pages are keyed by language, full path and the versions of `page_cache_scopes`.
+    """
+    page_cache_scopes = (caching.CATALOG,)
+
+    def dispatch(self, request, *args, **kwargs):
+        if not caching.is_page_cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = caching.page_cache_key(request, self.page_cache_scopes)
+        content = cache.get(key)
+        if content is not None:
+            return HttpResponse(caching.fill_csrf_token(content, request))
+
+        request.is_page_cache_render = True
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+        finally:
+            request.is_page_cache_render = False
+        if response.streaming:
+            return response
+
+        content = response.content.decode(response.charset)
+        # Pictures are finished by the worker, whose version bumps a per-process cache never sees
+        if response.status_code == 200 and static(PICTURE_PENDING_PLACEHOLDER) not in content:
+            cache.set(key, content, settings.CATALOG_PAGE_CACHE_TIMEOUT)
+        response.content = caching.fill_csrf_token(content, request)
+        return response
+
+
+class HomeView(CatalogPageCacheMixin, View):
+    page_cache_scopes = (caching.CATALOG, caching.HOME)
+
     def get(self, request, *args, **kwargs):
-        # Get top selling items
-        # We'll use OrderItem to find the most sold items
-        top_items = Item.objects.filter(is_active=True).annotate(
-            total_sold=Count('orderitem')
-        ).order_by('-total_sold')[:6]  # Get top 6 items
+        # Get top 6 selling items from the precomputed leaderboard
+        top_items = ItemSalesSummary.top_items(limit=6)
 
         # Get latest news
         latest_news = News.objects.filter(is_active=True).order_by('-published_at')[:5]  # Get latest 5 news items
@@ -128,11 +156,15 @@ class HomeView(View):
         })
 
 
-class ItemListView(ListView):
+class ItemListView(CatalogPageCacheMixin, ListView):
     model = Item
     template_name = 'ufo_shop/shop.html'  # Specify the template
     context_object_name = 'item_list'
     paginate_by = 12
+    ordering = ('-created_at', '-pk')
+    paginator_class = CachedCountPaginator
+    # 'cursor' (keyset on created_at, id) or 'offset' (numbered pages)
+    pagination_mode = settings.SHOP_PAGINATION_MODE
 
     def get_queryset(self):
         # Only active items that are not variants (we'll show variants on the detail page)
@@ -147,16 +179,25 @@ class ItemListView(ListView):
         # if user:
         #     queryset = queryset.filter(merchandiser__id=user)
 
-        return queryset.distinct()
+        return queryset.distinct().for_cards()
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.pagination_mode != 'cursor':
+            return super().paginate_queryset(queryset, page_size)
+        page = paginate_by_cursor(queryset, page_size, self.request.GET.get('cursor'))
+        return None, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context['pagination_mode'] = self.pagination_mode
+        context['item_list'] = context['object_list'] = caching.prime_card_versions(context['object_list'])
+        context['total_count'] = cached_count(self.object_list)
         context['categories'] = Category.objects.all()  # Pass categories to the template
         # context['users'] = User.objects.filter(item__isnull=False, is_staff=True).distinct()  # Merchandisers with items
         return context
 
 
-class ItemDetailView(DetailView):
+class ItemDetailView(CatalogPageCacheMixin, DetailView):
     model = Item
     template_name = 'ufo_shop/item_detail.html'
     context_object_name = 'item'
@@ -180,7 +221,8 @@ class ItemDetailView(DetailView):
             is_variant=False  # Only show parent items as related
         ).exclude(id=self.object.id).exclude(
             variants__id=self.object.id  # Exclude items that this item is a variant of
-        )[:6]
+        ).for_cards()[:6]
+        context['related_items'] = caching.prime_card_versions(context['related_items'])
 
         context['categories'] = Category.objects.all()
 
@@ -208,6 +250,34 @@ class ItemDetailView(DetailView):
         return self.render_to_response(context)
 
 
+class PictureRenditionView(View):
+    """Serve a picture rendition, rendering it on its first request (see ufo_shop/renditions.py)"""
+    # Renditions never change under the same ETag, browsers and proxies may keep them for a year
+    max_age = 60 * 60 * 24 * 365
+
+    def get(self, request, picture_id, width, height, extension):
+        img_format = renditions.format_for_extension(extension)
+        if img_format is None or not renditions.is_allowed_size(width, height):
+            raise Http404("Unsupported rendition")
+        picture = get_object_or_404(Picture.objects.only('picture'), pk=picture_id)
+        if not picture.picture:
+            raise Http404("Picture has no original")
+
+        key = renditions.rendition_key(picture.picture.name, width, height, img_format)
+        etag = f'"{key}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            rendition_cache = renditions.RenditionCache()
+            path = rendition_cache.get(key, extension) or rendition_cache.put(
+                key, extension, renditions.render(picture, width, height, img_format)
+            )
+            response = FileResponse(open(path, 'rb'),
+                                    content_type=imaging.RENDITION_FORMATS[img_format]['mime_type'])
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=self.max_age, immutable=True)
+        return response
+
+
 class MerchandiserShopView(LoginRequiredMixin, ListView):
     model = Item
     template_name = 'ufo_shop/merchandiser_shop.html'
@@ -257,12 +327,20 @@ class MerchandiserShopView(LoginRequiredMixin, ListView):
 
 
 # Base class for item form views
+@method_decorator(csrf_exempt, name='dispatch')
 class ItemFormViewBase(LoginRequiredMixin):
     model = Item
     form_class = forms.ItemForm
     template_name = 'ufo_shop/item_form.html'
     success_url = reverse_lazy('merchandiser_shop')
 
+    def dispatch(self, request, *args, **kwargs):
+        # Stream uploaded pictures to a temporary file, however small, instead of keeping them in memory.
+        # Upload handlers can only be replaced before request.POST is read, so the CSRF check
+        # runs here instead of in the middleware.
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return csrf_protect(super().dispatch)(request, *args, **kwargs)
+
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['user'] = self.request.user
@@ -297,35 +375,28 @@ class ItemFormViewBase(LoginRequiredMixin):
                 form.instance.parent_item = None
                 form.instance.is_variant = False
 
-    def _handle_image_uploads(self, is_variant_of=None, is_create=True):
+    def _handle_image_uploads(self, image_files, is_variant_of=None, is_create=True):
         """Handle image uploads and copying from parent item"""
-        # Debug logging
-        print("DEBUG: request.FILES:", self.request.FILES)
-        print("DEBUG: request.POST:", self.request.POST)
-
-        # Handle single image upload
-        image_file = self.request.FILES.get('images')  # 'images' is the name of the form field
-        print("DEBUG: image:", image_file)
-        if image_file:
-            Picture.objects.create(
-                item=self.object, 
-                user=self.request.user, 
-                picture=image_file
-            )
-            # The Picture model's save() method will handle thumbnails/squares
+        # Handle the uploaded images (the validated, possibly downsized, 'images' form field)
+        if image_files:
+            # One insert for all pictures, derivatives are generated as a batch
+            Picture.create_batch(self.object, image_files, user=self.request.user)
 
         # If parent item has images and this is a variant with no images, copy parent images
-        has_images = image_file if is_create else self.object.pictures.exists()
+        has_images = image_files if is_create else self.object.pictures.exists()
         if is_variant_of and not has_images:
             parent_pictures = Picture.objects.filter(item=is_variant_of)
             for parent_pic in parent_pictures:
                 # Create a copy of the parent picture for this variant
                 # Only copy the thumbnail and square_image, as the original picture may have been deleted
+                # The copy shares the parent's stored files; they are deleted with the last picture using them
                 new_pic = Picture(
                     item=self.object,
                     user=self.request.user,
                     thumbnail=parent_pic.thumbnail,
-                    square_image=parent_pic.square_image
+                    square_image=parent_pic.square_image,
+                    renditions=parent_pic.renditions,
+                    position=parent_pic.position
                 )
                 # Only set the picture field if it exists in the parent
                 if parent_pic.picture:
@@ -349,7 +420,7 @@ class ItemCreateView(ItemFormViewBase, CreateView):
         self.object = form.save()
 
         # Handle image uploads
-        self._handle_image_uploads(is_variant_of, is_create=True)
+        self._handle_image_uploads(form.cleaned_data.get('images'), is_variant_of, is_create=True)
 
         # Use the success_url defined on the class
         return super().form_valid(form)
@@ -422,12 +493,28 @@ class ItemUpdateView(ItemFormViewBase, UpdateView):
         # Save the updated Item instance
         self.object = form.save()
 
+        # Apply the order of the existing images
+        positions = self._get_picture_positions()
+        if positions:
+            self.object.reorder_pictures(positions)
+
         # Handle image uploads
-        self._handle_image_uploads(is_variant_of, is_create=False)
+        self._handle_image_uploads(form.cleaned_data.get('images'), is_variant_of, is_create=False)
 
         # Use the success_url defined on the class
         return super().form_valid(form)
 
+    def _get_picture_positions(self):
+        """{picture id: position} from the position inputs of the existing images"""
+        positions = {}
+        for name, value in self.request.POST.items():
+            if name.startswith('picture_position_'):
+                try:
+                    positions[int(name[len('picture_position_'):])] = int(value)
+                except ValueError:
+                    continue
+        return positions
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['form_title'] = 'Edit Item'
@@ -442,13 +529,10 @@ class CartView(LoginRequiredMixin, View):
 
     def get(self, request):
         # Get or create an order with status IN_CART for the current user
-        cart, created = Order.objects.get_or_create(
-            user=request.user,
-            status=Order.Status.IN_CART
-        )
+        cart = request.cart.get_or_create()
 
         # Get all items in the cart
-        cart_items = cart.orderitem_set.all().select_related('item')
+        cart_items = request.cart.items
 
         # Create forms for updating quantities
         update_forms = []
@@ -460,7 +544,7 @@ class CartView(LoginRequiredMixin, View):
             update_forms.append((cart_item, form))
 
         # Calculate totals
-        cart.calculate_totals()
+        cart.calculate_totals(cart_items)
         cart.save()
 
         return render(request, 'ufo_shop/cart.html', {
@@ -481,14 +565,10 @@ class AddToCartView(LoginRequiredMixin, FormView):
         item = get_object_or_404(Item, id=item_id)
 
         # Get or create an order with status IN_CART for the current user
-        cart, created = Order.objects.get_or_create(
-            user=self.request.user,
-            status=Order.Status.IN_CART
-        )
+        cart = self.request.cart.get_or_create()
 
-        # Check if the item is already in the cart
-        order_item, created = OrderItem.objects.get_or_create(
-            order=cart,
+        # Check if the item is already in the cart (through the cart, so the line knows its order's status)
+        order_item, created = cart.orderitem_set.get_or_create(
             item=item,
             defaults={'amount': quantity}
         )
@@ -497,6 +577,7 @@ class AddToCartView(LoginRequiredMixin, FormView):
         if not created:
             order_item.amount += quantity
             order_item.save()
+        self.request.cart.update_count()
 
         messages.success(self.request, f'{item.name} added to your cart.')
 
@@ -518,10 +599,14 @@ class UpdateCartView(LoginRequiredMixin, FormView):
         quantity = form.cleaned_data['quantity']
 
         # Get the cart
-        cart = get_object_or_404(Order, user=self.request.user, status=Order.Status.IN_CART)
+        cart = self.request.cart.order
+        if cart is None:
+            raise Http404("No cart")
 
         # Get the order item
-        order_item = get_object_or_404(OrderItem, order=cart, item_id=item_id)
+        order_item = next((line for line in self.request.cart.items if line.item_id == item_id), None)
+        if order_item is None:
+            raise Http404("Item is not in the cart")
 
         # Update the quantity or remove if quantity is 0
         if quantity > 0:
@@ -533,7 +618,8 @@ class UpdateCartView(LoginRequiredMixin, FormView):
             messages.success(self.request, 'Item removed from cart.')
 
         # Recalculate totals
-        cart.calculate_totals()
+        self.request.cart.update_count()
+        cart.calculate_totals(self.request.cart.items)
         cart.save()
 
         return redirect('cart')
@@ -551,16 +637,14 @@ class CheckoutView(LoginRequiredMixin, FormView):
     def dispatch(self, request, *args, **kwargs):
         # Check if the cart is empty
         cart = self.get_cart()
-        if not cart or cart.orderitem_set.count() == 0:
+        if not cart or not request.cart.items:
             messages.warning(request, 'Your cart is empty. Please add items before checkout.')
             return redirect('shop')
         return super().dispatch(request, *args, **kwargs)
 
     def get_cart(self):
-        try:
-            return Order.objects.get(user=self.request.user, status=Order.Status.IN_CART)
-        except Order.DoesNotExist:
-            return None
+        # Loaded once per request by CartMiddleware
+        return self.request.cart.order
 
     def get_initial(self):
         # Pre-fill the form with user information
@@ -573,16 +657,15 @@ class CheckoutView(LoginRequiredMixin, FormView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         cart = self.get_cart()
-        cart.calculate_totals()
-        cart_items = cart.orderitem_set.all().select_related('item')
+        cart_items = self.request.cart.items
+        cart.calculate_totals(cart_items)
         context['cart'] = cart
         context['cart_items'] = cart_items
         return context
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        cart = self.get_cart()
-        kwargs['cart_items'] = cart.orderitem_set.all().select_related('item')
+        kwargs['cart_items'] = self.request.cart.items
         return kwargs
 
     def form_valid(self, form):
@@ -594,30 +677,31 @@ class CheckoutView(LoginRequiredMixin, FormView):
                 setattr(cart, field, form.cleaned_data[field])
 
         # Update the status to ORDERED
+        cart_items = self.request.cart.items
         cart.status = Order.Status.ORDERED
-        cart.calculate_totals()
+        cart.calculate_totals(cart_items)
         cart.save()
 
         # Update the pickup locations for each order item
-        cart_items = cart.orderitem_set.all()
         for item in cart_items:
             pickup_location = form.get_pickup_location(item.id)
             if pickup_location:
                 item.pickup_location = pickup_location
-                item.save()
+                item.save(update_fields=['pickup_location'])
+        self.request.cart.update_count()
 
-        # Create invoice for the order
-        invoice = Invoice.create_from_order(cart)
+        # Create invoice for the order; its PDF is generated in the background
+        Invoice.create_from_order(cart)
 
-        # Send order confirmation email
+        # Queue order confirmation email for the background worker
         self.send_order_confirmation(cart)
 
         # Redirect to order confirmation page
         return redirect('order_confirmation', pk=cart.id)
 
     def send_order_confirmation(self, order):
-        """Send order confirmation email using shared utility"""
-        send_order_confirmation_email(order, request=self.request)
+        """Queue order confirmation email using shared utility"""
+        queue_order_confirmation_email(order, request=self.request)
 
 
 class OrderConfirmationView(LoginRequiredMixin, DetailView):
@@ -645,28 +729,46 @@ class OrderConfirmationView(LoginRequiredMixin, DetailView):
         return context
 
 
+class OrderPaymentQRView(LoginRequiredMixin, View):
+    """PNG of the payment QR code of one of the user's orders"""
+
+    def get(self, request, pk):
+        order = get_object_or_404(Order, pk=pk, user=request.user)
+        etag = f'"{order.payment_qr_etag}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(order.get_payment_qr_png_bytes(), content_type='image/png')
+        response['ETag'] = etag
+        # The URL stays the same when the total or contact email change: browsers revalidate with the ETag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
 class OrderHistoryView(LoginRequiredMixin, ListView):
-    """View to display order history"""
+    """View to display order history.
+
+    Read only: orders without an invoice just show that it is being prepared, invoices
+    are created at checkout and missing ones by `manage.py backfill_invoices`.
+    """
     model = Order
     template_name = 'ufo_shop/order_history.html'
     context_object_name = 'orders'
+    paginate_by = 20
 
     def get_queryset(self):
         # Only show orders that are not in cart
-        orders = Order.objects.filter(
+        return Order.objects.filter(
             user=self.request.user
         ).exclude(
             status=Order.Status.IN_CART
-        ).order_by('-created_at')
-
-        # Ensure all orders have invoices
-        for order in orders:
-            # Check if order has an invoice
-            if not order.invoices.exists():
-                # Create invoice for the order
-                Invoice.create_from_order(order)
+        ).annotate(
+            has_invoice=Exists(Invoice.objects.filter(order=OuterRef('pk')))
+        )
 
-        return orders
+    def paginate_queryset(self, queryset, page_size):
+        # Keyset pagination: no COUNT and the same cost on every page
+        page = paginate_by_cursor(queryset, page_size, self.request.GET.get('cursor'))
+        return None, page, page.object_list, page.has_other_pages()
 
 
 class MerchandiserStatsView(LoginRequiredMixin, TemplateView):
@@ -730,23 +832,35 @@ class MerchandiserStatsView(LoginRequiredMixin, TemplateView):
 
 
 class DownloadInvoiceView(LoginRequiredMixin, View):
-    """View to download invoice PDF for an order"""
+    """View to download invoice PDF for an order.
 
-    def get(self, request, order_id):
-        # Get the order and ensure it belongs to the current user
-        order = get_object_or_404(Order, id=order_id, user=request.user)
+    Supports conditional GETs and byte ranges, and can leave sending the file to the
+    front-end server (INVOICE_DOWNLOAD_OFFLOAD), see ufo_shop/downloads.py.
+    """
 
-        # Get the latest invoice for the order
-        invoice = order.invoices.order_by('-created_at').first()
+    def get(self, request, order_id):
+        # Get the latest invoice of the order, which must belong to the current user
+        invoice = Invoice.objects.filter(order_id=order_id, order__user=request.user) \
+            .order_by('-created_at').first()
 
-        if not invoice or not invoice.pdf_file:
-            # If no invoice exists or PDF not generated, create one
+        if not invoice:
+            # If no invoice exists, create one
+            order = get_object_or_404(Order, id=order_id, user=request.user)
             invoice = Invoice.create_from_order(order)
 
-        # Prepare the response with the PDF file
-        from django.http import FileResponse
-        response = FileResponse(invoice.pdf_file, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="invoice_{invoice.invoice_number}.pdf"'
+        # Usually the worker has rendered the PDF already; otherwise render it now,
+        # or wait for the worker / another request that is rendering it
+        if not invoice.ensure_pdf():
+            messages.warning(request, 'The invoice PDF is not available yet. Please try again in a moment.')
+            return redirect('order_confirmation', pk=order_id)
+
+        response = downloads.serve_file(
+            request, invoice.pdf_file, 'application/pdf', f"invoice_{invoice.invoice_number}.pdf",
+            etag=f'"{invoice.pdf_etag}"', last_modified=invoice.updated_at,
+            offload=settings.INVOICE_DOWNLOAD_OFFLOAD, accel_prefix=settings.INVOICE_DOWNLOAD_ACCEL_PREFIX,
+        )
+        # Invoices are private; browsers revalidate them with the ETag
+        patch_cache_control(response, private=True, no_cache=True)
         return response
 
 